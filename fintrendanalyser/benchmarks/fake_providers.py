@@ -0,0 +1,199 @@
+"""
+Deterministic stand-ins for the external data providers, used by the benchmarks.
+
+Every generator is seeded from its arguments, so two runs at the same scale produce the same data.
+"""
+import datetime
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def _seed(*parts):
+    return int.from_bytes(hashlib.sha256(repr(parts).encode('utf-8')).digest()[:8], 'little')
+
+
+def generate_ohlcv(symbol, index, base_price=100.0, base_volume=1_000_000):
+    """
+    Generate a geometric random walk of OHLCV bars over an index.
+
+    Returns:
+        tuple: Open, high, low, close and volume arrays.
+    """
+    rng = np.random.default_rng(_seed(symbol, len(index)))
+    returns = rng.normal(0.0003, 0.015, len(index))
+    close = base_price * np.exp(np.cumsum(returns))
+    open_ = np.concatenate([[base_price], close[:-1]]) * (1 + rng.normal(0, 0.002, len(index)))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, len(index)))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, len(index)))
+    volume = rng.integers(base_volume // 2, base_volume * 2, len(index))
+    return open_, high, low, close, volume
+
+
+class FakeTicker:
+    """
+    Stand-in for yfinance.Ticker serving a fixed number of daily bars ending today.
+    """
+
+    def __init__(self, symbol, days=2500):
+        self.ticker = symbol
+        self.days = days
+
+    def history(self, period=None, start=None, end=None):
+        today = pd.Timestamp(datetime.date.today(), tz='America/New_York')
+        index = pd.bdate_range(end=today, periods=self.days, name='Date')
+        open_, high, low, close, volume = generate_ohlcv(self.ticker, index)
+        frame = pd.DataFrame({
+            'Open': open_,
+            'High': high,
+            'Low': low,
+            'Close': close,
+            'Volume': volume,
+            'Dividends': 0.0,
+            'Stock Splits': 0.0,
+        }, index=index)
+        if start is not None:
+            frame = frame[frame.index >= pd.Timestamp(start, tz='America/New_York')]
+        if end is not None:
+            frame = frame[frame.index < pd.Timestamp(end, tz='America/New_York')]
+        return frame
+
+
+class FakeTimeSeries:
+    """
+    Stand-in for alpha_vantage.timeseries.TimeSeries serving 1-minute bars.
+    """
+
+    def __init__(self, key=None, output_format='pandas', full_size=20000):
+        self.full_size = full_size
+
+    def get_intraday(self, symbol, interval='1min', outputsize='compact'):
+        size = 100 if outputsize == 'compact' else self.full_size
+        end = pd.Timestamp(datetime.date.today()) + pd.Timedelta(hours=16)
+        index = pd.date_range(end=end, periods=size, freq='min', name='date')
+        open_, high, low, close, volume = generate_ohlcv(symbol, index, base_volume=10_000)
+        frame = pd.DataFrame({
+            '1. open': open_,
+            '2. high': high,
+            '3. low': low,
+            '4. close': close,
+            '5. volume': volume.astype(float),
+        }, index=index)
+        return frame.iloc[::-1], {'2. Symbol': symbol, '4. Interval': interval}
+
+
+def generate_articles(query, count=100):
+    """
+    Generate NewsAPI "everything" articles for a query, a few of them removed or syndicated copies.
+
+    Returns:
+        list: Articles in the NewsAPI response layout.
+    """
+    rng = np.random.default_rng(_seed('news', query, count))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    articles = []
+    for number in range(count):
+        removed = rng.random() < 0.05
+        # Syndicated copies share the story id, and so the URL, of an earlier article
+        story = int(rng.integers(0, number + 1)) if rng.random() < 0.1 else number
+        published_at = now - datetime.timedelta(minutes=int(rng.integers(0, 60 * 24 * 7)))
+        articles.append({
+            'source': {'id': None, 'name': '[Removed]' if removed else f'Source {story % 17}'},
+            'title': '[Removed]' if removed else f'{query} story {story}: markets react to quarterly figures',
+            'description': '[Removed]' if removed else f'Analysts discuss what story {story} means for {query} investors.',
+            'url': f'https://news.example.com/{query.lower()}/{story}',
+            'publishedAt': published_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        })
+    return articles
+
+
+def generate_world_bank_payload(country_codes, indicator_code, first_year, last_year, page=1, per_page=50):
+    """
+    Generate a page of a World Bank indicator response, metadata followed by the observations.
+
+    Parameters:
+        country_codes (str): ISO3 country codes joined with ";".
+        indicator_code (str): Indicator code.
+        first_year (int): First year of the range.
+        last_year (int): Last year of the range.
+        page (int): Page number, from 1.
+        per_page (int): Observations per page.
+
+    Returns:
+        list: Payload in the World Bank JSON layout.
+    """
+    data = []
+    for country_code in country_codes.split(';'):
+        rng = np.random.default_rng(_seed('worldbank', country_code, indicator_code))
+        data.extend(
+            {
+                'indicator': {'id': indicator_code, 'value': f'Indicator {indicator_code}'},
+                'country': {'id': country_code[:2], 'value': f'Country {country_code}'},
+                'countryiso3code': country_code,
+                'date': str(year),
+                'value': float(rng.uniform(1e9, 1e13)),
+                'unit': '',
+                'obs_status': '',
+                'decimal': 0,
+            }
+            for year in range(last_year, first_year - 1, -1)
+        )
+    pages = max(1, -(-len(data) // per_page))
+    metadata = {'page': page, 'pages': pages, 'per_page': per_page, 'total': len(data)}
+    return [metadata, data[(page - 1) * per_page:page * per_page]]
+
+
+class FakeResponse:
+    """
+    Minimal requests.Response stand-in.
+    """
+
+    def __init__(self, payload, status_code=200):
+        self._payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeHttpApis:
+    """
+    Callable replacing requests.get, or a requests.Session, answering NewsAPI and World Bank URLs
+    with generated payloads.
+    """
+
+    def __init__(self, articles_per_query=100):
+        self.articles_per_query = articles_per_query
+        self.calls = 0
+
+    def __call__(self, url, params=None, **kwargs):
+        from urllib.parse import parse_qs, urlparse
+
+        self.calls += 1
+        parsed = urlparse(url)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        query.update(params or {})
+        if 'newsapi.org' in parsed.netloc:
+            articles = generate_articles(query.get('q', ''), self.articles_per_query)
+            return FakeResponse({'status': 'ok', 'totalResults': len(articles), 'articles': articles})
+        if 'worldbank.org' in parsed.netloc:
+            parts = parsed.path.strip('/').split('/')
+            country_code, indicator_code = parts[2], parts[4]
+            first_year, last_year = (int(year) for year in str(query.get('date', '2010:2020')).split(':'))
+            return FakeResponse(generate_world_bank_payload(
+                country_code, indicator_code, first_year, last_year,
+                page=int(query.get('page', 1)), per_page=int(query.get('per_page', 50))
+            ))
+        return FakeResponse({}, status_code=404)
+
+    def get(self, url, params=None, **kwargs):
+        """
+        Same as calling the fake, so it can also stand in for a requests.Session.
+        """
+        return self(url, params=params, **kwargs)
+
+    def close(self):
+        pass
@@ -0,0 +1,157 @@
+"""
+Cold-start import benchmark.
+
+Imports every module in a fresh interpreter and reports how long the import takes, and whether
+it had side effects: opening a database connection, loading .env, or importing one of the heavy
+clients that modules are expected to import lazily.
+
+Usage (from the fintrendanalyser directory):
+    python -m benchmarks.import_benchmark
+    python -m benchmarks.import_benchmark --save-baseline
+"""
+from utils.logging import setup_logger
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+logger = setup_logger(name='import_benchmark')
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'import_times.json')
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    'utils.database',
+    'utils.cache',
+    'utils.columnar_storage',
+    'utils.events',
+    'utils.pipeline',
+    'utils.profiling',
+    'utils.query_service',
+    'utils.rate_limiting',
+    'data_ingestion.fetch_historical_stock_data',
+    'data_ingestion.fetch_intraday_stock_data',
+    'data_ingestion.poll_intraday_stock_data',
+    'data_ingestion.fetch_financial_news',
+    'data_ingestion.fetch_economic_data',
+    'data_processing.transform_financial_news',
+    'data_processing.rollup_intraday_bars',
+    'data_processing.score_news_sentiment',
+    'data_processing.cluster_news_duplicates',
+    'data_processing.maintain_partitions',
+    'data_processing.compute_technical_indicators',
+    'data_processing.compute_risk_statistics',
+    'orchestrator',
+]
+
+# Modules that must only be imported once a job actually runs
+LAZY_MODULES = ['alpha_vantage', 'dotenv', 'pandas', 'pyarrow', 'requests', 'textblob', 'yfinance']
+
+# An import regresses when it is this much slower than the baseline, relatively and in seconds
+REGRESSION_TOLERANCE = 0.5
+REGRESSION_MIN_SECONDS = 0.02
+
+# Runs in the fresh interpreter; psycopg2 is imported up front so that connecting can be refused
+PROBE = '''
+import importlib, json, sys, time
+import psycopg2
+
+def refuse_connection(*args, **kwargs):
+    raise RuntimeError("connected to the database at import time")
+
+psycopg2.connect = refuse_connection
+start = time.perf_counter()
+error = None
+try:
+    importlib.import_module(sys.argv[1])
+except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "error": error,
+    "lazy_modules_loaded": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+'''
+
+
+def measure_import(module, runs):
+    """
+    Import a module in fresh interpreters.
+
+    Returns:
+        dict: Median import seconds, import error if any, and lazy modules loaded by the import.
+    """
+    samples = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, '-c', PROBE, module, *LAZY_MODULES],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {
+        'seconds': statistics.median(sample['seconds'] for sample in samples),
+        'error': samples[-1]['error'],
+        'lazy_modules_loaded': samples[-1]['lazy_modules_loaded'],
+    }
+
+
+def find_problems(results, baseline=None):
+    """
+    List import errors, side effects and regressions against the baseline.
+
+    Returns:
+        list: Human-readable description of every problem.
+    """
+    problems = []
+    for module, result in results.items():
+        if result['error']:
+            problems.append(f'{module}: import failed ({result["error"]})')
+        if result['lazy_modules_loaded']:
+            problems.append(f'{module}: imports {", ".join(result["lazy_modules_loaded"])} at import time')
+        reference = (baseline or {}).get(module)
+        if reference is not None and result['seconds'] > max(
+                reference['seconds'] * (1 + REGRESSION_TOLERANCE), reference['seconds'] + REGRESSION_MIN_SECONDS):
+            problems.append(f'{module}: import took {result["seconds"]:.3f}s, baseline {reference["seconds"]:.3f}s')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start import times and side effects.')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per module.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the baseline.')
+    args = parser.parse_args()
+
+    results = {}
+    for module in MODULES:
+        results[module] = measure_import(module, args.runs)
+        logger.info(f'{module}: {results[module]["seconds"] * 1000:.1f} ms')
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        logger.info(f'Saved baseline to "{BASELINE_PATH}".')
+        baseline = None
+    elif os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)
+    else:
+        baseline = None
+
+    problems = find_problems(results, baseline)
+    for problem in problems:
+        logger.warning(problem)
+    if problems:
+        sys.exit(1)
+    logger.info('No import-time side effect or regression.')
+
+
+if __name__ == "__main__":
+    main()
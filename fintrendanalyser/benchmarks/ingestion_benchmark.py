@@ -0,0 +1,334 @@
+"""
+Offline ingestion benchmark.
+
+Runs the real ingestion and processing code paths against deterministic fake providers and a local
+PostgreSQL database (configured with the usual DB_* variables), and reports rows/sec, database
+round-trips, peak RSS and per-stage latency. Point DB_NAME at a throwaway database: --reset drops
+the raw and processed schemas.
+
+Usage (from the fintrendanalyser directory):
+    python -m benchmarks.ingestion_benchmark --symbols 50 --days 2500 --reset
+    python -m benchmarks.ingestion_benchmark --symbols 50 --days 2500 --reset --save-baseline
+"""
+from benchmarks.fake_providers import FakeHttpApis, FakeTicker, FakeTimeSeries
+from utils.constants import DB_PROCESSED_DATA_SCHEMA, DB_RAW_DATA_SCHEMA
+from utils.database import forget_created_tables, get_db_params
+from utils.logging import setup_logger
+import argparse
+import collections
+import json
+import os
+import psycopg2
+import psycopg2.extensions
+import requests
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+
+logger = setup_logger(name='ingestion_benchmark')
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+# Relative change tolerated before a metric is reported as a regression
+REGRESSION_TOLERANCE = 0.2
+
+# World Bank panel of the economic ingestion stage: 120 countries, split over several multi-country requests
+ECONOMIC_COUNTRIES = [f'{first}{second}X' for first in 'ABCDEFGHIJ' for second in 'ABCDEFGHIJKL']
+ECONOMIC_INDICATORS = ['NY.GDP.MKTP.CD', 'FP.CPI.TOTL.ZG', 'SL.UEM.TOTL.ZS']
+
+# Metrics of the stage currently running
+_counters = collections.Counter()
+_latencies = collections.defaultdict(list)
+_counters_lock = threading.Lock()
+_original_connect = psycopg2.connect
+
+
+def _count(name, amount=1):
+    with _counters_lock:
+        _counters[name] += amount
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """
+    Cursor counting every statement sent to the server.
+    """
+
+    def execute(self, query, vars=None):
+        _count('round_trips')
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        _count('round_trips')
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        _count('round_trips')
+        return super().copy_expert(sql, file, size)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """
+    Connection handing out counting cursors and counting commits.
+    """
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        _count('round_trips')
+        _count('commits')
+        return super().commit()
+
+
+def _counting_connect(*args, **kwargs):
+    _count('connections')
+    kwargs.setdefault('connection_factory', CountingConnection)
+    return _original_connect(*args, **kwargs)
+
+
+def _timed(module, name):
+    """
+    Replace module.name with a wrapper recording the latency of each call under name.
+    """
+    function = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with _counters_lock:
+                _latencies[name].append(time.perf_counter() - start)
+
+    setattr(module, name, wrapper)
+
+
+def _counting_bulk_insert(module):
+    """
+    Wrap the bulk_insert_data of a module to count the rows passed through it.
+    """
+    function = module.bulk_insert_data
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        inserted, skipped = function(*args, **kwargs)
+        with _counters_lock:
+            _latencies['bulk_insert_data'].append(time.perf_counter() - start)
+            _counters['rows'] += inserted + skipped
+            _counters['rows_inserted'] += inserted
+        return inserted, skipped
+
+    module.bulk_insert_data = wrapper
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def reset_database():
+    connection = _original_connect(**get_db_params())
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {DB_RAW_DATA_SCHEMA} CASCADE')
+        cursor.execute(f'DROP SCHEMA IF EXISTS {DB_PROCESSED_DATA_SCHEMA} CASCADE')
+    connection.commit()
+    connection.close()
+    forget_created_tables()
+    logger.info('Dropped the raw and processed schemas.')
+
+
+def build_stages(args):
+    """
+    Import the ingestion modules with fake providers patched in.
+
+    Returns:
+        list: (stage name, callable) pairs, in execution order.
+    """
+    from data_ingestion import fetch_economic_data as economic
+    from data_ingestion import fetch_financial_news as news
+    from data_ingestion import fetch_historical_stock_data as historical
+    from data_ingestion import fetch_intraday_stock_data as intraday
+    from data_processing import compute_technical_indicators as indicators
+    from data_processing import transform_financial_news as transform
+    from utils import cache, rate_limiting
+
+    symbols = [f'S{number:04d}' for number in range(args.symbols)]
+    cache._cache = cache.ResponseCache(path=os.path.join(tempfile.mkdtemp(), 'responses.sqlite'))
+    rate_limiting._schedulers['alpha_vantage'] = rate_limiting.RequestScheduler(
+        name='Fake Alpha Vantage',
+        requests_per_minute=1_000_000,
+        max_workers=args.workers
+    )
+    rate_limiting._schedulers['news_api'] = rate_limiting.RequestScheduler(
+        name='Fake NewsAPI',
+        requests_per_minute=1_000_000,
+        max_workers=args.workers
+    )
+    fake_http = FakeHttpApis(articles_per_query=args.articles)
+
+    historical.create_ticker = lambda symbol: FakeTicker(symbol, days=args.days)
+    _timed(historical, 'fetch_symbol_history')
+    _timed(historical, 'write_history_rows')
+    intraday.create_time_series = lambda api_key: FakeTimeSeries(full_size=args.intraday_bars)
+    _timed(intraday, 'write_intraday_rows')
+    economic.create_world_bank_session = lambda max_workers: fake_http
+    for module in (historical, intraday, news, economic, transform, indicators):
+        _counting_bulk_insert(module)
+
+    def with_fake_http(function):
+        original_get = requests.get
+        requests.get = fake_http
+        try:
+            return function()
+        finally:
+            requests.get = original_get
+
+    return [
+        (
+            'historical_ingestion',
+            lambda: historical.fetch_historical_stock_data(symbols, full_backfill=True, max_workers=args.workers)
+        ),
+        ('intraday_ingestion', lambda: intraday.fetch_intraday_stock_data(symbols, full_backfill=True)),
+        ('news_ingestion', lambda: with_fake_http(news.fetch_financial_news)),
+        (
+            'economic_ingestion',
+            lambda: economic.fetch_economic_data(countries=ECONOMIC_COUNTRIES, indicators=ECONOMIC_INDICATORS)
+        ),
+        ('news_transform', transform.transform_financial_news),
+        ('technical_indicators', indicators.compute_technical_indicators),
+    ]
+
+
+def run_benchmark(args):
+    """
+    Run every stage and collect its metrics.
+
+    Returns:
+        dict: Scale parameters and metrics per stage.
+    """
+    psycopg2.connect = _counting_connect
+    if args.reset:
+        reset_database()
+
+    results = {
+        'scale': {
+            'symbols': args.symbols,
+            'days': args.days,
+            'intraday_bars': args.intraday_bars,
+            'articles': args.articles,
+            'workers': args.workers,
+        },
+        'stages': {},
+    }
+    for name, stage in build_stages(args):
+        with _counters_lock:
+            _counters.clear()
+            _latencies.clear()
+        start = time.perf_counter()
+        stage()
+        elapsed = time.perf_counter() - start
+        with _counters_lock:
+            counters = dict(_counters)
+            latencies = {call: list(values) for call, values in _latencies.items()}
+
+        rows = counters.get('rows', 0)
+        results['stages'][name] = {
+            'seconds': elapsed,
+            'rows': rows,
+            'rows_inserted': counters.get('rows_inserted', 0),
+            'rows_per_sec': rows / elapsed if elapsed > 0 else None,
+            'round_trips': counters.get('round_trips', 0),
+            'commits': counters.get('commits', 0),
+            'connections': counters.get('connections', 0),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'latency': {
+                call: {
+                    'calls': len(values),
+                    'mean': sum(values) / len(values),
+                    'p50': _percentile(values, 0.5),
+                    'p95': _percentile(values, 0.95),
+                }
+                for call, values in latencies.items() if values
+            },
+        }
+        logger.info(
+            f'{name}: {rows} rows in {elapsed:.2f}s, {counters.get("round_trips", 0)} round-trips.'
+        )
+
+    psycopg2.connect = _original_connect
+    return results
+
+
+def baseline_path(args):
+    return os.path.join(
+        BASELINES_DIR,
+        f'ingestion_{args.symbols}x{args.days}_{args.intraday_bars}_{args.articles}.json'
+    )
+
+
+def compare_with_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare a run against a stored baseline.
+
+    Returns:
+        list: Human-readable description of every regressed metric.
+    """
+    regressions = []
+    for name, stage in results['stages'].items():
+        reference = baseline['stages'].get(name)
+        if reference is None:
+            continue
+        if reference['rows_per_sec'] and stage['rows_per_sec'] is not None \
+                and stage['rows_per_sec'] < reference['rows_per_sec'] * (1 - tolerance):
+            regressions.append(
+                f"{name}: rows/sec fell from {reference['rows_per_sec']:.0f} to {stage['rows_per_sec']:.0f}"
+            )
+        for metric in ('round_trips', 'seconds', 'peak_rss_mb'):
+            if reference[metric] and stage[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f'{name}: {metric} rose from {reference[metric]:.1f} to {stage[metric]:.1f}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingestion against fake providers and a local PostgreSQL.')
+    parser.add_argument('--symbols', type=int, default=20, help='Number of synthetic symbols.')
+    parser.add_argument('--days', type=int, default=2500, help='Daily bars per symbol.')
+    parser.add_argument('--intraday-bars', type=int, default=5000, help='1-minute bars per symbol on full fetches.')
+    parser.add_argument('--articles', type=int, default=100, help='Articles per NewsAPI query.')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent fetch workers.')
+    parser.add_argument('--reset', action='store_true', help='Drop the raw and processed schemas first.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the baseline of this scale.')
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report)
+    print(report)
+
+    path = baseline_path(args)
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(path, 'w') as baseline_file:
+            baseline_file.write(report)
+        logger.info(f'Saved baseline to "{path}".')
+    elif os.path.exists(path):
+        with open(path) as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file))
+        for regression in regressions:
+            logger.warning(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+        logger.info('No regression against the stored baseline.')
+
+
+if __name__ == "__main__":
+    main()
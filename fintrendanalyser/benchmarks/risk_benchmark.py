@@ -0,0 +1,229 @@
+"""
+Risk statistics benchmark.
+
+Runs the computations of data_processing.compute_risk_statistics on a synthetic factor-model
+universe held in memory, without a database, and compares the sliding correlation matrices
+with a recomputation per date and with a pandas loop over symbol pairs, the latter timed on a
+sample of pairs and extrapolated to the whole universe.
+
+Usage (from the fintrendanalyser directory):
+    python -m benchmarks.risk_benchmark --symbols 1000 --days 2520
+    python -m benchmarks.risk_benchmark --symbols 1000 --days 2520 --workers 4 --save-baseline
+"""
+from data_processing.compute_risk_statistics import (
+    DEFAULT_WINDOW,
+    MIN_WINDOW_COVERAGE,
+    correlation_matrices,
+    equal_weighted_returns,
+    log_returns,
+    parallel_correlation_matrices,
+    rolling_risk_statistics
+)
+from utils.logging import setup_logger
+import argparse
+import json
+import numpy as np
+import os
+import resource
+import sys
+import time
+
+
+logger = setup_logger(name='risk_benchmark')
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+# Relative slowdown tolerated before a stage is reported as a regression
+REGRESSION_TOLERANCE = 0.2
+
+# Share of missing closes in the synthetic universe, e.g. listings, delistings and halts
+MISSING_SHARE = 0.02
+
+
+def synthetic_closes(symbols, days, seed=0):
+    """
+    Generate closes driven by a market factor and a few sector factors, with missing values.
+
+    Returns:
+        ndarray: (symbols x days) closes, NaN where missing.
+    """
+    rng = np.random.default_rng(seed)
+    market = rng.normal(0.0003, 0.01, days)
+    sectors = rng.normal(0.0, 0.006, (10, days))
+    sector_of = rng.integers(0, 10, symbols)
+    betas = rng.uniform(0.5, 1.5, symbols)[:, None]
+    returns = betas * market + sectors[sector_of] + rng.normal(0.0, 0.015, (symbols, days))
+    closes = 50.0 * np.exp(np.cumsum(returns, axis=1))
+    closes[rng.random((symbols, days)) < MISSING_SHARE] = np.nan
+    return closes
+
+
+def _timed(results, name, function, work=None, unit=None):
+    start = time.perf_counter()
+    value = function()
+    elapsed = time.perf_counter() - start
+    results[name] = {'seconds': elapsed}
+    if work is not None:
+        results[name][f'{unit}_per_sec'] = work / elapsed if elapsed > 0 else None
+    logger.info(f'{name}: {elapsed:.3f}s.')
+    return value
+
+
+def naive_pair_seconds(returns, window, min_periods, pairs, seed=0):
+    """
+    Time a pandas rolling correlation over every date for a sample of symbol pairs.
+
+    Returns:
+        float: Seconds per pair.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame(returns.T)
+    sample = rng.choice(returns.shape[0], size=(pairs, 2))
+    start = time.perf_counter()
+    for first, second in sample:
+        frame[first].rolling(window, min_periods=min_periods).corr(frame[second])
+    return (time.perf_counter() - start) / pairs
+
+
+def run_benchmark(args):
+    """
+    Run every stage and collect its timings.
+
+    Returns:
+        dict: Scale parameters, seconds and throughput per stage, and the accuracy check.
+    """
+    min_periods = max(2, int(args.window * MIN_WINDOW_COVERAGE))
+    closes = synthetic_closes(args.symbols, args.days)
+    symbol_dates = args.symbols * args.days
+    pair_count = args.symbols * (args.symbols - 1) // 2
+    as_of_columns = list(range(args.days - args.as_of_dates, args.days))
+    stages = {}
+
+    returns = _timed(stages, 'log_returns', lambda: log_returns(closes), symbol_dates, 'symbol_dates')
+    benchmark = equal_weighted_returns(returns)
+    _timed(
+        stages,
+        'rolling_statistics',
+        lambda: rolling_risk_statistics(returns, benchmark, args.window, min_periods),
+        symbol_dates,
+        'symbol_dates'
+    )
+    sliding = _timed(
+        stages,
+        'correlation_sliding',
+        lambda: correlation_matrices(returns, as_of_columns, args.window, min_periods),
+        pair_count * len(as_of_columns),
+        'pair_dates'
+    )
+    recomputed = _timed(
+        stages,
+        'correlation_recompute',
+        lambda: [
+            result
+            for column in as_of_columns
+            for result in correlation_matrices(returns, [column], args.window, min_periods)
+        ],
+        pair_count * len(as_of_columns),
+        'pair_dates'
+    )
+    if args.workers > 1:
+        _timed(
+            stages,
+            'correlation_parallel',
+            lambda: parallel_correlation_matrices(returns, as_of_columns, args.window, min_periods, workers=args.workers),
+            pair_count * len(as_of_columns),
+            'pair_dates'
+        )
+
+    seconds_per_pair = naive_pair_seconds(returns, args.window, min_periods, args.naive_pairs)
+    stages['naive_pandas_pairs'] = {
+        'seconds': seconds_per_pair * pair_count,
+        'sampled_pairs': args.naive_pairs,
+        'extrapolated': True,
+    }
+    logger.info(
+        f'naive_pandas_pairs: {seconds_per_pair * 1000:.2f} ms per pair, '
+        f'{seconds_per_pair * pair_count:.0f}s extrapolated to {pair_count} pairs.'
+    )
+
+    # The sliding sums must match the recomputation up to rounding
+    drift = max(
+        float(np.nanmax(np.abs(slid[2] - fresh[2]))) for slid, fresh in zip(sliding, recomputed)
+    )
+    return {
+        'scale': {
+            'symbols': args.symbols,
+            'days': args.days,
+            'window': args.window,
+            'as_of_dates': args.as_of_dates,
+            'workers': args.workers,
+        },
+        'stages': stages,
+        'max_correlation_drift': drift,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def baseline_path(args):
+    return os.path.join(
+        BASELINES_DIR,
+        f'risk_{args.symbols}x{args.days}_{args.window}_{args.as_of_dates}_{args.workers}.json'
+    )
+
+
+def compare_with_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare a run against a stored baseline.
+
+    Returns:
+        list: Human-readable description of every regressed stage.
+    """
+    regressions = []
+    for name, stage in results['stages'].items():
+        reference = baseline['stages'].get(name)
+        if reference is None or stage.get('extrapolated'):
+            continue
+        if reference['seconds'] and stage['seconds'] > reference['seconds'] * (1 + tolerance):
+            regressions.append(f"{name}: seconds rose from {reference['seconds']:.3f} to {stage['seconds']:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the risk statistics on a synthetic universe.')
+    parser.add_argument('--symbols', type=int, default=1000, help='Number of synthetic symbols.')
+    parser.add_argument('--days', type=int, default=2520, help='Trading days per symbol.')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help='Rolling window in trading days.')
+    parser.add_argument('--as-of-dates', type=int, default=20, help='Consecutive dates with a correlation matrix.')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes for the parallel stage.')
+    parser.add_argument('--naive-pairs', type=int, default=200, help='Symbol pairs timed with pandas.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the baseline of this scale.')
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report)
+    print(report)
+
+    path = baseline_path(args)
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(path, 'w') as baseline_file:
+            baseline_file.write(report)
+        logger.info(f'Saved baseline to "{path}".')
+    elif os.path.exists(path):
+        with open(path) as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file))
+        for regression in regressions:
+            logger.warning(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+        logger.info('No regression against the stored baseline.')
+
+
+if __name__ == "__main__":
+    main()
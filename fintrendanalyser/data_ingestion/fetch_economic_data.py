@@ -1,70 +1,404 @@
 from utils.constants import (
     DB_RAW_DATA_SCHEMA,
     ECONOMIC_DATA_TABLE_SCHEMA,
-    ECONOMIC_DATA_TABLE_NAME
+    ECONOMIC_DATA_TABLE_NAME,
+    ECONOMIC_DATA_TABLE_CONSTRAINTS
 )
+from utils.cache import CacheMissError, get_response_cache
 from utils.database import (
-    get_db_connection,
+    db_session,
     create_table_with_schema,
-    insert_data
+    bulk_insert_data,
+    execute_select
 )
+from utils.environment import get_setting
 from utils.logging import setup_logger
-import requests
+from utils.pipeline import Pipeline
+from utils.profiling import span
+import argparse
+import collections
+import datetime
 
 
 logger = setup_logger(name='fetch_economic_data')
 
-# Establish a database connection
-conn = get_db_connection()
+ECONOMIC_DATA_TABLE_FULLNAME = f'{DB_RAW_DATA_SCHEMA}.{ECONOMIC_DATA_TABLE_NAME}'
 
-# Create table with the defined schema
-create_table_with_schema(
-    connection=conn,
-    db_schema=DB_RAW_DATA_SCHEMA,
-    db_table_name=ECONOMIC_DATA_TABLE_NAME,
-    db_table_schema_definition=ECONOMIC_DATA_TABLE_SCHEMA
+# World Bank API endpoint and query parameters
+WORLD_BANK_BASE_URL = 'http://api.worldbank.org/v2/country/'
+DEFAULT_INDICATOR_CODES = ['NY.GDP.MKTP.CD']  # GDP
+DEFAULT_COUNTRY_CODES = ['USA']  # United States
+DEFAULT_FIRST_YEAR = 1960
+
+# Observations per page, and country codes joined with ";" into one request, which keeps URLs short
+WORLD_BANK_PER_PAGE = 10000
+COUNTRIES_PER_REQUEST = 50
+
+# Years before the current one the World Bank may still revise; older years are only fetched once.
+# Overridable with WORLD_BANK_REVISABLE_YEARS
+DEFAULT_REVISABLE_YEARS = 5
+
+# Pages downloaded concurrently, which is also the size of the HTTP connection pool; overridable with WORLD_BANK_MAX_WORKERS
+DEFAULT_MAX_WORKERS = 8
+
+# Rows buffered by the writer before a bulk upsert
+WRITE_BATCH_ROWS = 20000
+
+# Revised observations overwrite the stored ones; unchanged ones are not rewritten
+UPSERT_ACTION = (
+    'ON CONFLICT (indicator_id, country_id, date) DO UPDATE SET '
+    'indicator_value = EXCLUDED.indicator_value, country_value = EXCLUDED.country_value, '
+    'countryiso3code = EXCLUDED.countryiso3code, value = EXCLUDED.value, unit = EXCLUDED.unit, '
+    'obs_status = EXCLUDED.obs_status, decimal = EXCLUDED.decimal '
+    f'WHERE ({ECONOMIC_DATA_TABLE_NAME}.value, {ECONOMIC_DATA_TABLE_NAME}.obs_status) '
+    'IS DISTINCT FROM (EXCLUDED.value, EXCLUDED.obs_status)'
 )
 
-# World Bank API endpoint and query parameters
-base_url = 'http://api.worldbank.org/v2/country/'
-indicator_code = 'NY.GDP.MKTP.CD'  # GDP
-country_code = 'USA'  # United States
-date_range = '2010:2020'
-url = f'{base_url}{country_code}/indicator/{indicator_code}?date={date_range}&format=json'
-
-logger.info(f'Starting to fetch economic data from the World Bank API for {country_code}.')
-
-# Make the request to the World Bank API
-response = requests.get(url)
-
-if response.status_code == 200:
-    # Process the data
-    data = response.json()[1]  # The actual data is in the second element of the response
-    logger.info(f'Fetched {len(data)} records from the World Bank API for {country_code}.')
-    for item in data:
-        data_values = (
+def create_world_bank_session(max_workers):
+    """
+    Create the HTTP session shared by the download workers, importing requests only when a run starts.
+
+    Parameters:
+        max_workers (int): Number of concurrent downloads, bounding the connection pool.
+
+    Returns:
+        requests.Session: Session keeping up to max_workers connections alive.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def ensure_economic_data_primary_key(conn):
+    """
+    Add the primary key to an economic data table created before it was declared, keeping the
+    last copy of every duplicated observation.
+    """
+    (has_primary_key,), = execute_select(
+        conn,
+        "SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p')",
+        (ECONOMIC_DATA_TABLE_FULLNAME,)
+    )
+    if has_primary_key:
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {ECONOMIC_DATA_TABLE_FULLNAME} older USING {ECONOMIC_DATA_TABLE_FULLNAME} newer '
+            f'WHERE older.indicator_id = newer.indicator_id AND older.country_id = newer.country_id '
+            f'AND older.date = newer.date AND older.ctid < newer.ctid'
+        )
+        cursor.execute(
+            f'DELETE FROM {ECONOMIC_DATA_TABLE_FULLNAME} '
+            f'WHERE indicator_id IS NULL OR country_id IS NULL OR date IS NULL'
+        )
+        cursor.execute(
+            f'ALTER TABLE {ECONOMIC_DATA_TABLE_FULLNAME} ADD PRIMARY KEY (indicator_id, country_id, date)'
+        )
+    conn.commit()
+    logger.info(f'Added the primary key of "{ECONOMIC_DATA_TABLE_FULLNAME}".')
+
+
+def list_country_codes(session):
+    """
+    Return the ISO3 codes of every country and aggregate known to the World Bank, unless cached.
+    """
+    params = {'format': 'json', 'per_page': WORLD_BANK_PER_PAGE}
+
+    def request_world_bank():
+        response = session.get(WORLD_BANK_BASE_URL, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    payload = get_response_cache().get_or_fetch('worldbank', {'url': WORLD_BANK_BASE_URL, **params}, request_world_bank)
+    if len(payload) < 2:
+        raise ValueError(f'World Bank error listing the countries: {payload[0].get("message")}')
+    return [country['id'] for country in payload[1] or []]
+
+
+def plan_requests(
+        conn,
+        countries,
+        indicators,
+        first_year,
+        revisable_years,
+        full_backfill=False,
+        country_codes=None
+        ):
+    """
+    Split the panel into World Bank requests, fetching only the revisable years of the series
+    already stored and the full range of the others.
+
+    With ["all"], an indicator without stored series is fetched for every country in one request;
+    otherwise its stored series are fetched by country code, and the codes of country_codes
+    without stored series over the full range.
+
+    Parameters:
+        conn: The database connection object.
+        countries (list): ISO3 country codes, or ["all"].
+        indicators (list): Indicator codes.
+        first_year (int): First year of a full fetch.
+        revisable_years (int): Years before the current one fetched again for stored series.
+        full_backfill (bool): Fetch the full range of every series.
+        country_codes (list, optional): Every country code, see list_country_codes; required with
+            ["all"] unless full_backfill is set.
+
+    Returns:
+        list: (indicator, country codes joined with ";", "first:last" years) of each request.
+    """
+    current_year = datetime.date.today().year
+    full_range = f'{first_year}:{current_year}'
+    revisable_range = f'{max(first_year, current_year - revisable_years)}:{current_year}'
+
+    stored = set()
+    if not full_backfill:
+        stored = {
+            (indicator, country)
+            for indicator, country in execute_select(
+                conn,
+                f'SELECT DISTINCT indicator_id, countryiso3code FROM {ECONOMIC_DATA_TABLE_FULLNAME} '
+                f'WHERE indicator_id = ANY(%s)',
+                (list(indicators),)
+            )
+        }
+
+    requests_plan = []
+    for indicator in indicators:
+        if countries == ['all']:
+            stored_countries = sorted(country for key, country in stored if key == indicator and country)
+            new_countries = [
+                country for country in country_codes if (indicator, country) not in stored
+            ] if stored_countries else countries
+        else:
+            stored_countries = [country for country in countries if (indicator, country) in stored]
+            new_countries = [country for country in countries if country not in stored_countries]
+        for group, date_range in ((stored_countries, revisable_range), (new_countries, full_range)):
+            for start in range(0, len(group), COUNTRIES_PER_REQUEST):
+                requests_plan.append((indicator, ';'.join(group[start:start + COUNTRIES_PER_REQUEST]), date_range))
+    return requests_plan
+
+
+def request_page(session, indicator, countries, date_range, page):
+    """
+    Download one page of a World Bank indicator, unless it is cached.
+
+    Returns:
+        tuple: Pagination metadata and the observations of the page.
+    """
+    url = f'{WORLD_BANK_BASE_URL}{countries}/indicator/{indicator}'
+    params = {'date': date_range, 'format': 'json', 'per_page': WORLD_BANK_PER_PAGE, 'page': page}
+
+    def request_world_bank():
+        response = session.get(url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    with span('economic_data.fetch', indicator):
+        payload = get_response_cache().get_or_fetch('worldbank', {'url': url, **params}, request_world_bank)
+    # Errors come back as a single message element, and empty results with a null data element
+    if len(payload) < 2:
+        raise ValueError(f'World Bank error for {indicator} ({countries}): {payload[0].get("message")}')
+    return payload[0], payload[1] or []
+
+
+def request_label(request):
+    """
+    Return the name of a planned request, the key of its status.
+    """
+    indicator, countries, date_range = request
+    return f'{indicator} for {countries} ({date_range})'
+
+
+def economic_rows(data):
+    """
+    Convert World Bank observations into row tuples in the column order of the economic data table.
+    """
+    return [
+        (
             item['indicator']['id'],
             item['indicator']['value'],
             item['country']['id'],
             item['country']['value'],
             item['countryiso3code'],
             item['date'],
-            item.get('value', None),
-            '',
-            '',
+            item.get('value'),
+            item.get('unit') or '',
+            item.get('obs_status') or '',
             item['decimal']
         )
-        insert_data(
+        for item in data
+    ]
+
+
+def fetch_economic_data(
+        countries=DEFAULT_COUNTRY_CODES,
+        indicators=DEFAULT_INDICATOR_CODES,
+        first_year=DEFAULT_FIRST_YEAR,
+        revisable_years=None,
+        full_backfill=False,
+        max_workers=None
+        ):
+    """
+    Fetch a panel of World Bank indicators for many countries and upsert it in the raw schema.
+
+    The first page of each request tells how many pages follow; those are then downloaded
+    concurrently through one pooled HTTP session, and rows are upserted in large batches.
+    A failing request is recorded in the returned statuses and does not stop the run.
+
+    Parameters:
+        countries (list): ISO3 country codes, or ["all"] for every country and aggregate.
+        indicators (list): World Bank indicator codes.
+        first_year (int): First year fetched for series not stored yet.
+        revisable_years (int, optional): Years before the current one fetched again for stored series,
+            defaults to WORLD_BANK_REVISABLE_YEARS.
+        full_backfill (bool): Fetch the full range of every series.
+        max_workers (int, optional): Concurrent page downloads, defaults to WORLD_BANK_MAX_WORKERS.
+
+    Returns:
+        dict: Status per request (see request_label), one of "written", "no_data" or "failed: <error>".
+    """
+    if revisable_years is None:
+        revisable_years = get_setting('WORLD_BANK_REVISABLE_YEARS', DEFAULT_REVISABLE_YEARS, int)
+    if max_workers is None:
+        max_workers = get_setting('WORLD_BANK_MAX_WORKERS', DEFAULT_MAX_WORKERS, int)
+    cache = get_response_cache()
+    batch = {}
+    # Pages of each request in the current batch, and pages of each request stored so far
+    batch_pages = collections.Counter()
+    written_pages = collections.Counter()
+    page_counts = {}
+    inserted = 0
+
+    with db_session() as conn:
+        # Create table with the defined schema
+        create_table_with_schema(
             connection=conn,
             db_schema=DB_RAW_DATA_SCHEMA,
             db_table_name=ECONOMIC_DATA_TABLE_NAME,
-            table_columns=list(ECONOMIC_DATA_TABLE_SCHEMA.keys()),
-            table_data=data_values
+            db_table_schema_definition=ECONOMIC_DATA_TABLE_SCHEMA,
+            constraints=ECONOMIC_DATA_TABLE_CONSTRAINTS
         )
-    logger.info(f'Finished fetching and inserting economic data for {country_code}.')
-else:
-    logger.error(f'Failed to fetch economic data for {country_code} with status code {response.status_code}.')
+        ensure_economic_data_primary_key(conn)
+        country_codes = None
+        if countries == ['all'] and not full_backfill:
+            with create_world_bank_session(1) as list_session:
+                country_codes = list_country_codes(list_session)
+        planned = plan_requests(
+            conn, countries, indicators, first_year, revisable_years, full_backfill, country_codes
+        )
+        statuses = {request_label(request): 'pending' for request in planned}
+        logger.info(
+            f'Fetching {len(indicators)} indicators for {len(countries)} countries '
+            f'from the World Bank API in {len(planned)} requests.'
+        )
+
+        def first_page_stage(request):
+            indicator, request_countries, date_range = request
+            try:
+                metadata, data = request_page(session, indicator, request_countries, date_range, 1)
+            except (OSError, ValueError, CacheMissError) as e:
+                logger.error(f'Failed to fetch {indicator} for {request_countries}: {e}')
+                statuses[request_label(request)] = f'failed: {e}'
+                return
+            if not data:
+                statuses[request_label(request)] = 'no_data'
+            page_counts[request_label(request)] = int(metadata.get('pages') or 1)
+            yield 'rows', (request_label(request), data)
+            for page in range(2, int(metadata.get('pages') or 1) + 1):
+                yield 'page', (request, page)
+
+        def page_stage(item):
+            kind, value = item
+            if kind == 'rows':
+                yield item
+                return
+            (indicator, request_countries, date_range), page = value
+            try:
+                _, data = request_page(session, indicator, request_countries, date_range, page)
+            except (OSError, ValueError, CacheMissError) as e:
+                logger.error(f'Failed to fetch page {page} of {indicator} for {request_countries}: {e}')
+                statuses[request_label(value[0])] = f'failed: page {page}: {e}'
+                return
+            yield 'rows', (request_label(value[0]), data)
+
+        def flush():
+            nonlocal inserted
+            try:
+                if batch:
+                    with span('economic_data.write'):
+                        batch_inserted, _ = bulk_insert_data(
+                            connection=conn,
+                            db_schema=DB_RAW_DATA_SCHEMA,
+                            db_table_name=ECONOMIC_DATA_TABLE_NAME,
+                            table_columns=list(ECONOMIC_DATA_TABLE_SCHEMA.keys()),
+                            table_data=list(batch.values()),
+                            on_conflict_action=UPSERT_ACTION
+                        )
+                    inserted += batch_inserted
+            except Exception as e:
+                conn.rollback()
+                logger.error(f'Failed to write {len(batch)} observations of {len(batch_pages)} requests: ', exc_info=e)
+                for label in batch_pages:
+                    statuses[label] = f'failed: {e}'
+            else:
+                written_pages.update(batch_pages)
+            batch.clear()
+            batch_pages.clear()
+
+        def write_stage(item):
+            _, (label, data) = item
+            batch_pages[label] += 1
+            with span('economic_data.transform'):
+                # Keyed by primary key, as an upsert cannot touch the same row twice
+                for row in economic_rows(data):
+                    batch[(row[0], row[2], row[5])] = row
+            if len(batch) >= WRITE_BATCH_ROWS:
+                flush()
+
+        session = create_world_bank_session(max_workers)
+        try:
+            (
+                Pipeline('economic_data')
+                .stage('first_page', first_page_stage, workers=max_workers)
+                .stage('pages', page_stage, workers=max_workers)
+                .stage('write', write_stage, finish=flush)
+                .run(planned)
+            )
+        finally:
+            session.close()
+
+    # A request is written once every one of its pages is stored
+    statuses = {
+        label: 'written' if status == 'pending' and written_pages[label] == page_counts.get(label) else status
+        for label, status in statuses.items()
+    }
+    failed = [label for label, status in statuses.items() if status.startswith('failed')]
+    logger.info(
+        f'Finished economic data run: {len(planned)} requests, {len(failed)} failed, '
+        f'{inserted} observations inserted or revised.'
+    )
+    cache.log_stats(logger)
+    return statuses
+
 
-# Close the database connection
-conn.close()
-logger.info('Database connection closed.')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fetch World Bank indicators.')
+    parser.add_argument('--countries', nargs='+', default=DEFAULT_COUNTRY_CODES, help='ISO3 codes, or "all".')
+    parser.add_argument('--indicators', nargs='+', default=DEFAULT_INDICATOR_CODES, help='Indicator codes.')
+    parser.add_argument('--first-year', type=int, default=DEFAULT_FIRST_YEAR, help='First year of new series.')
+    parser.add_argument('--revisable-years', type=int, help='Years fetched again, defaults to WORLD_BANK_REVISABLE_YEARS.')
+    parser.add_argument('--full-backfill', action='store_true', help='Fetch the full range of every series.')
+    parser.add_argument('--max-workers', type=int, help='Concurrent downloads, defaults to WORLD_BANK_MAX_WORKERS.')
+    args = parser.parse_args()
+    fetch_economic_data(
+        countries=args.countries,
+        indicators=args.indicators,
+        first_year=args.first_year,
+        revisable_years=args.revisable_years,
+        full_backfill=args.full_backfill,
+        max_workers=args.max_workers
+    )
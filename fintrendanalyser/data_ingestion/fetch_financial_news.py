@@ -1,76 +1,389 @@
-from dotenv import load_dotenv
 from utils.constants import (
     DB_RAW_DATA_SCHEMA,
     FINANCIAL_NEWS_TABLE_SCHEMA,
-    FINANCIAL_NEWS_TABLE_NAME
+    RAW_FINANCIAL_NEWS_TABLE_SCHEMA,
+    FINANCIAL_NEWS_TABLE_NAME,
+    RAW_FINANCIAL_NEWS_TABLE_CONSTRAINTS
 )
+from utils.cache import CacheMissError, get_response_cache
 from utils.database import (
-    get_db_connection,
+    db_session,
     create_table_with_schema,
-    insert_data
+    bulk_insert_data,
+    execute_select,
+    stream_select
+)
+from utils.environment import load_environment
+from utils.ingestion_state import (
+    backfill_completion_statements,
+    backfill_cursor_statement,
+    create_ingestion_state_table,
+    load_backfill_cursors,
+    load_watermarks
 )
 from utils.logging import setup_logger
+from utils.pipeline import Pipeline
+from utils.profiling import span
+from utils.rate_limiting import RateLimitBudgetExhausted, get_news_api_scheduler
+import datetime
+import hashlib
+import numpy as np
 import os
-import requests
-
+import threading
 
-# Load environment variables from .env file
-load_dotenv()
 
 logger = setup_logger(name='fetch_financial_news')
 
-# Establish a database connection
-conn = get_db_connection()
+# Base URL for NewsAPI
+NEWS_API_BASE_URL = "https://newsapi.org/v2/everything"
 
-# Create table with the defined schema
-create_table_with_schema(
-    connection=conn,
-    db_schema=DB_RAW_DATA_SCHEMA,
-    db_table_name=FINANCIAL_NEWS_TABLE_NAME,
-    db_table_schema_definition=FINANCIAL_NEWS_TABLE_SCHEMA
-)
+# List of companies to fetch news for
+DEFAULT_NEWS_COMPANIES = ['Apple', 'Microsoft', 'Google', 'Amazon', 'Tesla']
 
-api_key = os.getenv('NEWS_API_KEY')
+RAW_TABLE_FULLNAME = f'{DB_RAW_DATA_SCHEMA}.{FINANCIAL_NEWS_TABLE_NAME}'
 
-# List of companies to fetch news for
-companies = ['Apple', 'Microsoft', 'Google', 'Amazon', 'Tesla']
+# Ingestion state source holding the latest published_at per company, and the oldest published_at
+# reached by a run that stopped before paging back to the watermark
+WATERMARK_SOURCE = 'newsapi'
 
-# Base URL for NewsAPI
-base_url = "https://newsapi.org/v2/everything?"
-
-# Fetch news for each company
-for company in companies:
-    query_url = f"{base_url}q={company}&apiKey={api_key}"
-
-    # Make the API request
-    response = requests.get(query_url)
-
-    if response.status_code == 200:
-        # Parse the response
-        articles = response.json()['articles']
-        logger.info(f"Fetched {len(articles)} articles for {company}.")
-
-        # Insert each article into the database
-        for article in articles:
-            data_values = (
-                company,
-                article['title'],
-                article['description'],
-                article['url'],
-                article['publishedAt'],
-                article['source']['name']
+# Articles per page (the NewsAPI maximum), and pages fetched per company and run at most
+NEWS_API_PAGE_SIZE = 100
+MAX_PAGES_PER_COMPANY = 5
+
+# Known URLs published this long before the oldest watermark are loaded into the seen-URL index
+SEEN_URLS_LOOKBACK = datetime.timedelta(days=2)
+
+# Rows buffered by the writer before a bulk insert
+WRITE_BATCH_ROWS = 5000
+
+def url_hash(url):
+    """
+    Hash a URL to a signed 64-bit integer, the same value as url_hash_sql computes in PostgreSQL.
+    """
+    return int.from_bytes(hashlib.md5(url.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+def url_hash_sql(column):
+    return f"('x' || substr(md5({column}), 1, 16))::bit(64)::bigint"
+
+
+class SeenUrlIndex:
+    """
+    Set of already stored article URLs, kept as a sorted array of 64-bit hashes (8 bytes per URL).
+
+    A hash collision makes a new article look seen, which at 64 bits is negligible for news volumes.
+    URLs added during the run are kept in a regular set.
+    """
+
+    def __init__(self, hashes):
+        self._hashes = np.sort(np.asarray(hashes, dtype=np.int64))
+        self._added = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hashes) + len(self._added)
+
+    @classmethod
+    def load(cls, conn, since=None):
+        """
+        Load the hashes of the stored URLs, computed by the database.
+
+        Parameters:
+            conn: The database connection object.
+            since (datetime, optional): Only load URLs published after this time.
+        """
+        query = f'SELECT {url_hash_sql("url")} FROM {RAW_TABLE_FULLNAME}'
+        params = ()
+        if since is not None:
+            query += ' WHERE published_at >= %s'
+            params = (since,)
+        chunks = [np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+                  for rows in stream_select(conn, query, params)]
+        conn.rollback()
+        return cls(np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64))
+
+    def add_if_new(self, url):
+        """
+        Record a URL, telling whether it was unseen.
+        """
+        key = url_hash(url)
+        position = np.searchsorted(self._hashes, key)
+        if position < len(self._hashes) and self._hashes[position] == key:
+            return False
+        with self._lock:
+            if key in self._added:
+                return False
+            self._added.add(key)
+            return True
+
+
+def prepare_raw_table(conn):
+    """
+    Create the raw news table; tables created before the URL key existed are deduplicated once and given the key.
+    """
+    create_table_with_schema(
+        connection=conn,
+        db_schema=DB_RAW_DATA_SCHEMA,
+        db_table_name=FINANCIAL_NEWS_TABLE_NAME,
+        db_table_schema_definition=RAW_FINANCIAL_NEWS_TABLE_SCHEMA,
+        constraints=RAW_FINANCIAL_NEWS_TABLE_CONSTRAINTS
+    )
+    create_ingestion_state_table(conn)
+
+    url_key_exists = execute_select(
+        conn, f"SELECT to_regclass('{DB_RAW_DATA_SCHEMA}.{FINANCIAL_NEWS_TABLE_NAME}_url_key') IS NOT NULL"
+    )[0][0]
+    if not url_key_exists:
+        logger.info(f'Removing duplicate URLs from "{RAW_TABLE_FULLNAME}" before adding its URL key.')
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {RAW_TABLE_FULLNAME} a USING {RAW_TABLE_FULLNAME} b "
+                "WHERE a.url = b.url AND a.ctid < b.ctid"
+            )
+            cursor.execute(
+                f"CREATE UNIQUE INDEX {FINANCIAL_NEWS_TABLE_NAME}_url_key ON {RAW_TABLE_FULLNAME} (url)"
             )
-            insert_data(
-                connection=conn,
-                db_schema=DB_RAW_DATA_SCHEMA,
-                db_table_name=FINANCIAL_NEWS_TABLE_NAME,
-                table_columns=list(FINANCIAL_NEWS_TABLE_SCHEMA.keys()),
-                table_data=data_values
+        conn.commit()
+
+
+def newsapi_time(timestamp):
+    """
+    Format a stored timestamp as a NewsAPI "from" or "to" parameter, in UTC.
+    """
+    return timestamp.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def write_news_rows(conn, rows, cursors=None, completed_companies=()):
+    """
+    Insert article rows and move the ingestion state of their companies in a single transaction.
+
+    Pages come newest first, so the watermark of a company only moves once its pages ran out: until
+    then, the oldest published_at reached is stored as its cursor, and the next run pages the range
+    between the watermark and the cursor instead of skipping it.
+
+    Parameters:
+        conn: The database connection object.
+        rows (list): Article row tuples, possibly empty.
+        cursors (dict, optional): Company mapped to the oldest published_at of its pages in rows.
+        completed_companies (iterable): Companies whose pages ran out, once rows are written.
+
+    Returns:
+        int: Number of articles inserted.
+    """
+    state_statements = [
+        backfill_cursor_statement(WATERMARK_SOURCE, company, cursor) for company, cursor in (cursors or {}).items()
+    ]
+    if completed_companies:
+        state_statements += backfill_completion_statements(
+            WATERMARK_SOURCE,
+            completed_companies,
+            RAW_TABLE_FULLNAME,
+            key_column='company',
+            time_column='published_at'
+        )
+
+    if not rows:
+        with conn.cursor() as cursor:
+            for statement, params in state_statements:
+                cursor.execute(statement, params)
+        conn.commit()
+        return 0
+
+    inserted, _ = bulk_insert_data(
+        connection=conn,
+        db_schema=DB_RAW_DATA_SCHEMA,
+        db_table_name=FINANCIAL_NEWS_TABLE_NAME,
+        table_columns=list(FINANCIAL_NEWS_TABLE_SCHEMA.keys()),
+        table_data=rows,
+        on_conflict_action='ON CONFLICT (url) DO NOTHING',
+        # One transaction, so the cursors never move past articles that were not written
+        batch_size=len(rows),
+        post_merge_statements=state_statements
+    )
+    return inserted
+
+
+def fetch_financial_news(companies=DEFAULT_NEWS_COMPANIES):
+    """
+    Fetch the NewsAPI articles mentioning each company published since the last run, and store
+    the ones not stored yet in the raw schema.
+
+    Each company is paged from its latest stored published_at, companies are fetched concurrently
+    within the NewsAPI request budget, and articles are checked against an in-memory index of the
+    stored URLs before any database work, so a run's cost follows the number of new articles. A
+    company whose paging stops early, at the page limit, the plan's result cap or the request
+    budget, keeps its watermark, and the next run resumes below the oldest article reached.
+
+    Parameters:
+        companies (list): Company names to query.
+
+    Returns:
+        dict: Status per company: "complete", "partial" when paging stopped at the page limit or
+        the plan's result cap and resumes next run, or "failed: <error>" when its pages could not be
+        fetched or written. A status is only set once the articles fetched for the company are stored.
+    """
+    import requests
+
+    load_environment()
+    api_key = os.getenv('NEWS_API_KEY')
+    cache = get_response_cache()
+    scheduler = get_news_api_scheduler()
+    statuses = {company: 'pending' for company in companies}
+    batch = []
+    batch_companies = set()
+    batch_cursors = {}
+    completed_companies = set()
+    # Outcome of the fetch of each company, which becomes its status once its articles are stored
+    outcomes = {}
+    inserted = 0
+    skipped = 0
+    skipped_lock = threading.Lock()
+
+    with db_session() as conn:
+        prepare_raw_table(conn)
+        watermarks = load_watermarks(
+            conn,
+            source=WATERMARK_SOURCE,
+            data_table_fullname=RAW_TABLE_FULLNAME,
+            key_column='company',
+            time_column='published_at'
+        )
+        cursors = load_backfill_cursors(conn, WATERMARK_SOURCE)
+        if cursors:
+            logger.info(f'Resuming the paging of {len(cursors)} companies below their oldest fetched article.')
+        # Older articles are excluded by the "from" parameter, unless a company has no watermark yet
+        known = [watermarks[company] for company in companies if company in watermarks]
+        since = min(known) - SEEN_URLS_LOOKBACK if len(known) == len(companies) else None
+        seen_urls = SeenUrlIndex.load(conn, since=since)
+        logger.info(f'Loaded {len(seen_urls)} known article URLs.')
+
+        def request_page(company, published_from, published_to, page):
+            params = {
+                'q': company,
+                'sortBy': 'publishedAt',
+                'pageSize': NEWS_API_PAGE_SIZE,
+                'page': page,
+            }
+            if published_from is not None:
+                params['from'] = published_from
+            if published_to is not None:
+                params['to'] = published_to
+
+            def request_news():
+                response = requests.get(NEWS_API_BASE_URL, params={**params, 'apiKey': api_key})
+                response.raise_for_status()
+                return response.json()
+
+            # Make the API request, unless the response is cached (the key leaves out the API key)
+            return cache.get_or_fetch(
+                'newsapi',
+                {'url': NEWS_API_BASE_URL, **params},
+                lambda: scheduler.call(request_news)
             )
-        logger.info(f"Finished fetching and inserting articles for {company}.")
-    else:
-        logger.error(f"Failed to fetch news for {company} with status code {response.status_code}.")
 
-# Close the database connection
-conn.close()
-logger.info("Database connection closed.")
+        def fetch_stage(company):
+            nonlocal skipped
+            watermark = watermarks.get(company)
+            cursor = cursors.get(company)
+            published_from = newsapi_time(watermark) if watermark else None
+            published_to = newsapi_time(cursor) if cursor else None
+            for page in range(1, MAX_PAGES_PER_COMPANY + 1):
+                try:
+                    with span('financial_news.fetch', company):
+                        payload = request_page(company, published_from, published_to, page)
+                except (requests.RequestException, CacheMissError, RateLimitBudgetExhausted) as e:
+                    # What was fetched is kept and the cursor stays at the oldest article reached
+                    response = getattr(e, 'response', None)
+                    if response is not None and response.status_code == 426:
+                        # NewsAPI refuses pages past the plan's result cap
+                        logger.info(f"Reached the NewsAPI result cap at page {page} of news for {company}.")
+                        yield company, None, 'partial'
+                    else:
+                        logger.error(f"Failed to fetch page {page} of news for {company}: {e}")
+                        yield company, None, f'failed: {e}'
+                    return
+
+                articles = payload.get('articles', [])
+                with span('financial_news.transform', company):
+                    rows = [
+                        (
+                            company,
+                            article['title'],
+                            article['description'],
+                            article['url'],
+                            article['publishedAt'],
+                            article['source']['name']
+                        )
+                        for article in articles
+                        if seen_urls.add_if_new(article['url'])
+                    ]
+                with skipped_lock:
+                    skipped += len(articles) - len(rows)
+                logger.info(f"Fetched page {page} of news for {company}: {len(rows)} of {len(articles)} articles are new.")
+                if articles:
+                    yield company, rows, min(article['publishedAt'] for article in articles)
+                if len(articles) < NEWS_API_PAGE_SIZE or page * NEWS_API_PAGE_SIZE >= payload.get('totalResults', 0):
+                    # Results ran out, so everything since the watermark was fetched
+                    yield company, None, 'complete'
+                    return
+            logger.info(f"Stopped news for {company} after {MAX_PAGES_PER_COMPANY} pages; the next run resumes below them.")
+            yield company, None, 'partial'
+
+        def flush():
+            nonlocal inserted
+            try:
+                if batch or batch_cursors or completed_companies:
+                    with span('financial_news.write'):
+                        inserted += write_news_rows(conn, batch, batch_cursors, completed_companies)
+            except Exception as e:
+                conn.rollback()
+                failed_companies = batch_companies | completed_companies | set(outcomes)
+                logger.error(f"Failed to write news for {', '.join(sorted(failed_companies))}: ", exc_info=e)
+                for company in failed_companies:
+                    statuses[company] = f'failed: {e}'
+            else:
+                statuses.update(outcomes)
+            batch.clear()
+            batch_companies.clear()
+            batch_cursors.clear()
+            completed_companies.clear()
+            outcomes.clear()
+
+        def write_stage(item):
+            company, rows, last_item = item
+            # Later pages of a company whose write failed would move its cursor past the lost articles
+            if statuses[company].startswith('failed'):
+                return
+            if rows is None:
+                # The fetch of the company ended; its outcome is its status once the batch is stored
+                outcomes[company] = last_item
+                if last_item == 'complete':
+                    completed_companies.add(company)
+                return
+            oldest_published_at = last_item
+            batch.extend(rows)
+            batch_companies.add(company)
+            # Pages arrive newest first, so the last one holds the oldest article
+            batch_cursors[company] = oldest_published_at
+            if len(batch) >= WRITE_BATCH_ROWS:
+                flush()
+
+        (
+            Pipeline('financial_news')
+            .stage('fetch', fetch_stage, workers=scheduler.max_workers)
+            .stage('write', write_stage, finish=flush)
+            .run(statuses)
+        )
+
+    failed = [company for company, status in statuses.items() if status.startswith('failed')]
+    logger.info(
+        f"Finished news run for {len(statuses)} companies ({len(failed)} failed): {inserted} new articles, "
+        f"{skipped} already known articles skipped before any database work."
+    )
+    scheduler.log_budget()
+    cache.log_stats(logger)
+    return statuses
+
+
+if __name__ == "__main__":
+    fetch_financial_news()
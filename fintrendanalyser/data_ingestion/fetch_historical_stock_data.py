@@ -2,112 +2,471 @@ from utils.constants import (
     DB_RAW_DATA_SCHEMA,
     HISTORICAL_STOCK_DATA_TABLE_NAME,
     HISTORICAL_STOCK_DATA_TABLE_SCHEMA,
-    HISTORICAL_STOCK_DATA_TABLE_CONSTRAINTS
+    HISTORICAL_STOCK_DATA_TABLE_CONSTRAINTS,
+    HISTORICAL_STOCK_DATA_TABLE_INDEXES,
+    HISTORICAL_STOCK_DATA_TABLE_PARTITIONING,
+    STOCK_RISK_STATISTICS_TABLE_NAME,
+    SYMBOL_UNIVERSE_TABLE_NAME,
+    SYMBOL_UNIVERSE_TABLE_SCHEMA,
+    SYMBOL_UNIVERSE_TABLE_CONSTRAINTS
+)
+from utils.cache import get_response_cache
+from utils.columnar_storage import (
+    HISTORICAL_BARS_DATASET,
+    ParquetBarSink,
+    parquet_sink_enabled
 )
 from utils.database import (
-    get_db_connection,
+    db_session,
     create_table_with_schema,
-    insert_data,
-    execute_select
+    bulk_insert_data,
+    ensure_partitions
+)
+from utils.environment import get_setting
+from utils.events import change_notification_statement
+from utils.ingestion_state import (
+    backfill_completion_statements,
+    backfill_cursor_statement,
+    create_ingestion_state_table,
+    load_backfill_cursors,
+    load_watermarks,
+    low_water_mark_statement,
+    watermark_update_statement
 )
-from utils.logging import setup_logger
+from utils.logging import get_metrics, setup_logger
+from utils.pipeline import Pipeline
+from utils.profiling import span
+from utils.universe import load_symbol_universe
+import argparse
 import datetime
-import sys
-import yfinance as yf
 
 
 logger = setup_logger(name='fetch_historical_stock_data')
 
-# Establish a database connection
-conn = get_db_connection()
+# Number of symbols downloaded concurrently, overridable with HISTORICAL_FETCH_MAX_WORKERS
+DEFAULT_MAX_WORKERS = 8
+
+# Maximum number of chunks waiting between two stages of the ingestion pipeline
+DEFAULT_QUEUE_SIZE = 16
+
+# Length of the date ranges histories are downloaded in, so memory does not grow with the history length;
+# overridable with HISTORICAL_FETCH_CHUNK_YEARS
+DEFAULT_CHUNK_YEARS = 5
+
+# Rows buffered by the writer before a bulk insert
+WRITE_BATCH_ROWS = 20000
+
+# A full backfill walks back from today until this many consecutive ranges come back empty, so a
+# single transient empty response does not end it, but never past BACKFILL_EARLIEST_DATE
+BACKFILL_EMPTY_RANGES_TO_STOP = 2
+BACKFILL_EARLIEST_DATE = datetime.date(1900, 1, 1)
+
+HISTORICAL_TABLE_FULLNAME = f'{DB_RAW_DATA_SCHEMA}.{HISTORICAL_STOCK_DATA_TABLE_NAME}'
+
+HISTORY_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+def create_ticker(stock):
+    """
+    Create the yfinance Ticker of a symbol, importing yfinance only when a download runs.
+    """
+    import yfinance
+    return yfinance.Ticker(stock)
+
+
+def fetch_symbol_history(stock, start_date, end_date):
+    """
+    Download the daily history of a single symbol over a date range.
+
+    Parameters:
+        stock (str): Stock symbol.
+        start_date (date): First day of the range.
+        end_date (date): Day after the last day of the range.
+
+    Returns:
+        DataFrame: History as returned by yfinance, possibly empty.
+    """
+    # A range ending before today no longer changes and is cached without expiry, while one
+    # including today keeps the short yfinance time-to-live, as today's bar moves until the close
+    cache_options = {'ttl': None} if end_date <= datetime.datetime.now().date() else {}
+    with span('historical_stock_data.fetch', stock):
+        return get_response_cache().get_or_fetch(
+            'yfinance',
+            {'symbol': stock, 'start': str(start_date), 'end': str(end_date)},
+            lambda: create_ticker(stock).history(start=start_date, end=end_date),
+            **cache_options
+        )
 
-# Create table with the defined schema
-create_table_with_schema(
-    connection=conn,
-    db_schema=DB_RAW_DATA_SCHEMA,
-    db_table_name=HISTORICAL_STOCK_DATA_TABLE_NAME,
-    db_table_schema_definition=HISTORICAL_STOCK_DATA_TABLE_SCHEMA,
-    constraints=HISTORICAL_STOCK_DATA_TABLE_CONSTRAINTS
-)
 
-# List of stock symbols
-stocks = ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'TSLA']
+def needs_backfill(latest_date=None, full_backfill=False, backfill_cursor=None):
+    """
+    Return whether a symbol is fetched by walking back through its history rather than forward from its watermark.
+    """
+    return full_backfill or latest_date is None or backfill_cursor is not None
 
-# Define the start and end dates for historical data
-# start_date = '2020-01-01'
-# end_date = '2023-01-01'
 
-# Flag for full backfill
-FULL_BACKFILL = '--full-backfill' in sys.argv
+def fetch_symbol_history_chunks(
+        stock,
+        latest_date=None,
+        full_backfill=False,
+        chunk_years=DEFAULT_CHUNK_YEARS,
+        backfill_cursor=None
+        ):
+    """
+    Download the missing daily history of a single symbol, one date range at a time.
 
-# Fetch historical data for each stock
-for stock in stocks:
-    ticker = yf.Ticker(stock)
+    A backfill walks back in time from today, or from the cursor of an interrupted backfill, and
+    ends once BACKFILL_EMPTY_RANGES_TO_STOP consecutive ranges come back empty.
 
-    # Query the latest date in the database for the current stock
-    latest_date_results = execute_select(conn, "SELECT MAX(datetime) FROM historical_stock_data WHERE symbol = %s", (stock,))
-    latest_date = latest_date_results[0][0] if latest_date_results else None
+    Parameters:
+        stock (str): Stock symbol.
+        latest_date (datetime, optional): Latest stored bar of the symbol, None if it has no data yet.
+        full_backfill (bool): Fetch the full available history regardless of what is stored.
+        chunk_years (int): Length of each downloaded date range, in years.
+        backfill_cursor (datetime, optional): Start of the oldest range written by an interrupted backfill.
 
-    # Get the current date
+    Yields:
+        tuple: First day of the range and its history, possibly empty; nothing when the symbol is up to date.
+    """
     current_date = datetime.datetime.now().date()
+    end_date = current_date + datetime.timedelta(days=1)
+    chunk_length = datetime.timedelta(days=365 * chunk_years)
 
-    # If there's no data yet for this stock or the flag for full backfill is specified, fetch a longer history
-    if FULL_BACKFILL or latest_date is None:
-        logger.info(f"Fetching full history for {stock}.")
-        hist_data = ticker.history(period="max")
+    # If there's no data yet for this stock or the flag for full backfill is specified, fetch the whole history
+    if needs_backfill(latest_date, full_backfill, backfill_cursor):
+        if backfill_cursor is not None:
+            end_date = backfill_cursor.date()
+            logger.info(f"Resuming the backfill of {stock} before {end_date} in {chunk_years}-year chunks.")
+        else:
+            logger.info(f"Fetching full history for {stock} in {chunk_years}-year chunks.")
+        num_records = 0
+        empty_ranges = 0
+        # The first trading day is unknown, so walk back from today until the ranges come back empty
+        while end_date > BACKFILL_EARLIEST_DATE and empty_ranges < BACKFILL_EMPTY_RANGES_TO_STOP:
+            start_date = max(end_date - chunk_length, BACKFILL_EARLIEST_DATE)
+            hist_data = fetch_symbol_history(stock, start_date, end_date)
+            num_records += len(hist_data)
+            empty_ranges = empty_ranges + 1 if hist_data.empty else 0
+            yield start_date, hist_data
+            end_date = start_date
 
         # Log the number of records fetched for full backfill
-        num_records = len(hist_data)
         logger.info(f"Fetched {num_records} records for full backfill of {stock}.")
-
         if num_records == 0:
             logger.warning(f"No data available to insert for full backfill of {stock}.")
 
     elif latest_date.date() < current_date:
         # Fetch data from the day after the latest date
         start_date = latest_date.date() + datetime.timedelta(days=1)
-        end_date = current_date + datetime.timedelta(days=1)
-
         logger.info(f"Fetching incremental data for {stock} from {start_date} to {end_date}.")
-        hist_data = ticker.history(start=start_date, end=end_date)
-
-        # Log the number of records fetched
-        num_records = len(hist_data)
-        logger.info(f"Fetched {num_records} records for {stock}.")
-        if num_records == 0:
-            logger.info(f"No new data available to insert for {stock}.")
+        while start_date < end_date:
+            chunk_end_date = min(start_date + chunk_length, end_date)
+            hist_data = fetch_symbol_history(stock, start_date, chunk_end_date)
+            logger.info(f"Fetched {len(hist_data)} records for {stock} up to {chunk_end_date}.")
+            yield start_date, hist_data
+            start_date = chunk_end_date
     else:
         logger.info(f"No new data to fetch for {stock}.")
-        continue
-
-    # Insert data into the database
-    for index, row in hist_data.iterrows():
-        data_values = (
-            stock,
-            index.to_pydatetime(),
-            row['Open'],
-            row['High'],
-            row['Low'],
-            row['Close'],
-            row['Volume']
-        )
-        insert_data(
-            conn,
+
+
+def history_to_rows(stock, hist_data):
+    """
+    Convert a yfinance history into plain row tuples, one column at a time rather than one row at a time.
+
+    Returns:
+        list: (symbol, datetime, open, high, low, close, volume) tuples.
+    """
+    columns = [hist_data[column].to_numpy().tolist() for column in HISTORY_COLUMNS]
+    return list(zip([stock] * len(hist_data), hist_data.index.to_pydatetime(), *columns))
+
+
+def write_history_rows(conn, rows, backfill_cursors=None, completed_backfills=()):
+    """
+    Bulk insert history rows of any number of symbols in a single transaction.
+
+    The watermark of a symbol being backfilled is left unchanged: the start of its oldest written
+    range is stored as its backfill cursor instead, and its watermark is only set once its backfill
+    is complete, so an interrupted backfill is resumed by the next run rather than lost.
+
+    Parameters:
+        conn: The database connection object.
+        rows (list): Row tuples as returned by history_to_rows, possibly empty.
+        backfill_cursors (dict, optional): Symbol being backfilled mapped to the start of its oldest range in rows.
+        completed_backfills (iterable): Symbols whose backfill is complete once rows are written.
+
+    A failed write raises after rolling back, leaving the cursors and watermarks of its symbols
+    unchanged; the caller marks those symbols failed rather than written.
+
+    Returns:
+        int: Number of rows inserted.
+    """
+    state_statements = [
+        backfill_cursor_statement(HISTORICAL_STOCK_DATA_TABLE_NAME, stock, cursor)
+        for stock, cursor in (backfill_cursors or {}).items()
+    ]
+    completion_statements = backfill_completion_statements(
+        HISTORICAL_STOCK_DATA_TABLE_NAME, completed_backfills, HISTORICAL_TABLE_FULLNAME
+    ) if completed_backfills else []
+
+    if not rows:
+        with conn.cursor() as cursor:
+            for statement, params in completion_statements:
+                cursor.execute(statement, params)
+        conn.commit()
+        return 0
+
+    # Create the partitions of the batch's date range before writing, in case it is a backfill
+    datetimes = [row[1] for row in rows]
+    ensure_partitions(
+        conn,
+        db_schema=DB_RAW_DATA_SCHEMA,
+        db_table_name=HISTORICAL_STOCK_DATA_TABLE_NAME,
+        partitioning=HISTORICAL_STOCK_DATA_TABLE_PARTITIONING,
+        start=min(datetimes),
+        end=max(datetimes)
+    )
+    inserted, _ = bulk_insert_data(
+        conn,
+        db_schema=DB_RAW_DATA_SCHEMA,
+        db_table_name=HISTORICAL_STOCK_DATA_TABLE_NAME,
+        table_columns=list(HISTORICAL_STOCK_DATA_TABLE_SCHEMA.keys()),
+        table_data=rows,
+        on_conflict_action='ON CONFLICT (symbol, datetime) DO NOTHING',
+        # One transaction, so the backfill cursors never move past rows that were not written
+        batch_size=len(rows),
+        post_merge_statements=[
+            *state_statements,
+            # Jobs checkpointed past the oldest written bar recompute from the mark: the indicators
+            # consume the default marks, the risk statistics their own
+            low_water_mark_statement(HISTORICAL_STOCK_DATA_TABLE_NAME, below_watermark=False),
+            low_water_mark_statement(
+                HISTORICAL_STOCK_DATA_TABLE_NAME, below_watermark=False, consumer=STOCK_RISK_STATISTICS_TABLE_NAME
+            ),
+            watermark_update_statement(HISTORICAL_STOCK_DATA_TABLE_NAME, skip_backfills=True),
+            change_notification_statement(HISTORICAL_TABLE_FULLNAME),
+            *completion_statements
+        ]
+    )
+    return inserted
+
+
+def history_to_bars(hist_data):
+    """
+    Convert a yfinance history into the bar layout of the Parquet sink.
+    """
+    return (
+        hist_data[HISTORY_COLUMNS]
+        .rename(columns=str.lower)
+        .rename_axis('datetime')
+        .reset_index()
+    )
+
+
+def fetch_historical_stock_data(
+        stocks,
+        full_backfill=False,
+        max_workers=None,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        parquet_sink=None,
+        chunk_years=None
+        ):
+    """
+    Fetch and store daily history for a universe of symbols.
+
+    The run is a three-stage pipeline connected by bounded queues: downloads yield the history of
+    each symbol in date-range chunks on a bounded worker pool, a transform stage turns each chunk
+    into plain row tuples, and a single writer bulk inserts them in batches. Peak memory is set by
+    the chunk and queue sizes rather than by the length of the histories, and network I/O overlaps
+    with the database writes. A failing symbol is recorded in the returned statuses and does not
+    stop the run; a failed or interrupted backfill is resumed by the next run from its cursor.
+
+    Parameters:
+        stocks (list): Stock symbols to fetch.
+        full_backfill (bool): Fetch the full available history for every symbol.
+        max_workers (int, optional): Maximum number of concurrent downloads, defaults to HISTORICAL_FETCH_MAX_WORKERS.
+        queue_size (int): Maximum number of chunks waiting between two stages.
+        parquet_sink (bool, optional): Also append the bars to the partitioned Parquet dataset, defaults to FTA_PARQUET_SINK.
+        chunk_years (int, optional): Length of each downloaded date range in years, defaults to HISTORICAL_FETCH_CHUNK_YEARS.
+
+    Returns:
+        dict: Status per symbol, one of "written", "up_to_date", "no_data" or "failed: <error>".
+    """
+    if max_workers is None:
+        max_workers = get_setting('HISTORICAL_FETCH_MAX_WORKERS', DEFAULT_MAX_WORKERS, int)
+    if chunk_years is None:
+        chunk_years = get_setting('HISTORICAL_FETCH_CHUNK_YEARS', DEFAULT_CHUNK_YEARS, int)
+    if parquet_sink is None:
+        parquet_sink = parquet_sink_enabled()
+
+    with db_session() as conn:
+        # Create table with the defined schema
+        create_table_with_schema(
+            connection=conn,
             db_schema=DB_RAW_DATA_SCHEMA,
             db_table_name=HISTORICAL_STOCK_DATA_TABLE_NAME,
-            table_columns=list(HISTORICAL_STOCK_DATA_TABLE_SCHEMA.keys()),
-            table_data=data_values
+            db_table_schema_definition=HISTORICAL_STOCK_DATA_TABLE_SCHEMA,
+            constraints=HISTORICAL_STOCK_DATA_TABLE_CONSTRAINTS,
+            partitioning=HISTORICAL_STOCK_DATA_TABLE_PARTITIONING,
+            indexes=HISTORICAL_STOCK_DATA_TABLE_INDEXES
         )
-    conn.commit()
+        create_ingestion_state_table(conn)
+
+        # Plan the whole run from the stored watermarks in one round-trip
+        watermarks = load_watermarks(
+            conn,
+            source=HISTORICAL_STOCK_DATA_TABLE_NAME,
+            data_table_fullname=HISTORICAL_TABLE_FULLNAME
+        )
+        backfill_cursors = load_backfill_cursors(conn, HISTORICAL_STOCK_DATA_TABLE_NAME)
+
+    if backfill_cursors:
+        logger.info(f"Resuming the interrupted backfills of {len(backfill_cursors)} symbols.")
+
+    statuses = {stock: 'pending' for stock in stocks}
+    backfills = {
+        stock for stock in statuses
+        if needs_backfill(watermarks.get(stock), full_backfill, backfill_cursors.get(stock))
+    }
+    sink = ParquetBarSink(HISTORICAL_BARS_DATASET) if parquet_sink else None
+    batch = []
+    batch_stocks = set()
+    batch_cursors = {}
+    completed_backfills = set()
+    inserted = 0
+
+    def fetch_stage(stock):
+        fetched_chunks = non_empty_chunks = 0
+        try:
+            for start_date, hist_data in fetch_symbol_history_chunks(
+                    stock, watermarks.get(stock), full_backfill, chunk_years, backfill_cursors.get(stock)
+                    ):
+                fetched_chunks += 1
+                if not hist_data.empty:
+                    non_empty_chunks += 1
+                    yield stock, start_date, hist_data
+        except Exception as e:
+            logger.error(f"Failed to fetch historical data for {stock}: ", exc_info=e)
+            statuses[stock] = f'failed: {e}'
+            return
+        if not fetched_chunks:
+            statuses[stock] = 'up_to_date'
+        elif not non_empty_chunks:
+            statuses[stock] = 'no_data'
+        # Tell the writer the whole history of the symbol went through, so its backfill can be closed
+        if stock in backfills:
+            yield stock, None, None
+
+    def transform_stage(chunk):
+        stock, start_date, hist_data = chunk
+        if hist_data is None:
+            yield stock, None, None, None
+            return
+        with span('historical_stock_data.transform', stock):
+            rows = history_to_rows(stock, hist_data)
+            bars = history_to_bars(hist_data) if sink is not None else None
+        yield stock, start_date, rows, bars
+
+    def flush():
+        nonlocal inserted
+        if not batch and not completed_backfills:
+            return
+        try:
+            with span('historical_stock_data.write'):
+                inserted += write_history_rows(conn, batch, batch_cursors, completed_backfills)
+        except Exception as e:
+            conn.rollback()
+            failed_stocks = batch_stocks | completed_backfills
+            logger.error(f"Failed to write historical data for {', '.join(sorted(failed_stocks))}: ", exc_info=e)
+            for stock in failed_stocks:
+                statuses[stock] = f'failed: {e}'
+        else:
+            for stock in batch_stocks:
+                if statuses[stock] == 'pending':
+                    statuses[stock] = 'written'
+        batch.clear()
+        batch_stocks.clear()
+        batch_cursors.clear()
+        completed_backfills.clear()
+
+    def write_stage(chunk):
+        stock, start_date, rows, bars = chunk
+        if statuses[stock].startswith('failed'):
+            return
+        if rows is None:
+            completed_backfills.add(stock)
+            return
+        batch.extend(rows)
+        batch_stocks.add(stock)
+        if stock in backfills:
+            # Ranges of a backfill arrive newest first, so the last one is the oldest
+            batch_cursors[stock] = start_date
+        if sink is not None:
+            sink.append(stock, bars)
+        if len(batch) >= WRITE_BATCH_ROWS:
+            flush()
+
+    logger.info(f"Fetching historical data for {len(statuses)} symbols with {max_workers} workers.")
+
+    with db_session() as conn:
+        pipeline = (
+            Pipeline('historical_stock_data', queue_size=queue_size)
+            .stage('fetch', fetch_stage, workers=max_workers)
+            .stage('transform', transform_stage)
+            .stage('write', write_stage, finish=flush)
+        )
+        pipeline.run(statuses)
+
+    if sink is not None:
+        sink.compact()
+
+    failed = [stock for stock, status in statuses.items() if status.startswith('failed')]
+    logger.info(
+        f"Finished historical data run: {len(statuses) - len(failed)} symbols succeeded, "
+        f"{len(failed)} failed, {inserted} new rows."
+    )
+    if failed:
+        logger.warning(f"Failed symbols: {', '.join(failed)}.")
+    get_response_cache().log_stats(logger)
+    get_metrics().log_summary(logger)
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch daily historical stock data from Yahoo Finance.')
+    parser.add_argument('--full-backfill', action='store_true', help='Fetch the full available history.')
+    # The symbols come from one source only, so neither flag silently overrides the other
+    symbols_source = parser.add_mutually_exclusive_group()
+    symbols_source.add_argument('--symbols-file', help='File with one symbol per line.')
+    symbols_source.add_argument(
+        '--symbols-from-db', action='store_true', help='Read active symbols from the universe table.'
+    )
+    parser.add_argument('--max-workers', type=int, help='Concurrent downloads, defaults to HISTORICAL_FETCH_MAX_WORKERS.')
+    parser.add_argument('--parquet', action='store_true', help='Also write bars to the Parquet dataset.')
+    parser.add_argument(
+        '--chunk-years', type=int, help='Length of each downloaded date range in years, defaults to HISTORICAL_FETCH_CHUNK_YEARS.'
+    )
+    args = parser.parse_args()
+
+    if args.symbols_from_db:
+        with db_session() as conn:
+            create_table_with_schema(
+                connection=conn,
+                db_schema=DB_RAW_DATA_SCHEMA,
+                db_table_name=SYMBOL_UNIVERSE_TABLE_NAME,
+                db_table_schema_definition=SYMBOL_UNIVERSE_TABLE_SCHEMA,
+                constraints=SYMBOL_UNIVERSE_TABLE_CONSTRAINTS
+            )
+            stocks = load_symbol_universe(connection=conn)
+    else:
+        stocks = load_symbol_universe(path=args.symbols_file)
 
-    # Print some info
-    # print(f"Showing fetched historical data for {stock}:")
-    # print(hist_data.head())
-    logger.info(f"Completed fetching data for {stock}.")
+    fetch_historical_stock_data(
+        stocks,
+        full_backfill=args.full_backfill,
+        max_workers=args.max_workers,
+        parquet_sink=args.parquet or None,
+        chunk_years=args.chunk_years
+    )
 
-    # Test: save data to a CSV file
-    # hist_data.to_csv(f"{stock}_historical_data.csv")
 
-# Close the connection
-conn.close()
-logger.info("Database connection closed.")
+if __name__ == "__main__":
+    main()
@@ -1,123 +1,265 @@
-from alpha_vantage.timeseries import TimeSeries
-from alpha_vantage.techindicators import TechIndicators
-from dotenv import load_dotenv
 from utils.constants import (
     DB_RAW_DATA_SCHEMA,
+    DEFAULT_STOCK_SYMBOLS,
     INTRADAY_STOCK_DATA_TABLE_NAME,
     INTRADAY_STOCK_DATA_TABLE_SCHEMA,
     INTRADAY_STOCK_DATA_TABLE_CONSTRAINTS,
-    STOCK_SMA_DATA_TABLE_NAME,
-    STOCK_SMA_DATA_TABLE_SCHEMA,
-    STOCK_SMA_DATA_TABLE_CONSTRAINTS
+    INTRADAY_STOCK_DATA_TABLE_INDEXES,
+    INTRADAY_STOCK_DATA_TABLE_PARTITIONING
+)
+from utils.cache import get_response_cache
+from utils.columnar_storage import (
+    INTRADAY_BARS_DATASET,
+    ParquetBarSink,
+    parquet_sink_enabled
 )
 from utils.database import (
-    get_db_connection,
+    db_session,
     create_table_with_schema,
-    insert_data,
-    execute_select
+    bulk_insert_data,
+    ensure_partitions
+)
+from utils.environment import load_environment
+from utils.events import change_notification_statement
+from utils.ingestion_state import (
+    create_ingestion_state_table,
+    load_watermarks,
+    low_water_mark_statement,
+    watermark_update_statement
 )
-from utils.logging import setup_logger
+from utils.logging import get_metrics, setup_logger
+from utils.pipeline import Pipeline
+from utils.profiling import span
+from utils.rate_limiting import get_alpha_vantage_scheduler
 import os
 import sys
 
 
-# Load environment variables from .env file
-load_dotenv()
+logger = setup_logger(name='fetch_intraday_stock_data')
 
-logger = setup_logger(name='fetch_intraday_stock_and_sma_data')
+# Rows of a fetched response handed to the next stage at a time
+INTRADAY_CHUNK_ROWS = 5000
 
-# Establish a database connection
-conn = get_db_connection()
+# Maximum number of chunks waiting between two stages of the ingestion pipeline
+DEFAULT_QUEUE_SIZE = 16
 
-# Create tables with the defined schemas
-create_table_with_schema(
-    connection=conn,
-    db_schema=DB_RAW_DATA_SCHEMA,
-    db_table_name=INTRADAY_STOCK_DATA_TABLE_NAME,
-    db_table_schema_definition=INTRADAY_STOCK_DATA_TABLE_SCHEMA,
-    constraints=INTRADAY_STOCK_DATA_TABLE_CONSTRAINTS
-)
+# Rows buffered by the writer before a bulk insert
+WRITE_BATCH_ROWS = 20000
 
-create_table_with_schema(
-    connection=conn,
-    db_schema=DB_RAW_DATA_SCHEMA,
-    db_table_name=STOCK_SMA_DATA_TABLE_NAME,
-    db_table_schema_definition=STOCK_SMA_DATA_TABLE_SCHEMA,
-    constraints=STOCK_SMA_DATA_TABLE_CONSTRAINTS
-)
+INTRADAY_COLUMNS = ['1. open', '2. high', '3. low', '4. close', '5. volume']
 
-api_key = os.getenv('ALPHA_VANTAGE_API_KEY')
-
-# List of stock symbols
-stocks = ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'TSLA']
-
-# Flag for full backfill
-FULL_BACKFILL = '--full-backfill' in sys.argv
-
-# Initialize TimeSeries and TechIndicators class
-ts = TimeSeries(key=api_key, output_format='pandas')
-ti = TechIndicators(key=api_key, output_format='pandas')
-
-for symbol in stocks:
-    if FULL_BACKFILL:
-        logger.info(f"Performing full backfill for intraday data of {symbol}.")
-        intraday_data, _ = ts.get_intraday(symbol=symbol, interval='1min', outputsize='full')
-    else:
-        logger.info(f"Fetching incremental intraday data for {symbol}.")
-        last_datetime_results = execute_select(conn, "SELECT MAX(datetime) FROM intraday_stock_data WHERE symbol = %s", (symbol,))
-        last_datetime = last_datetime_results[0][0] if last_datetime_results else None
-        outputsize = 'compact' if last_datetime is not None else 'full'
-        intraday_data, _ = ts.get_intraday(symbol=symbol, interval='1min', outputsize=outputsize)
-
-    # Insert intraday data
-    for index, row in intraday_data.iterrows():
-        data_values = (
-            symbol,
-            index.to_pydatetime(),
-            row['1. open'],
-            row['2. high'],
-            row['3. low'],
-            row['4. close'],
-            row['5. volume']
-        )
-        insert_data(
+def create_time_series(api_key):
+    """
+    Create the Alpha Vantage TimeSeries client, importing alpha_vantage only when a fetch runs.
+    """
+    from alpha_vantage.timeseries import TimeSeries
+    return TimeSeries(key=api_key, output_format='pandas')
+
+
+def intraday_to_rows(symbol, intraday_data):
+    """
+    Convert 1-minute bars as returned by TimeSeries.get_intraday into plain row tuples, column by column.
+
+    Returns:
+        list: (symbol, datetime, open, high, low, close, volume) tuples.
+    """
+    columns = [intraday_data[column].to_numpy().tolist() for column in INTRADAY_COLUMNS[:4]]
+    volumes = intraday_data['5. volume'].to_numpy().astype('int64').tolist()
+    return list(zip([symbol] * len(intraday_data), intraday_data.index.to_pydatetime(), *columns, volumes))
+
+
+def write_intraday_rows(conn, rows):
+    """
+    Bulk insert 1-minute bar rows of any number of symbols.
+
+    A failed write raises after rolling back, so the caller marks the symbols of the batch failed.
+
+    Returns:
+        int: Number of rows inserted.
+    """
+    # Create the partitions of the batch's date range before writing, in case it is a backfill
+    datetimes = [row[1] for row in rows]
+    ensure_partitions(
+        conn,
+        db_schema=DB_RAW_DATA_SCHEMA,
+        db_table_name=INTRADAY_STOCK_DATA_TABLE_NAME,
+        partitioning=INTRADAY_STOCK_DATA_TABLE_PARTITIONING,
+        start=min(datetimes),
+        end=max(datetimes)
+    )
+    inserted, _ = bulk_insert_data(
+        connection=conn,
+        db_schema=DB_RAW_DATA_SCHEMA,
+        db_table_name=INTRADAY_STOCK_DATA_TABLE_NAME,
+        table_columns=['symbol', 'datetime', 'open', 'high', 'low', 'close', 'volume'],
+        table_data=rows,
+        on_conflict_action='ON CONFLICT (symbol, datetime) DO NOTHING',
+        post_merge_statements=[
+            # Rows below the watermarks, e.g. of a full backfill, are rolled up again from the low-water marks
+            low_water_mark_statement(INTRADAY_STOCK_DATA_TABLE_NAME),
+            watermark_update_statement(INTRADAY_STOCK_DATA_TABLE_NAME),
+            change_notification_statement(f'{DB_RAW_DATA_SCHEMA}.{INTRADAY_STOCK_DATA_TABLE_NAME}')
+        ]
+    )
+    return inserted
+
+
+def intraday_to_bars(intraday_data):
+    """
+    Convert TimeSeries.get_intraday output into the bar layout of the Parquet sink.
+    """
+    return (
+        intraday_data[INTRADAY_COLUMNS]
+        .rename(columns=lambda column: column.split('. ', 1)[1])
+        .rename_axis('datetime')
+        .reset_index()
+    )
+
+
+def fetch_intraday_stock_data(
+        stocks,
+        full_backfill=False,
+        parquet_sink=None,
+        queue_size=DEFAULT_QUEUE_SIZE
+        ):
+    """
+    Fetch and store intraday bars for a list of symbols.
+
+    The run is a three-stage pipeline connected by bounded queues: fetches split each response into
+    chunks, a transform stage turns each chunk into plain row tuples, and a single writer bulk
+    inserts them in batches, so writes overlap with the calls still waiting for request budget.
+    All Alpha Vantage calls go through the shared request scheduler, which runs them concurrently
+    within the configured per-minute and per-day budget and retries throttled calls with backoff.
+    Daily indicators such as the SMA are computed locally by data_processing.compute_technical_indicators.
+    A failing symbol is recorded in the returned statuses and does not stop the run.
+
+    Parameters:
+        stocks (list): Stock symbols to fetch.
+        full_backfill (bool): Fetch the full intraday history instead of the latest bars.
+        parquet_sink (bool, optional): Also append the bars to the partitioned Parquet dataset, defaults to FTA_PARQUET_SINK.
+        queue_size (int): Maximum number of chunks waiting between two stages.
+
+    Returns:
+        dict: Status per symbol, one of "written", "no_data" or "failed: <error>".
+    """
+    load_environment()
+    api_key = os.getenv('ALPHA_VANTAGE_API_KEY')
+    if parquet_sink is None:
+        parquet_sink = parquet_sink_enabled()
+    scheduler = get_alpha_vantage_scheduler()
+    cache = get_response_cache()
+
+    # Initialize TimeSeries class
+    ts = scheduler.wrap(create_time_series(api_key), cache=cache, namespace='alpha_vantage')
+    sink = ParquetBarSink(INTRADAY_BARS_DATASET) if parquet_sink else None
+
+    with db_session() as conn:
+        # Create table with the defined schema
+        create_table_with_schema(
             connection=conn,
             db_schema=DB_RAW_DATA_SCHEMA,
             db_table_name=INTRADAY_STOCK_DATA_TABLE_NAME,
-            table_columns=['symbol', 'datetime', 'open', 'high', 'low', 'close', 'volume'],
-            table_data=data_values,
-            on_conflict_action='ON CONFLICT (symbol, datetime) DO NOTHING'
+            db_table_schema_definition=INTRADAY_STOCK_DATA_TABLE_SCHEMA,
+            constraints=INTRADAY_STOCK_DATA_TABLE_CONSTRAINTS,
+            partitioning=INTRADAY_STOCK_DATA_TABLE_PARTITIONING,
+            indexes=INTRADAY_STOCK_DATA_TABLE_INDEXES
+        )
+        create_ingestion_state_table(conn)
+
+        # Plan the whole run from the stored watermarks in one round-trip
+        watermarks = {} if full_backfill else load_watermarks(
+            conn,
+            source=INTRADAY_STOCK_DATA_TABLE_NAME,
+            data_table_fullname=f'{DB_RAW_DATA_SCHEMA}.{INTRADAY_STOCK_DATA_TABLE_NAME}'
+        )
+
+    statuses = {symbol: 'pending' for symbol in stocks}
+    batch = []
+    batch_symbols = set()
+    inserted = 0
+
+    def fetch_stage(symbol):
+        if full_backfill:
+            logger.info(f"Performing full backfill for intraday data of {symbol}.")
+            outputsize = 'full'
+        else:
+            logger.info(f"Fetching incremental intraday data for {symbol}.")
+            outputsize = 'compact' if symbol in watermarks else 'full'
+        try:
+            with span('intraday_stock_data.fetch', symbol):
+                intraday_data, _ = ts.get_intraday(symbol=symbol, interval='1min', outputsize=outputsize)
+        except Exception as e:
+            logger.error(f"Failed to fetch intraday data for {symbol}: {e}")
+            statuses[symbol] = f'failed: {e}'
+            return
+        if intraday_data.empty:
+            statuses[symbol] = 'no_data'
+        for start in range(0, len(intraday_data), INTRADAY_CHUNK_ROWS):
+            yield symbol, intraday_data.iloc[start:start + INTRADAY_CHUNK_ROWS]
+
+    def transform_stage(chunk):
+        symbol, intraday_data = chunk
+        with span('intraday_stock_data.transform', symbol):
+            rows = intraday_to_rows(symbol, intraday_data)
+            bars = intraday_to_bars(intraday_data) if sink is not None else None
+        yield symbol, rows, bars
+
+    def flush():
+        nonlocal inserted
+        if not batch:
+            return
+        try:
+            with span('intraday_stock_data.write'):
+                inserted += write_intraday_rows(conn, batch)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Failed to write {len(batch)} intraday rows: {e}")
+            for symbol in batch_symbols:
+                statuses[symbol] = f'failed: {e}'
+        else:
+            for symbol in batch_symbols:
+                if statuses[symbol] == 'pending':
+                    statuses[symbol] = 'written'
+        batch.clear()
+        batch_symbols.clear()
+
+    def write_stage(chunk):
+        symbol, rows, bars = chunk
+        # Later chunks of a symbol whose write failed would move its watermark past the missing bars
+        if statuses[symbol].startswith('failed'):
+            return
+        batch.extend(rows)
+        batch_symbols.add(symbol)
+        if sink is not None:
+            sink.append(symbol, bars)
+        if len(batch) >= WRITE_BATCH_ROWS:
+            flush()
+
+    with db_session() as conn:
+        pipeline = (
+            Pipeline('intraday_stock_data', queue_size=queue_size)
+            .stage('fetch', fetch_stage, workers=scheduler.max_workers)
+            .stage('transform', transform_stage)
+            .stage('write', write_stage, finish=flush)
         )
+        pipeline.run(statuses)
+
+    failed = [symbol for symbol, status in statuses.items() if status.startswith('failed')]
+    logger.info(
+        f"Finished intraday data run: {len(statuses) - len(failed)} symbols succeeded, "
+        f"{len(failed)} failed, {inserted} new rows."
+    )
+    if sink is not None:
+        sink.compact()
+    scheduler.log_budget()
+    cache.log_stats(logger)
+    get_metrics().log_summary(logger)
+    return statuses
+
 
-    try:
-        sma_data, _ = ti.get_sma(symbol=symbol, interval='daily', time_period=20)
-        # Insert SMA data
-        for index, row in sma_data.iterrows():
-            data_values = (
-                symbol,
-                index.date(),
-                row['SMA']
-            )
-            insert_data(
-                connection=conn,
-                db_schema=DB_RAW_DATA_SCHEMA,
-                db_table_name=STOCK_SMA_DATA_TABLE_NAME,
-                table_columns=['symbol', 'datetime', 'sma'],
-                table_data=data_values,
-                on_conflict_action='ON CONFLICT (symbol, datetime) DO NOTHING'
-            )
-    except ValueError as e:
-        logger.error(f"API rate limit hit when fetching SMA data for {symbol}: {e}")
-        # Optionally wait and retry or just log and continue/stop
-        # time.sleep(60)  # Wait for a minute (adjust as needed)
-        continue  # Skip to the next symbol or use break to stop the loop
-
-    logger.info(f"Intraday and SMA data inserted for {symbol}")
-
-    # Plotting (for testing)
-    # intraday_data['4. close'].plot()
-    # plt.title(f'Intraday TimeSeries for {symbol}')
-    # plt.show()
-
-# Close the database connection
-conn.close()
+if __name__ == "__main__":
+    fetch_intraday_stock_data(
+        DEFAULT_STOCK_SYMBOLS,
+        full_backfill='--full-backfill' in sys.argv,
+        parquet_sink='--parquet' in sys.argv or None
+    )
@@ -0,0 +1,411 @@
+"""
+Long-running intraday ingestion: polls the latest 1-minute bars of each symbol during market
+hours, stores only the bars newer than the last one seen, and publishes an event per symbol
+with new bars so that downstream stages can react to them.
+
+Each symbol has its own poll interval, which doubles after every poll without new bars (illiquid
+symbols, halts, holidays) and resets as soon as new bars arrive. Outside market hours symbols
+sleep until the next session opens. The freshness of every stored bar, from the end of its
+minute to its commit, is recorded in the intraday.freshness_seconds histogram.
+
+Usage (from the fintrendanalyser directory):
+    python -m data_ingestion.poll_intraday_stock_data
+    python -m data_ingestion.poll_intraday_stock_data --symbols-file symbols.txt --rollups
+"""
+from utils.constants import (
+    DB_RAW_DATA_SCHEMA,
+    INTRADAY_STOCK_DATA_TABLE_NAME,
+    INTRADAY_STOCK_DATA_TABLE_SCHEMA,
+    INTRADAY_STOCK_DATA_TABLE_CONSTRAINTS,
+    INTRADAY_STOCK_DATA_TABLE_INDEXES,
+    INTRADAY_STOCK_DATA_TABLE_PARTITIONING
+)
+from concurrent.futures import FIRST_COMPLETED, wait
+from data_ingestion.fetch_intraday_stock_data import (
+    create_time_series,
+    intraday_to_rows,
+    write_intraday_rows
+)
+from utils.database import db_session, create_table_with_schema, execute_select
+from utils.environment import get_setting, load_environment
+from utils.events import INTRADAY_BARS_TOPIC, get_event_bus
+from utils.ingestion_state import create_ingestion_state_table
+from utils.logging import get_metrics, setup_logger
+from utils.profiling import span
+from utils.rate_limiting import RateLimitBudgetExhausted, get_alpha_vantage_scheduler
+from utils.universe import load_symbol_universe
+from zoneinfo import ZoneInfo
+import argparse
+import datetime
+import heapq
+import os
+import signal
+import threading
+import time
+
+
+logger = setup_logger(name='poll_intraday_stock_data')
+
+# Regular session of the US exchanges; Alpha Vantage timestamps are in this time zone
+MARKET_TIMEZONE = ZoneInfo('America/New_York')
+MARKET_OPEN = datetime.time(9, 30)
+MARKET_CLOSE = datetime.time(16, 0)
+
+# Bars of the last minutes of a session are still published for a while after the close
+POST_CLOSE_GRACE = datetime.timedelta(minutes=20)
+
+# Seconds between polls of a symbol getting new bars, and upper bound of its backoff without new bars;
+# overridable with INTRADAY_POLL_INTERVAL_SECONDS and INTRADAY_MAX_POLL_INTERVAL_SECONDS
+DEFAULT_POLL_INTERVAL = 60
+DEFAULT_MAX_POLL_INTERVAL = 900
+
+# Seconds after the open of a session at which the first polls are due
+SESSION_START_DELAY = 65
+
+# Seconds between status lines, and between checks of the stop flag while waiting
+STATUS_INTERVAL = 300
+STOP_CHECK_INTERVAL = 1.0
+
+# Seconds to wait before reconnecting after the database connection broke
+RECONNECT_DELAY = 30
+
+# Freshness histogram buckets in seconds, from 1 second to about 2 hours (delayed feeds lag by 15 minutes)
+FRESHNESS_BUCKETS = tuple(2.0 ** exponent for exponent in range(14))
+
+BAR_LENGTH = datetime.timedelta(minutes=1)
+
+RAW_TABLE_FULLNAME = f'{DB_RAW_DATA_SCHEMA}.{INTRADAY_STOCK_DATA_TABLE_NAME}'
+
+
+def session_bounds(day):
+    """
+    Return the open and the end of the polling window (close plus grace) of a trading day, as aware datetimes.
+    """
+    opens_at = datetime.datetime.combine(day, MARKET_OPEN, tzinfo=MARKET_TIMEZONE)
+    closes_at = datetime.datetime.combine(day, MARKET_CLOSE, tzinfo=MARKET_TIMEZONE) + POST_CLOSE_GRACE
+    return opens_at, closes_at
+
+
+def is_polling_window(moment):
+    """
+    Tell whether new bars can appear at a moment: a weekday between the open and the close plus grace.
+
+    Exchange holidays are not known here; symbols simply back off to the maximum interval on them.
+    """
+    local = moment.astimezone(MARKET_TIMEZONE)
+    if local.weekday() >= 5:
+        return False
+    opens_at, closes_at = session_bounds(local.date())
+    return opens_at <= local < closes_at
+
+
+def next_session_open(moment):
+    """
+    Return the open of the next session starting after a moment, as an aware datetime.
+    """
+    day = moment.astimezone(MARKET_TIMEZONE).date()
+    while True:
+        opens_at, _ = session_bounds(day)
+        if day.weekday() < 5 and opens_at > moment:
+            return opens_at
+        day += datetime.timedelta(days=1)
+
+
+def bar_freshness(bar_start, written_at):
+    """
+    Seconds between the end of a bar, given as Alpha Vantage's naive market-time start, and its commit.
+    """
+    return (written_at - (bar_start.replace(tzinfo=MARKET_TIMEZONE) + BAR_LENGTH)).total_seconds()
+
+
+def load_last_seen(conn, symbols):
+    """
+    Load the latest stored bar of each symbol, the starting point of the in-memory last-seen timestamps.
+
+    Returns:
+        dict: Symbol mapped to the naive datetime of its latest bar, for symbols with stored bars.
+    """
+    rows = execute_select(
+        conn,
+        f'SELECT symbol, MAX(datetime) FROM {RAW_TABLE_FULLNAME} WHERE symbol = ANY(%s) GROUP BY symbol',
+        (list(symbols),)
+    )
+    conn.rollback()
+    return dict(rows)
+
+
+class SymbolSchedule:
+    """
+    Poll times of a set of symbols, kept in a heap ordered by due time.
+
+    A symbol's interval doubles, up to max_interval, after every poll that brought no new bars,
+    and resets to interval when one does.
+    """
+
+    def __init__(self, symbols, interval=DEFAULT_POLL_INTERVAL, max_interval=DEFAULT_MAX_POLL_INTERVAL):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.intervals = {symbol: interval for symbol in symbols}
+        now = time.time()
+        self._heap = [(now, symbol) for symbol in symbols]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def next_due(self):
+        """
+        Return the epoch time at which the next symbol is due, None when no symbol is scheduled.
+        """
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """
+        Remove and return the next symbol if it is due, else None.
+        """
+        if self._heap and self._heap[0][0] <= now:
+            return heapq.heappop(self._heap)[1]
+        return None
+
+    def reschedule(self, symbol, got_new_bars, now=None):
+        """
+        Schedule the next poll of a symbol after a poll, at the next session open when the market is closed.
+
+        Returns:
+            float: Epoch time of the next poll.
+        """
+        now = time.time() if now is None else now
+        if got_new_bars:
+            self.intervals[symbol] = self.interval
+        else:
+            self.intervals[symbol] = min(self.intervals[symbol] * 2, self.max_interval)
+
+        due = now + self.intervals[symbol]
+        moment = datetime.datetime.fromtimestamp(due, datetime.timezone.utc)
+        if not is_polling_window(moment):
+            # Start the next session with a fresh interval
+            self.intervals[symbol] = self.interval
+            due = next_session_open(moment).timestamp() + SESSION_START_DELAY
+        heapq.heappush(self._heap, (due, symbol))
+        return due
+
+
+def subscribe_rollups(event_bus):
+    """
+    Refresh the intraday rollups whenever new bars are published.
+
+    A refresh covers every bar committed before it started, so events of bars written before the
+    start of the previous refresh are skipped, and a burst of events triggers a single refresh.
+
+    Returns:
+        callable: Function removing the subscription.
+    """
+    from data_processing.rollup_intraday_bars import rollup_intraday_bars
+
+    last_refresh = None
+
+    def refresh_rollups(event):
+        nonlocal last_refresh
+        if last_refresh is not None and event['written_at'] <= last_refresh:
+            return
+        last_refresh = datetime.datetime.now(datetime.timezone.utc)
+        with get_metrics().timer('intraday.rollup_refresh_seconds'):
+            rollup_intraday_bars()
+
+    return event_bus.subscribe(INTRADAY_BARS_TOPIC, refresh_rollups)
+
+
+def poll_intraday_stock_data(
+        stocks,
+        interval=None,
+        max_interval=None,
+        stop_event=None
+        ):
+    """
+    Poll and store the new intraday bars of a list of symbols until stopped.
+
+    Calls go through the shared Alpha Vantage scheduler, with at most as many polls in flight as it
+    has workers, and skip the response cache since every poll must see the latest bars. Responses
+    are written by the calling thread on a single pooled connection, held for the whole run.
+
+    Parameters:
+        stocks (list): Stock symbols to poll.
+        interval (int, optional): Seconds between polls of a symbol getting new bars,
+            defaults to INTRADAY_POLL_INTERVAL_SECONDS.
+        max_interval (int, optional): Maximum seconds between polls of a symbol without new bars,
+            defaults to INTRADAY_MAX_POLL_INTERVAL_SECONDS.
+        stop_event (threading.Event, optional): Event stopping the polling once set.
+
+    Returns:
+        int: Number of rows inserted.
+    """
+    load_environment()
+    api_key = os.getenv('ALPHA_VANTAGE_API_KEY')
+    if interval is None:
+        interval = get_setting('INTRADAY_POLL_INTERVAL_SECONDS', DEFAULT_POLL_INTERVAL, int)
+    if max_interval is None:
+        max_interval = get_setting('INTRADAY_MAX_POLL_INTERVAL_SECONDS', DEFAULT_MAX_POLL_INTERVAL, int)
+    scheduler = get_alpha_vantage_scheduler()
+    ts = scheduler.wrap(create_time_series(api_key))
+    event_bus = get_event_bus()
+    metrics = get_metrics()
+    freshness = metrics.histogram('intraday.freshness_seconds', buckets=FRESHNESS_BUCKETS)
+    stop_event = stop_event or threading.Event()
+
+    schedule = SymbolSchedule(stocks, interval=interval, max_interval=max_interval)
+    last_seen = {}
+    in_flight = {}
+    inserted = 0
+    polls = 0
+    next_status = time.monotonic() + STATUS_INTERVAL
+
+    def handle_response(conn, symbol, future):
+        nonlocal inserted
+        try:
+            intraday_data, _ = future.result()
+        except RateLimitBudgetExhausted as e:
+            logger.warning(f'{e} Polling {symbol} again in {schedule.max_interval}s.')
+            schedule.intervals[symbol] = schedule.max_interval
+            return False
+        except Exception as e:
+            logger.error(f'Failed to poll intraday data for {symbol}: {e}')
+            return False
+
+        try:
+            with span('intraday_poll.transform', symbol):
+                previous = last_seen.get(symbol)
+                rows = [row for row in intraday_to_rows(symbol, intraday_data) if previous is None or row[1] > previous]
+        except Exception as e:
+            logger.error(f'Failed to read the intraday response of {symbol}: {e}')
+            return False
+        if not rows:
+            return False
+
+        try:
+            with span('intraday_poll.write', symbol):
+                inserted += write_intraday_rows(conn, rows)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f'Failed to write {len(rows)} intraday rows of {symbol}: {e}')
+            if conn.closed:
+                raise
+            return False
+
+        written_at = datetime.datetime.now(datetime.timezone.utc)
+        first, last = min(row[1] for row in rows), max(row[1] for row in rows)
+        last_seen[symbol] = last
+        for row in rows:
+            freshness.observe(max(bar_freshness(row[1], written_at), 0.0))
+        metrics.counter('intraday.polled_bars').inc(len(rows))
+        event_bus.publish(INTRADAY_BARS_TOPIC, {
+            'symbol': symbol,
+            'first': first,
+            'last': last,
+            'bars': len(rows),
+            'written_at': written_at,
+        })
+        return True
+
+    def poll(conn):
+        nonlocal polls, next_status
+        while not stop_event.is_set():
+            now = time.time()
+            while len(in_flight) < scheduler.max_workers:
+                symbol = schedule.pop_due(now)
+                if symbol is None:
+                    break
+                in_flight[ts.submit('get_intraday', symbol=symbol, interval='1min', outputsize='compact')] = symbol
+
+            next_due = schedule.next_due()
+            timeout = STOP_CHECK_INTERVAL if next_due is None else min(max(next_due - now, 0.0), STOP_CHECK_INTERVAL)
+            if in_flight:
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                stop_event.wait(timeout)
+                done = ()
+
+            for future in done:
+                symbol = in_flight.pop(future)
+                polls += 1
+                got_new_bars = False
+                try:
+                    got_new_bars = handle_response(conn, symbol, future)
+                finally:
+                    # Even when the connection is lost, so the symbol is polled again after reconnecting
+                    schedule.reschedule(symbol, got_new_bars)
+
+            if time.monotonic() >= next_status:
+                next_status = time.monotonic() + STATUS_INTERVAL
+                log_status()
+
+    def log_status():
+        snapshot = freshness.snapshot()
+        waiting = sorted(schedule.intervals.items(), key=lambda item: item[1], reverse=True)[:5]
+        backoff = ', '.join(f'{symbol} {seconds}s' for symbol, seconds in waiting if seconds > schedule.interval)
+        freshness_text = (
+            f"freshness p50 {snapshot['p50']:.0f}s, p95 {snapshot['p95']:.0f}s, max {snapshot['max']:.0f}s"
+            if snapshot['count'] else 'no new bars yet'
+        )
+        logger.info(
+            f'Polled {polls} times, {inserted} new rows, {freshness_text}'
+            f'{f"; backing off: {backoff}" if backoff else ""}.'
+        )
+        scheduler.log_budget()
+
+    logger.info(f'Polling intraday bars of {len(stocks)} symbols every {interval}s (backing off to {max_interval}s).')
+    while not stop_event.is_set():
+        try:
+            with db_session() as conn:
+                create_table_with_schema(
+                    connection=conn,
+                    db_schema=DB_RAW_DATA_SCHEMA,
+                    db_table_name=INTRADAY_STOCK_DATA_TABLE_NAME,
+                    db_table_schema_definition=INTRADAY_STOCK_DATA_TABLE_SCHEMA,
+                    constraints=INTRADAY_STOCK_DATA_TABLE_CONSTRAINTS,
+                    partitioning=INTRADAY_STOCK_DATA_TABLE_PARTITIONING,
+                    indexes=INTRADAY_STOCK_DATA_TABLE_INDEXES
+                )
+                create_ingestion_state_table(conn)
+                # Later polls only compare against memory; a reconnect reloads what other writers stored
+                last_seen.update(load_last_seen(conn, stocks))
+                poll(conn)
+        except Exception as e:
+            if stop_event.is_set():
+                break
+            logger.error(f'Intraday polling lost its database connection: {e}. Reconnecting in {RECONNECT_DELAY}s.')
+            stop_event.wait(RECONNECT_DELAY)
+
+    # Polls still waiting for request budget are dropped; their bars are fetched on the next start
+    for future in in_flight:
+        future.cancel()
+    log_status()
+    event_bus.close()
+    metrics.log_summary(logger)
+    return inserted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Continuously poll and store new intraday bars.')
+    parser.add_argument('--symbols-file', help='Text or CSV file with the symbols to poll.')
+    parser.add_argument(
+        '--interval', type=int, help='Seconds between polls of an active symbol, defaults to INTRADAY_POLL_INTERVAL_SECONDS.'
+    )
+    parser.add_argument(
+        '--max-interval', type=int,
+        help='Maximum seconds between polls of an idle symbol, defaults to INTRADAY_MAX_POLL_INTERVAL_SECONDS.'
+    )
+    parser.add_argument('--rollups', action='store_true', help='Refresh the intraday rollups as new bars arrive.')
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    if args.rollups:
+        subscribe_rollups(get_event_bus())
+    poll_intraday_stock_data(
+        load_symbol_universe(path=args.symbols_file),
+        interval=args.interval,
+        max_interval=args.max_interval,
+        stop_event=stop
+    )
@@ -0,0 +1,275 @@
+from utils.constants import (
+    DB_PROCESSED_DATA_SCHEMA,
+    FINANCIAL_NEWS_TABLE_NAME,
+    NEWS_CLUSTERS_TABLE_NAME,
+    NEWS_CLUSTERS_TABLE_SCHEMA,
+    NEWS_CLUSTERS_TABLE_CONSTRAINTS,
+    NEWS_CLUSTER_SIGNATURES_TABLE_NAME,
+    NEWS_CLUSTER_SIGNATURES_TABLE_SCHEMA,
+    NEWS_CLUSTER_SIGNATURES_TABLE_CONSTRAINTS,
+    NEWS_LSH_BUCKETS_TABLE_NAME,
+    NEWS_LSH_BUCKETS_TABLE_SCHEMA,
+    NEWS_LSH_BUCKETS_TABLE_CONSTRAINTS
+)
+from utils.database import (
+    db_session,
+    create_table_with_schema,
+    bulk_insert_data,
+    execute_select,
+    stream_select
+)
+from utils.logging import setup_logger
+import hashlib
+import numpy as np
+import re
+import time
+import zlib
+
+
+logger = setup_logger(name='cluster_news_duplicates')
+
+NEWS_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{FINANCIAL_NEWS_TABLE_NAME}'
+CLUSTERS_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{NEWS_CLUSTERS_TABLE_NAME}'
+SIGNATURES_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{NEWS_CLUSTER_SIGNATURES_TABLE_NAME}'
+BUCKETS_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{NEWS_LSH_BUCKETS_TABLE_NAME}'
+
+# Words per shingle
+SHINGLE_SIZE = 3
+
+# 16 bands of 8 rows: pairs above ~0.7 Jaccard similarity almost always share a bucket
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 16
+
+# Estimated Jaccard similarity from which an LSH candidate is accepted as a near-duplicate
+SIMILARITY_THRESHOLD = 0.7
+
+# Articles read from the database per chunk
+STREAM_CHUNK_SIZE = 5000
+
+# Prime above 2**32, so (a * x + b) mod p of 32-bit shingle hashes fits in 64 bits
+_HASH_PRIME = np.uint64(4294967311)
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+class MinHasher:
+    """
+    MinHash signatures of word shingles, and the LSH band keys derived from them.
+
+    The permutations are seeded, so signatures computed by different runs are comparable.
+    """
+
+    def __init__(self, num_permutations=NUM_PERMUTATIONS, num_bands=NUM_BANDS, seed=1):
+        if num_permutations % num_bands:
+            raise ValueError('The number of permutations must be a multiple of the number of bands.')
+        generator = np.random.default_rng(seed)
+        self.num_bands = num_bands
+        self.rows_per_band = num_permutations // num_bands
+        self._a = generator.integers(1, 2 ** 32, size=num_permutations, dtype=np.uint64)
+        self._b = generator.integers(0, 2 ** 32, size=num_permutations, dtype=np.uint64)
+
+    @staticmethod
+    def shingles(text):
+        tokens = _TOKEN_PATTERN.findall((text or '').lower())
+        if len(tokens) < SHINGLE_SIZE:
+            return {' '.join(tokens)} if tokens else set()
+        return {' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+    def signature(self, text):
+        """
+        Compute the MinHash signature of a text.
+
+        Returns:
+            ndarray or None: uint64 signature, None for a text without words.
+        """
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        # One row per shingle, one column per permutation; the signature is the minimum of each column
+        return ((hashes[:, None] * self._a + self._b) % _HASH_PRIME).min(axis=0)
+
+    def band_keys(self, signature):
+        """
+        Hash each band of a signature into a signed 64-bit bucket key.
+        """
+        bands = signature.reshape(self.num_bands, self.rows_per_band)
+        return [
+            int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), 'big', signed=True)
+            for band in bands
+        ]
+
+    @staticmethod
+    def similarity(signature, other):
+        return float(np.mean(signature == other))
+
+
+def _cluster_id_of(url):
+    return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def _signature_to_bytea(signature):
+    return '\\x' + signature.astype('<u8').tobytes().hex()
+
+
+def create_cluster_tables(conn):
+    for table_name, table_schema, constraints in (
+            (NEWS_CLUSTERS_TABLE_NAME, NEWS_CLUSTERS_TABLE_SCHEMA, NEWS_CLUSTERS_TABLE_CONSTRAINTS),
+            (NEWS_CLUSTER_SIGNATURES_TABLE_NAME, NEWS_CLUSTER_SIGNATURES_TABLE_SCHEMA, NEWS_CLUSTER_SIGNATURES_TABLE_CONSTRAINTS),
+            (NEWS_LSH_BUCKETS_TABLE_NAME, NEWS_LSH_BUCKETS_TABLE_SCHEMA, NEWS_LSH_BUCKETS_TABLE_CONSTRAINTS),
+            ):
+        create_table_with_schema(
+            connection=conn,
+            db_schema=DB_PROCESSED_DATA_SCHEMA,
+            db_table_name=table_name,
+            db_table_schema_definition=table_schema,
+            constraints=constraints
+        )
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {CLUSTERS_TABLE_FULLNAME} ADD COLUMN IF NOT EXISTS "
+            f"representative {NEWS_CLUSTERS_TABLE_SCHEMA['representative']}"
+        )
+    conn.commit()
+
+
+def load_candidates(conn, band_keys):
+    """
+    Look up the clusters owning any of the given LSH buckets, with their representative signature.
+
+    Parameters:
+        conn: The database connection object.
+        band_keys (set): (band, bucket) pairs.
+
+    Returns:
+        tuple: (band, bucket) mapped to a cluster id, and cluster id mapped to its signature.
+    """
+    if not band_keys:
+        return {}, {}
+    bands, buckets = zip(*band_keys)
+    rows = execute_select(
+        conn,
+        f'SELECT buckets.band, buckets.bucket, buckets.cluster_id, signatures.signature '
+        f'FROM {BUCKETS_TABLE_FULLNAME} buckets '
+        f'JOIN unnest(%s::smallint[], %s::bigint[]) AS wanted(band, bucket) '
+        f'ON buckets.band = wanted.band AND buckets.bucket = wanted.bucket '
+        f'JOIN {SIGNATURES_TABLE_FULLNAME} signatures ON signatures.cluster_id = buckets.cluster_id',
+        (list(bands), list(buckets))
+    )
+    index = {(band, bucket): cluster_id for band, bucket, cluster_id, _ in rows}
+    signatures = {cluster_id: np.frombuffer(bytes(signature), dtype='<u8') for _, _, cluster_id, signature in rows}
+    return index, signatures
+
+
+def assign_clusters(hasher, articles, index, signatures):
+    """
+    Assign each article to the cluster of its most similar LSH candidate, or to a new cluster.
+
+    index and signatures are updated in place with the buckets and clusters created along the way,
+    so near-duplicates within the same chunk end up together.
+
+    Parameters:
+        hasher (MinHasher): Signature and band key computation.
+        articles (list): (url, signature, band keys) of each article, in publication order.
+        index (dict): (band, bucket) mapped to a cluster id.
+        signatures (dict): Cluster id mapped to its representative signature.
+
+    Returns:
+        tuple: Cluster rows, new signature rows and new bucket rows to store; a cluster row tells
+        whether its article founded the cluster, the one article of it whose sentiment is scored.
+    """
+    cluster_rows, signature_rows, bucket_rows = [], [], []
+    for url, signature, keys in articles:
+        if signature is None:
+            cluster_rows.append((url, _cluster_id_of(url), True))
+            continue
+
+        best_cluster, best_similarity = None, SIMILARITY_THRESHOLD
+        for cluster_id in {index[key] for key in keys if key in index}:
+            similarity = hasher.similarity(signature, signatures[cluster_id])
+            if similarity >= best_similarity:
+                best_cluster, best_similarity = cluster_id, similarity
+
+        representative = best_cluster is None
+        if representative:
+            best_cluster = _cluster_id_of(url)
+            signatures[best_cluster] = signature
+            signature_rows.append((best_cluster, _signature_to_bytea(signature)))
+        cluster_rows.append((url, best_cluster, representative))
+        for key in keys:
+            if key not in index:
+                index[key] = best_cluster
+                bucket_rows.append((*key, best_cluster))
+    return cluster_rows, signature_rows, bucket_rows
+
+
+def cluster_news_duplicates(chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Assign a near-duplicate cluster id to every processed article that has none yet.
+
+    MinHash signatures of the title and description are banded into a persistent LSH index, so
+    each new article is only compared with the few clusters sharing one of its buckets: a run is
+    linear in the number of new articles, however many articles are already indexed.
+
+    Parameters:
+        chunk_size (int): Articles read and written per chunk.
+
+    Returns:
+        dict: Articles assigned, new clusters created and elapsed seconds.
+    """
+    start = time.perf_counter()
+    hasher = MinHasher()
+    assigned = new_clusters = 0
+
+    with db_session() as conn:
+        create_cluster_tables(conn)
+
+    with db_session() as read_conn, db_session() as write_conn:
+        chunks = stream_select(
+            read_conn,
+            f"SELECT news.url, concat_ws(' ', news.title, news.description) FROM {NEWS_TABLE_FULLNAME} news "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {CLUSTERS_TABLE_FULLNAME} clusters WHERE clusters.url = news.url) "
+            f"ORDER BY news.published_at",
+            batch_size=chunk_size
+        )
+        for rows in chunks:
+            articles = []
+            for url, text in rows:
+                signature = hasher.signature(text)
+                keys = [] if signature is None else list(enumerate(hasher.band_keys(signature)))
+                articles.append((url, signature, keys))
+
+            index, signatures = load_candidates(write_conn, {key for _, _, keys in articles for key in keys})
+            cluster_rows, signature_rows, bucket_rows = assign_clusters(hasher, articles, index, signatures)
+
+            # Clusters and buckets first, so a crash never leaves an article pointing at an unindexed cluster
+            for table_name, table_columns, table_data, on_conflict_action in (
+                    (NEWS_CLUSTER_SIGNATURES_TABLE_NAME, ['cluster_id', 'signature'], signature_rows,
+                     'ON CONFLICT (cluster_id) DO NOTHING'),
+                    (NEWS_LSH_BUCKETS_TABLE_NAME, ['band', 'bucket', 'cluster_id'], bucket_rows,
+                     'ON CONFLICT (band, bucket) DO NOTHING'),
+                    (NEWS_CLUSTERS_TABLE_NAME, ['url', 'cluster_id', 'representative'], cluster_rows,
+                     'ON CONFLICT (url) DO NOTHING'),
+                    ):
+                bulk_insert_data(
+                    connection=write_conn,
+                    db_schema=DB_PROCESSED_DATA_SCHEMA,
+                    db_table_name=table_name,
+                    table_columns=table_columns,
+                    table_data=table_data,
+                    on_conflict_action=on_conflict_action
+                )
+            assigned += len(cluster_rows)
+            new_clusters += len(signature_rows)
+            logger.info(f'Assigned {assigned} articles to clusters so far.')
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f'Finished clustering financial news: {assigned} articles, {new_clusters} new clusters, '
+        f'{assigned - new_clusters} near-duplicates, in {elapsed:.1f}s.'
+    )
+    return {'articles': assigned, 'new_clusters': new_clusters, 'seconds': elapsed}
+
+
+if __name__ == "__main__":
+    cluster_news_duplicates()
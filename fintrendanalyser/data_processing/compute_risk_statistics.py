@@ -0,0 +1,579 @@
+"""
+Cross-asset risk statistics over the daily bars: rolling volatility, beta and correlation to a
+benchmark for every symbol and date, and the rolling correlation and covariance matrices of the
+whole universe at selected dates.
+
+Closes are loaded into a (symbols x dates) matrix of log returns, and every statistic is
+computed for the whole universe at once from window sums that slide column by column, so no
+loop runs over symbols or symbol pairs.
+
+Usage (from the fintrendanalyser directory):
+    python -m data_processing.compute_risk_statistics
+    python -m data_processing.compute_risk_statistics --window 63 --benchmark SPY --correlation-every 5
+"""
+from utils.constants import (
+    DB_PROCESSED_DATA_SCHEMA,
+    DB_RAW_DATA_SCHEMA,
+    HISTORICAL_STOCK_DATA_TABLE_NAME,
+    STOCK_CORRELATIONS_TABLE_NAME,
+    STOCK_CORRELATIONS_TABLE_SCHEMA,
+    STOCK_CORRELATIONS_TABLE_CONSTRAINTS,
+    STOCK_RISK_STATISTICS_TABLE_NAME,
+    STOCK_RISK_STATISTICS_TABLE_SCHEMA,
+    STOCK_RISK_STATISTICS_TABLE_CONSTRAINTS
+)
+from concurrent.futures import ProcessPoolExecutor
+from utils.database import (
+    db_session,
+    create_table_with_schema,
+    bulk_insert_data,
+    execute_select,
+    stream_select_frames
+)
+from utils.environment import get_setting
+from utils.events import change_notification_statement
+from utils.ingestion_state import (
+    INGESTION_STATE_TABLE_FULLNAME,
+    consume_low_water_marks_statement,
+    create_ingestion_state_table,
+    low_water_source
+)
+from utils.logging import setup_logger
+from utils.profiling import span
+import argparse
+import contextlib
+import datetime
+import multiprocessing
+import numpy as np
+import os
+import tempfile
+import time
+
+
+logger = setup_logger(name='compute_risk_statistics')
+
+# Trading days per year, used to annualise the volatility
+TRADING_DAYS_PER_YEAR = 252
+
+# Rolling window in trading days, overridable with RISK_WINDOW_DAYS, and the share of it a symbol
+# needs returns for to get a value
+DEFAULT_WINDOW = 63
+MIN_WINDOW_COVERAGE = 0.8
+
+# Symbols processed at a time by the per-symbol statistics, bounding their temporary arrays
+SYMBOL_BLOCK_ROWS = 256
+
+# A rolling covariance slides when at most this share of its window changes, otherwise it is rebuilt,
+# and is rebuilt anyway after sliding this many columns, bounding rounding drift
+SLIDE_MAX_SHARE = 0.5
+REBUILD_AFTER_COLUMNS = 2520
+
+# Thread count variables of the BLAS libraries NumPy may be linked against
+BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+STATISTICS_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{STOCK_RISK_STATISTICS_TABLE_NAME}'
+CORRELATIONS_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{STOCK_CORRELATIONS_TABLE_NAME}'
+
+
+def create_risk_tables(conn):
+    create_table_with_schema(
+        connection=conn,
+        db_schema=DB_PROCESSED_DATA_SCHEMA,
+        db_table_name=STOCK_RISK_STATISTICS_TABLE_NAME,
+        db_table_schema_definition=STOCK_RISK_STATISTICS_TABLE_SCHEMA,
+        constraints=STOCK_RISK_STATISTICS_TABLE_CONSTRAINTS
+    )
+    create_table_with_schema(
+        connection=conn,
+        db_schema=DB_PROCESSED_DATA_SCHEMA,
+        db_table_name=STOCK_CORRELATIONS_TABLE_NAME,
+        db_table_schema_definition=STOCK_CORRELATIONS_TABLE_SCHEMA,
+        constraints=STOCK_CORRELATIONS_TABLE_CONSTRAINTS
+    )
+
+
+def load_low_water_marks(conn):
+    """
+    Read the low-water marks the history table keeps for the risk statistics, e.g. of an older range
+    of a backfill or of a gap filled after the last run.
+
+    Returns:
+        tuple: Low-water mark per symbol, and the earliest of their dates, None without marks.
+    """
+    rows = execute_select(
+        conn,
+        f'SELECT symbol, watermark, watermark::date FROM {INGESTION_STATE_TABLE_FULLNAME} WHERE source = %s',
+        (low_water_source(HISTORICAL_STOCK_DATA_TABLE_NAME, STOCK_RISK_STATISTICS_TABLE_NAME),)
+    )
+    marks = {symbol: watermark for symbol, watermark, _ in rows}
+    return marks, min((date for _, _, date in rows), default=None)
+
+
+def load_close_matrix(conn, since=None):
+    """
+    Load the daily closes into a (symbols x dates) matrix, NaN where a symbol has no bar.
+
+    Parameters:
+        conn: The database connection object.
+        since (date, optional): First date to load.
+
+    Returns:
+        tuple: Sorted symbols, their datetime64[D] dates, and the C-contiguous float64 close matrix.
+    """
+    query = f'SELECT symbol, datetime::date AS date, close FROM {DB_RAW_DATA_SCHEMA}.{HISTORICAL_STOCK_DATA_TABLE_NAME}'
+    params = ()
+    if since is not None:
+        query += ' WHERE datetime >= %s'
+        params = (since,)
+
+    chunks = list(stream_select_frames(conn, query, params, as_arrays=True))
+    if not chunks:
+        return [], np.empty(0, dtype='datetime64[D]'), np.empty((0, 0))
+
+    symbols, symbol_rows = np.unique(np.concatenate([chunk['symbol'] for chunk in chunks]), return_inverse=True)
+    dates, date_columns = np.unique(
+        np.concatenate([chunk['date'] for chunk in chunks]).astype('datetime64[D]'), return_inverse=True
+    )
+    closes = np.full((len(symbols), len(dates)), np.nan)
+    closes[symbol_rows, date_columns] = np.concatenate([chunk['close'] for chunk in chunks])
+    return symbols.tolist(), dates, closes
+
+
+def log_returns(closes):
+    """
+    Compute daily log returns along the date axis, NaN where either close is missing or not positive.
+    """
+    returns = np.full_like(closes, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[:, 1:] = np.log(closes[:, 1:] / closes[:, :-1])
+    returns[~np.isfinite(returns)] = np.nan
+    return returns
+
+
+def equal_weighted_returns(returns):
+    """
+    Average the returns of every symbol with a return on each date, NaN on dates without any.
+    """
+    valid = ~np.isnan(returns)
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid='ignore'):
+        return np.where(counts > 0, np.where(valid, returns, 0.0).sum(axis=0) / counts, np.nan)
+
+
+def window_sums(values, window):
+    """
+    Sum each row over the window of columns ending at every column, in one pass.
+
+    Each window sum is the difference of two running sums, so moving the window by a column costs
+    one addition and one subtraction whatever its length. The first window - 1 columns hold the sums
+    of their partial windows.
+    """
+    cumulative = np.cumsum(values, axis=1)
+    sums = cumulative.copy()
+    sums[:, window:] -= cumulative[:, :-window]
+    return sums
+
+
+def rolling_risk_statistics(returns, benchmark, window, min_periods):
+    """
+    Compute the rolling volatility of every symbol, and its beta and correlation to a benchmark.
+
+    Each statistic uses the dates of its window where the symbol (and for beta, the benchmark) has
+    a return, and is NaN when fewer than min_periods such dates remain.
+
+    Parameters:
+        returns (ndarray): (symbols x dates) log returns.
+        benchmark (ndarray): Log returns of the benchmark per date.
+        window (int): Window length in dates.
+        min_periods (int): Minimum number of returns in a window.
+
+    Returns:
+        tuple: Annualised volatility, beta and benchmark correlation, each a (symbols x dates) matrix.
+    """
+    volatility = np.empty_like(returns)
+    beta = np.empty_like(returns)
+    correlation = np.empty_like(returns)
+    benchmark_valid = ~np.isnan(benchmark)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, returns.shape[0], SYMBOL_BLOCK_ROWS):
+            block = slice(start, start + SYMBOL_BLOCK_ROWS)
+            valid = ~np.isnan(returns[block])
+            x = np.where(valid, returns[block], 0.0)
+            count = window_sums(valid.astype(float), window)
+            sum_x = window_sums(x, window)
+            variance = (window_sums(x * x, window) - sum_x * sum_x / count) / (count - 1)
+            volatility[block] = np.where(
+                count >= min_periods, np.sqrt(np.maximum(variance, 0.0) * TRADING_DAYS_PER_YEAR), np.nan
+            )
+
+            # Beta and correlation only use the dates where both the symbol and the benchmark have a return
+            paired = valid & benchmark_valid
+            x = np.where(paired, returns[block], 0.0)
+            y = np.where(paired, benchmark, 0.0)
+            count = window_sums(paired.astype(float), window)
+            sum_x, sum_y = window_sums(x, window), window_sums(y, window)
+            covariance = window_sums(x * y, window) - sum_x * sum_y / count
+            variance_x = window_sums(x * x, window) - sum_x * sum_x / count
+            variance_y = window_sums(y * y, window) - sum_y * sum_y / count
+            defined = (count >= min_periods) & (variance_y > 0)
+            beta[block] = np.where(defined, covariance / variance_y, np.nan)
+            correlation[block] = np.where(
+                defined & (variance_x > 0),
+                np.clip(covariance / np.sqrt(variance_x * variance_y), -1.0, 1.0),
+                np.nan
+            )
+
+    return volatility, beta, correlation
+
+
+class RollingCovariance:
+    """
+    Pairwise covariance and correlation matrices of the universe over a window of dates that slides forward.
+
+    The window is kept as four (symbols x symbols) sums over the dates where both symbols of a pair
+    have a return: the cross products, the pair counts, and the sums of returns and squared returns.
+    Sliding the window adds the entering dates and subtracts the leaving ones with two matrix
+    products, so moving it by k dates costs O(symbols^2 * k) instead of a recomputation over the window.
+    """
+
+    def __init__(self, returns, window):
+        """
+        Parameters:
+            returns (ndarray): (symbols x dates) log returns, NaN where missing.
+            window (int): Window length in dates.
+        """
+        self.returns = returns
+        self.window = window
+        size = returns.shape[0]
+        self._products = np.zeros((size, size))
+        self._counts = np.zeros((size, size))
+        self._sums = np.zeros((size, size))
+        self._squares = np.zeros((size, size))
+        self._start = self._end = None
+        self._slid = 0
+
+    def _window_columns(self, columns):
+        values = np.asarray(self.returns[:, columns])
+        valid = ~np.isnan(values)
+        return np.where(valid, values, 0.0), valid.astype(float)
+
+    def _rebuild(self, start, end):
+        x, mask = self._window_columns(slice(start, end))
+        np.matmul(x, x.T, out=self._products)
+        np.matmul(mask, mask.T, out=self._counts)
+        np.matmul(x, mask.T, out=self._sums)
+        np.matmul(x * x, mask.T, out=self._squares)
+        self._slid = 0
+
+    def _slide(self, start, end):
+        # The entering dates are added and the leaving ones subtracted in a single product per sum
+        columns = np.r_[self._end:end, self._start:start]
+        signs = np.r_[np.ones(end - self._end), -np.ones(start - self._start)]
+        x, mask = self._window_columns(columns)
+        signed_x, signed_mask = x * signs, mask * signs
+        self._products += signed_x @ x.T
+        self._counts += signed_mask @ mask.T
+        self._sums += signed_x @ mask.T
+        self._squares += (signed_x * x) @ mask.T
+        self._slid += end - self._end
+
+    def move_to(self, end):
+        """
+        Move the window so that it ends with the date at column end - 1.
+
+        The window slides when fewer than SLIDE_MAX_SHARE of its dates change, and is rebuilt otherwise.
+        """
+        start = max(end - self.window, 0)
+        changed = (end - self._end) + (start - self._start) if self._end is not None else None
+        if changed is None or end < self._end or start >= self._end or changed > self.window * SLIDE_MAX_SHARE \
+                or self._slid >= REBUILD_AFTER_COLUMNS:
+            self._rebuild(start, end)
+        elif changed:
+            self._slide(start, end)
+        self._start, self._end = start, end
+
+    def statistics(self, min_periods):
+        """
+        Return the covariance and correlation matrices of the current window.
+
+        Each pair uses the dates where both symbols have a return; pairs with fewer than
+        min_periods such dates are NaN.
+
+        Returns:
+            tuple: (symbols x symbols) covariance and correlation matrices.
+        """
+        counts = np.rint(self._counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means_product = self._sums * self._sums.T / counts
+            covariance = (self._products - means_product) / (counts - 1)
+            variance = np.maximum((self._squares - self._sums * self._sums / counts) / (counts - 1), 0.0)
+            correlation = np.clip(covariance / np.sqrt(variance * variance.T), -1.0, 1.0)
+        undefined = counts < max(min_periods, 2)
+        covariance[undefined] = np.nan
+        correlation[undefined] = np.nan
+        return covariance, correlation
+
+
+def correlation_matrices(returns, columns, window, min_periods):
+    """
+    Compute the covariance and correlation matrices of the windows ending at the given columns.
+
+    Returns:
+        list: (column, upper-triangle covariances, upper-triangle correlations) per column, in
+        np.triu_indices(symbols, 1) order.
+    """
+    rolling = RollingCovariance(returns, window)
+    upper = np.triu_indices(returns.shape[0], 1)
+    results = []
+    for column in sorted(columns):
+        rolling.move_to(column + 1)
+        covariance, correlation = rolling.statistics(min_periods)
+        results.append((column, covariance[upper], correlation[upper]))
+    return results
+
+
+_worker_returns = None
+
+def _init_worker(returns_path):
+    global _worker_returns
+    _worker_returns = np.load(returns_path, mmap_mode='r')
+
+
+def _correlation_segment(columns, window, min_periods):
+    return correlation_matrices(_worker_returns, columns, window, min_periods)
+
+
+@contextlib.contextmanager
+def _blas_threads(threads):
+    """
+    Limit the BLAS threads of the worker processes spawned in the with block, unless already configured.
+    """
+    unset = [name for name in BLAS_THREAD_VARIABLES if name not in os.environ]
+    os.environ.update({name: str(threads) for name in unset})
+    try:
+        yield
+    finally:
+        for name in unset:
+            os.environ.pop(name, None)
+
+
+def default_workers():
+    """
+    Return the number of worker processes for the correlation matrices, RISK_WORKERS or the number of CPUs.
+    """
+    return get_setting('RISK_WORKERS', os.cpu_count() or 1, int)
+
+
+def parallel_correlation_matrices(returns, columns, window, min_periods, workers=None):
+    """
+    Compute the matrices of correlation_matrices, splitting the columns across worker processes.
+
+    Each worker slides its own window over a contiguous run of the columns, reading the returns
+    from a memory-mapped file shared by all workers. A single column, or a single worker, is
+    computed in-process, where the matrix products use every core through BLAS.
+
+    Returns:
+        list: As correlation_matrices, ordered by column.
+    """
+    columns = sorted(columns)
+    workers = max(1, min(workers or default_workers(), len(columns)))
+    if workers == 1:
+        return correlation_matrices(returns, columns, window, min_periods)
+
+    segments = [list(segment) for segment in np.array_split(np.asarray(columns), workers)]
+    with tempfile.TemporaryDirectory() as directory:
+        returns_path = os.path.join(directory, 'returns.npy')
+        np.save(returns_path, np.ascontiguousarray(returns))
+        # Workers are spawned rather than forked, so they inherit neither the pooled connections nor threads
+        with _blas_threads(max(1, (os.cpu_count() or 1) // workers)), ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(returns_path,)
+                ) as executor:
+            futures = [executor.submit(_correlation_segment, segment, window, min_periods) for segment in segments]
+            results = [result for future in futures for result in future.result()]
+    return results
+
+
+def correlation_as_of_columns(new_columns, every=None):
+    """
+    Pick the columns to compute correlation matrices at: the last new date and, with every,
+    each every-th new date before it.
+    """
+    if not len(new_columns):
+        return []
+    if not every:
+        return [int(new_columns[-1])]
+    return sorted(int(column) for column in new_columns[::-1][::every])
+
+
+def compute_risk_statistics(
+        window=None,
+        benchmark_symbol=None,
+        correlation_every=None,
+        full_refresh=False,
+        workers=None
+        ):
+    """
+    Compute the risk statistics of the daily bars not processed yet, and store them in the processed schema.
+
+    Only the dates after the last stored one are computed, from the closes of those dates plus
+    enough earlier ones to fill their windows. Bars stored at or before that date since the last run,
+    as recorded by the low-water marks of the history table, move the first computed date back to
+    the earliest of them, for every symbol, since the market index and correlations mix them all.
+
+    Parameters:
+        window (int, optional): Rolling window in trading days, defaults to RISK_WINDOW_DAYS.
+        benchmark_symbol (str, optional): Stored symbol used as the market index for beta, defaults to
+            RISK_BENCHMARK_SYMBOL; without one, an equal-weighted index of the universe is used.
+        correlation_every (int, optional): Also store the correlation matrices of every n-th new
+            date; by default only the last date's matrix is stored.
+        full_refresh (bool): Recompute every date.
+        workers (int, optional): Worker processes for the correlation matrices, defaults to default_workers().
+
+    Returns:
+        dict: Symbols, new dates, statistic rows and correlation rows written, and elapsed seconds.
+    """
+    start_time = time.perf_counter()
+    if window is None:
+        window = get_setting('RISK_WINDOW_DAYS', DEFAULT_WINDOW, int)
+    if benchmark_symbol is None:
+        benchmark_symbol = get_setting('RISK_BENCHMARK_SYMBOL')
+    min_periods = max(2, int(window * MIN_WINDOW_COVERAGE))
+
+    with db_session() as conn:
+        create_risk_tables(conn)
+        create_ingestion_state_table(conn)
+        marks, first_marked_date = load_low_water_marks(conn)
+        last_date = None if full_refresh else execute_select(
+            conn, f'SELECT MAX(datetime) FROM {STATISTICS_TABLE_FULLNAME} WHERE window_days = %s', (window,)
+        )[0][0]
+        conn.commit()
+        recompute_from = None
+        if last_date and first_marked_date and first_marked_date <= last_date:
+            recompute_from = first_marked_date
+            logger.info(f'Recomputing risk statistics from {recompute_from}, before which bars were stored late.')
+        # Calendar days covering the window of trading days before the first new date, with margin for holidays
+        anchor = recompute_from or last_date
+        since = anchor - datetime.timedelta(days=window * 7 // 5 + 10) if anchor else None
+        with span('risk_statistics.load'):
+            symbols, dates, closes = load_close_matrix(conn, since)
+
+    if recompute_from:
+        new_columns = np.nonzero(dates >= np.datetime64(recompute_from, 'D'))[0]
+    elif last_date:
+        new_columns = np.nonzero(dates > np.datetime64(last_date, 'D'))[0]
+    else:
+        new_columns = np.arange(len(dates))
+    # The marks are dropped once the dates they cover are stored
+    consume_marks = consume_low_water_marks_statement(
+        HISTORICAL_STOCK_DATA_TABLE_NAME, marks, consumer=STOCK_RISK_STATISTICS_TABLE_NAME
+    )
+    if not len(new_columns):
+        with db_session() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(*consume_marks)
+            conn.commit()
+        logger.info('No new daily bars to compute risk statistics for.')
+        return {'symbols': len(symbols), 'dates': 0, 'statistics_rows': 0, 'correlation_rows': 0, 'seconds': 0.0}
+    logger.info(f'Computing {window}-day risk statistics of {len(symbols)} symbols over {len(new_columns)} new dates.')
+
+    with span('risk_statistics.compute'):
+        returns = log_returns(closes)
+        if benchmark_symbol is None:
+            benchmark = equal_weighted_returns(returns)
+        elif benchmark_symbol in symbols:
+            benchmark = returns[symbols.index(benchmark_symbol)]
+        else:
+            logger.warning(f'Benchmark {benchmark_symbol} has no daily bars; using an equal-weighted index instead.')
+            benchmark = equal_weighted_returns(returns)
+        volatility, beta, correlation = rolling_risk_statistics(returns, benchmark, window, min_periods)
+
+        as_of_columns = correlation_as_of_columns(new_columns, correlation_every)
+        matrices = parallel_correlation_matrices(returns, as_of_columns, window, min_periods, workers=workers)
+
+    first_new = int(new_columns[0])
+    rows, columns = np.nonzero(~np.isnan(volatility[:, first_new:]) | ~np.isnan(beta[:, first_new:]))
+    columns += first_new
+    dates = dates.tolist()
+    statistics_rows = len(rows)
+    upper_a, upper_b = np.triu_indices(len(symbols), 1)
+    pair_symbols = np.asarray(symbols, dtype=object)
+    correlation_rows = 0
+
+    with db_session() as conn, span('risk_statistics.write'):
+        bulk_insert_data(
+            connection=conn,
+            db_schema=DB_PROCESSED_DATA_SCHEMA,
+            db_table_name=STOCK_RISK_STATISTICS_TABLE_NAME,
+            table_columns=list(STOCK_RISK_STATISTICS_TABLE_SCHEMA.keys()),
+            table_data=zip(
+                pair_symbols[rows].tolist(),
+                [dates[column] for column in columns],
+                [window] * statistics_rows,
+                volatility[rows, columns].tolist(),
+                beta[rows, columns].tolist(),
+                correlation[rows, columns].tolist()
+            ),
+            on_conflict_action=(
+                'ON CONFLICT (symbol, datetime, window_days) DO UPDATE SET volatility = EXCLUDED.volatility, '
+                'beta = EXCLUDED.beta, benchmark_correlation = EXCLUDED.benchmark_correlation'
+            ),
+            post_merge_statements=[change_notification_statement(STATISTICS_TABLE_FULLNAME)]
+        )
+        for column, covariances, correlations in matrices:
+            defined = np.nonzero(~np.isnan(correlations))[0]
+            correlation_rows += len(defined)
+            bulk_insert_data(
+                connection=conn,
+                db_schema=DB_PROCESSED_DATA_SCHEMA,
+                db_table_name=STOCK_CORRELATIONS_TABLE_NAME,
+                table_columns=list(STOCK_CORRELATIONS_TABLE_SCHEMA.keys()),
+                table_data=zip(
+                    [dates[column]] * len(defined),
+                    [window] * len(defined),
+                    pair_symbols[upper_a[defined]].tolist(),
+                    pair_symbols[upper_b[defined]].tolist(),
+                    correlations[defined].tolist(),
+                    covariances[defined].tolist()
+                ),
+                on_conflict_action=(
+                    'ON CONFLICT (as_of, window_days, symbol_a, symbol_b) DO UPDATE SET '
+                    'correlation = EXCLUDED.correlation, covariance = EXCLUDED.covariance'
+                )
+            )
+        with conn.cursor() as cursor:
+            cursor.execute(*consume_marks)
+        conn.commit()
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f'Finished risk statistics in {elapsed:.1f}s: {statistics_rows} symbol-date rows and '
+        f'{correlation_rows} correlation pairs over {len(matrices)} dates.'
+    )
+    return {
+        'symbols': len(symbols),
+        'dates': len(new_columns),
+        'statistics_rows': statistics_rows,
+        'correlation_rows': correlation_rows,
+        'seconds': elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compute rolling volatility, beta and correlation matrices.')
+    parser.add_argument('--window', type=int, help='Rolling window in trading days, defaults to RISK_WINDOW_DAYS.')
+    parser.add_argument('--benchmark', help='Symbol used as the market index, defaults to RISK_BENCHMARK_SYMBOL.')
+    parser.add_argument('--correlation-every', type=int, help='Store the correlation matrix of every n-th new date.')
+    parser.add_argument('--workers', type=int, help='Worker processes for the matrices, defaults to RISK_WORKERS.')
+    parser.add_argument('--full-refresh', action='store_true', help='Recompute every date.')
+    args = parser.parse_args()
+    compute_risk_statistics(
+        window=args.window,
+        benchmark_symbol=args.benchmark,
+        correlation_every=args.correlation_every,
+        full_refresh=args.full_refresh,
+        workers=args.workers
+    )
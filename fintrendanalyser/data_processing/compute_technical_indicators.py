@@ -0,0 +1,483 @@
+from utils.constants import (
+    DB_RAW_DATA_SCHEMA,
+    HISTORICAL_STOCK_DATA_TABLE_NAME,
+    INDICATOR_STATE_TABLE_NAME,
+    INDICATOR_STATE_TABLE_SCHEMA,
+    INDICATOR_STATE_TABLE_CONSTRAINTS,
+    STOCK_ATR_DATA_TABLE_NAME,
+    STOCK_ATR_DATA_TABLE_SCHEMA,
+    STOCK_BBANDS_DATA_TABLE_NAME,
+    STOCK_BBANDS_DATA_TABLE_SCHEMA,
+    STOCK_EMA_DATA_TABLE_NAME,
+    STOCK_EMA_DATA_TABLE_SCHEMA,
+    STOCK_INDICATOR_TABLE_CONSTRAINTS,
+    STOCK_MACD_DATA_TABLE_NAME,
+    STOCK_MACD_DATA_TABLE_SCHEMA,
+    STOCK_RSI_DATA_TABLE_NAME,
+    STOCK_RSI_DATA_TABLE_SCHEMA,
+    STOCK_SMA_DATA_TABLE_NAME,
+    STOCK_SMA_DATA_TABLE_SCHEMA
+)
+from utils.database import (
+    db_session,
+    create_table_with_schema,
+    bulk_insert_data,
+    execute_select,
+    stream_select
+)
+from utils.events import change_notification_statement
+from utils.ingestion_state import (
+    INGESTION_STATE_TABLE_FULLNAME,
+    consume_low_water_marks_statement,
+    create_ingestion_state_table,
+    low_water_source
+)
+from utils.logging import setup_logger
+import json
+import numpy as np
+import sys
+
+
+logger = setup_logger(name='compute_technical_indicators')
+
+INDICATOR_STATE_TABLE_FULLNAME = f'{DB_RAW_DATA_SCHEMA}.{INDICATOR_STATE_TABLE_NAME}'
+
+# Daily bars read per chunk; chunks are cut on timestamp boundaries
+BAR_CHUNK_ROWS = 50000
+
+# Indicator parameters
+SMA_PERIOD = 20
+EMA_PERIOD = 20
+RSI_PERIOD = 14
+MACD_FAST_PERIOD = 12
+MACD_SLOW_PERIOD = 26
+MACD_SIGNAL_PERIOD = 9
+BBANDS_STD_DEVS = 2.0
+ATR_PERIOD = 14
+
+# Length of the close window carried between runs; SMA and Bollinger bands share it
+WINDOW_SIZE = SMA_PERIOD
+
+# Scalar state carried between runs for each symbol
+SCALAR_STATE_FIELDS = [
+    'prev_close', 'ema', 'ema_fast', 'ema_slow', 'macd_signal',
+    'rsi_gain', 'rsi_loss', 'atr'
+]
+
+# Output table, value columns and engine outputs of each indicator
+INDICATOR_TABLES = {
+    STOCK_SMA_DATA_TABLE_NAME: (STOCK_SMA_DATA_TABLE_SCHEMA, ['sma']),
+    STOCK_EMA_DATA_TABLE_NAME: (STOCK_EMA_DATA_TABLE_SCHEMA, ['ema']),
+    STOCK_RSI_DATA_TABLE_NAME: (STOCK_RSI_DATA_TABLE_SCHEMA, ['rsi']),
+    STOCK_MACD_DATA_TABLE_NAME: (STOCK_MACD_DATA_TABLE_SCHEMA, ['macd', 'macd_signal', 'macd_hist']),
+    STOCK_BBANDS_DATA_TABLE_NAME: (STOCK_BBANDS_DATA_TABLE_SCHEMA, ['middle_band', 'upper_band', 'lower_band']),
+    STOCK_ATR_DATA_TABLE_NAME: (STOCK_ATR_DATA_TABLE_SCHEMA, ['atr']),
+}
+
+
+class IndicatorEngine:
+    """
+    Vectorized, incremental computation of SMA, EMA, RSI, MACD, Bollinger bands and ATR.
+
+    The state of every symbol is held in NumPy arrays, so each new bar is processed for the whole
+    universe at once. The state can be exported after a run and restored before the next one, so
+    only bars newer than the last run have to be processed. Bars can be fed in consecutive chunks
+    of timestamps, growing the universe as new symbols appear.
+    """
+
+    def __init__(self, symbols=(), states=None):
+        """
+        Parameters:
+            symbols (list): Symbols of the universe, one row of state each.
+            states (dict, optional): Exported state per symbol, as returned by export_states().
+        """
+        self.symbols = []
+        self.symbol_rows = {}
+        self.count = np.zeros(0, dtype=np.int64)
+        self.window = np.full((0, WINDOW_SIZE), np.nan)
+        for field in SCALAR_STATE_FIELDS:
+            setattr(self, field, np.full(0, np.nan))
+        self.add_symbols(symbols, states)
+
+    def add_symbols(self, symbols, states=None):
+        """
+        Grow the universe with the symbols not in it yet, e.g. as they appear in streamed bars.
+
+        Parameters:
+            symbols (iterable): Symbols to add; those already in the universe are ignored.
+            states (dict, optional): Exported state per symbol, as returned by export_states().
+        """
+        new_symbols = [symbol for symbol in dict.fromkeys(symbols) if symbol not in self.symbol_rows]
+        if not new_symbols:
+            return
+        start = len(self.symbols)
+        added = len(new_symbols)
+        self.symbols.extend(new_symbols)
+        self.symbol_rows.update({symbol: start + offset for offset, symbol in enumerate(new_symbols)})
+        self.count = np.concatenate([self.count, np.zeros(added, dtype=np.int64)])
+        self.window = np.vstack([self.window, np.full((added, WINDOW_SIZE), np.nan)])
+        for field in SCALAR_STATE_FIELDS:
+            setattr(self, field, np.concatenate([getattr(self, field), np.full(added, np.nan)]))
+
+        for offset, symbol in enumerate(new_symbols):
+            state = (states or {}).get(symbol)
+            if state:
+                self._restore(start + offset, state)
+
+    def _restore(self, row, state):
+        self.count[row] = state['count']
+        for field in SCALAR_STATE_FIELDS:
+            value = state.get(field)
+            getattr(self, field)[row] = np.nan if value is None else value
+        closes = state.get('window', [])
+        for offset, close in enumerate(closes):
+            self.window[row, (state['count'] - len(closes) + offset) % WINDOW_SIZE] = close
+
+    def export_states(self):
+        """
+        Export the state of every symbol that has seen at least one bar.
+
+        Returns:
+            dict: JSON-serialisable state per symbol.
+        """
+        states = {}
+        for row, symbol in enumerate(self.symbols):
+            count = int(self.count[row])
+            if count == 0:
+                continue
+            kept = min(count, WINDOW_SIZE)
+            state = {'count': count}
+            for field in SCALAR_STATE_FIELDS:
+                value = getattr(self, field)[row]
+                state[field] = None if np.isnan(value) else float(value)
+            state['window'] = [
+                float(self.window[row, (count - kept + offset) % WINDOW_SIZE]) for offset in range(kept)
+            ]
+            states[symbol] = state
+        return states
+
+    def update(self, highs, lows, closes):
+        """
+        Process new bars for the whole universe.
+
+        Parameters:
+            highs (ndarray): Highs, shape (symbols, bars), NaN where a symbol has no bar.
+            lows (ndarray): Lows, same shape.
+            closes (ndarray): Closes, same shape.
+
+        Returns:
+            dict: Output name mapped to an array of the same shape, NaN where the indicator is not yet defined.
+        """
+        outputs = {
+            name: np.full(closes.shape, np.nan)
+            for _, columns in INDICATOR_TABLES.values()
+            for name in columns
+        }
+        rows = np.arange(len(self.symbols))
+
+        for step in range(closes.shape[1]):
+            close = closes[:, step]
+            has_bar = ~np.isnan(close)
+            if not has_bar.any():
+                continue
+            high = np.where(has_bar, highs[:, step], np.nan)
+            low = np.where(has_bar, lows[:, step], np.nan)
+            first_bar = has_bar & (self.count == 0)
+
+            self.count = self.count + has_bar
+            count = self.count
+
+            # Rolling window for SMA and Bollinger bands
+            positions = (count - 1) % WINDOW_SIZE
+            self.window[rows[has_bar], positions[has_bar]] = close[has_bar]
+            window_full = has_bar & (count >= WINDOW_SIZE)
+            with np.errstate(invalid='ignore'):
+                mean = self.window.mean(axis=1)
+                std = self.window.std(axis=1)
+            outputs['sma'][:, step] = np.where(window_full, mean, np.nan)
+            outputs['middle_band'][:, step] = np.where(window_full, mean, np.nan)
+            outputs['upper_band'][:, step] = np.where(window_full, mean + BBANDS_STD_DEVS * std, np.nan)
+            outputs['lower_band'][:, step] = np.where(window_full, mean - BBANDS_STD_DEVS * std, np.nan)
+
+            # Exponential averages, seeded with the first close
+            self.ema = self._ema_step(self.ema, close, has_bar, first_bar, EMA_PERIOD)
+            self.ema_fast = self._ema_step(self.ema_fast, close, has_bar, first_bar, MACD_FAST_PERIOD)
+            self.ema_slow = self._ema_step(self.ema_slow, close, has_bar, first_bar, MACD_SLOW_PERIOD)
+            outputs['ema'][:, step] = np.where(has_bar & (count >= EMA_PERIOD), self.ema, np.nan)
+
+            macd = self.ema_fast - self.ema_slow
+            macd_ready = has_bar & (count >= MACD_SLOW_PERIOD)
+            signal_seed = macd_ready & (count == MACD_SLOW_PERIOD)
+            self.macd_signal = self._ema_step(
+                self.macd_signal, macd, macd_ready, signal_seed, MACD_SIGNAL_PERIOD
+            )
+            signal_ready = has_bar & (count >= MACD_SLOW_PERIOD + MACD_SIGNAL_PERIOD - 1)
+            outputs['macd'][:, step] = np.where(signal_ready, macd, np.nan)
+            outputs['macd_signal'][:, step] = np.where(signal_ready, self.macd_signal, np.nan)
+            outputs['macd_hist'][:, step] = np.where(signal_ready, macd - self.macd_signal, np.nan)
+
+            # Wilder-smoothed RSI over close-to-close changes
+            change = close - self.prev_close
+            has_change = has_bar & ~first_bar
+            gain = np.where(has_change, np.maximum(change, 0.0), 0.0)
+            loss = np.where(has_change, np.maximum(-change, 0.0), 0.0)
+            self.rsi_gain, rsi_ready = self._wilder_step(self.rsi_gain, gain, has_change, count - 1, RSI_PERIOD)
+            self.rsi_loss, _ = self._wilder_step(self.rsi_loss, loss, has_change, count - 1, RSI_PERIOD)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rsi = np.where(self.rsi_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + self.rsi_gain / self.rsi_loss))
+            outputs['rsi'][:, step] = np.where(rsi_ready, rsi, np.nan)
+
+            # Wilder-smoothed ATR over true ranges
+            true_range = np.where(
+                first_bar,
+                high - low,
+                np.fmax(high - low, np.fmax(np.abs(high - self.prev_close), np.abs(low - self.prev_close)))
+            )
+            self.atr, atr_ready = self._wilder_step(self.atr, true_range, has_bar, count, ATR_PERIOD)
+            outputs['atr'][:, step] = np.where(atr_ready, self.atr, np.nan)
+
+            self.prev_close = np.where(has_bar, close, self.prev_close)
+
+        return outputs
+
+    @staticmethod
+    def _ema_step(previous, value, active, seed, period):
+        alpha = 2.0 / (period + 1)
+        updated = np.where(seed, value, previous + alpha * (value - previous))
+        return np.where(active, updated, previous)
+
+    @staticmethod
+    def _wilder_step(previous, value, active, sample_count, period):
+        """
+        Advance a Wilder average: a plain sum over the first period samples, averaged at the
+        period-th sample, then smoothed with (previous * (period - 1) + value) / period.
+
+        Returns:
+            tuple: Updated sums/averages and a mask of symbols where the average is defined.
+        """
+        warming_up = sample_count <= period
+        accumulated = np.where(sample_count == 1, value, np.nan_to_num(previous) + value)
+        accumulated = np.where(sample_count == period, accumulated / period, accumulated)
+        smoothed = (previous * (period - 1) + value) / period
+        updated = np.where(warming_up, accumulated, smoothed)
+        return np.where(active, updated, previous), active & (sample_count >= period)
+
+
+def create_indicator_tables(conn):
+    for table_name, (table_schema, _) in INDICATOR_TABLES.items():
+        create_table_with_schema(
+            connection=conn,
+            db_schema=DB_RAW_DATA_SCHEMA,
+            db_table_name=table_name,
+            db_table_schema_definition=table_schema,
+            constraints=STOCK_INDICATOR_TABLE_CONSTRAINTS
+        )
+    create_table_with_schema(
+        connection=conn,
+        db_schema=DB_RAW_DATA_SCHEMA,
+        db_table_name=INDICATOR_STATE_TABLE_NAME,
+        db_table_schema_definition=INDICATOR_STATE_TABLE_SCHEMA,
+        constraints=INDICATOR_STATE_TABLE_CONSTRAINTS
+    )
+
+
+def load_late_symbols(conn):
+    """
+    Read the low-water marks of the daily bars and find the symbols that got bars dated before
+    their carried-over state, e.g. an older range of a backfill stored after the last run.
+
+    Returns:
+        tuple: Low-water mark per symbol, and the symbols to recompute from their first bar.
+    """
+    rows = execute_select(
+        conn,
+        f'SELECT mark.symbol, mark.watermark, mark.watermark < s.last_datetime '
+        f'FROM {INGESTION_STATE_TABLE_FULLNAME} mark '
+        f'LEFT JOIN {INDICATOR_STATE_TABLE_FULLNAME} s ON s.symbol = mark.symbol '
+        f'WHERE mark.source = %s',
+        (low_water_source(HISTORICAL_STOCK_DATA_TABLE_NAME),)
+    )
+    marks = {symbol: watermark for symbol, watermark, _ in rows}
+    late_symbols = [symbol for symbol, _, is_late in rows if is_late]
+    return marks, late_symbols
+
+
+def load_states(conn, reset_symbols):
+    """
+    Load the carried-over state of every symbol, except those to recompute from their first bar.
+
+    Returns:
+        dict: Stored state per symbol.
+    """
+    return {
+        symbol: state for symbol, state in execute_select(
+            conn,
+            f'SELECT symbol, state FROM {INDICATOR_STATE_TABLE_FULLNAME} WHERE NOT symbol = ANY(%s)',
+            (list(reset_symbols),)
+        )
+    }
+
+
+def new_bars_query(full_refresh=False, reset_symbols=()):
+    """
+    Build the query of the daily bars not yet processed by the engine, ordered by datetime.
+
+    Returns:
+        tuple: SQL query selecting (symbol, datetime, high, low, close) rows, and its parameters.
+    """
+    query = (
+        f'SELECT h.symbol, h.datetime, h.high, h.low, h.close '
+        f'FROM {DB_RAW_DATA_SCHEMA}.{HISTORICAL_STOCK_DATA_TABLE_NAME} h '
+        f'LEFT JOIN {INDICATOR_STATE_TABLE_FULLNAME} s '
+        f'ON s.symbol = h.symbol AND NOT %(full_refresh)s AND NOT s.symbol = ANY(%(reset_symbols)s) '
+        f'WHERE s.last_datetime IS NULL OR h.datetime > s.last_datetime '
+        f'ORDER BY h.datetime'
+    )
+    return query, {'full_refresh': full_refresh, 'reset_symbols': list(reset_symbols)}
+
+
+def chunk_by_timestamp(batches):
+    """
+    Regroup streamed batches of bars ordered by datetime, so that all bars of a timestamp fall in the same chunk.
+
+    Yields:
+        list: Bar rows of consecutive timestamps.
+    """
+    carried = []
+    for rows in batches:
+        rows = carried + rows
+        cut = len(rows)
+        while cut and rows[cut - 1][1] == rows[-1][1]:
+            cut -= 1
+        carried = rows[cut:]
+        if cut:
+            yield rows[:cut]
+    if carried:
+        yield carried
+
+
+def bars_to_matrices(bars, symbol_rows):
+    """
+    Align bar rows into (symbols x timestamps) matrices, NaN where a symbol has no bar.
+
+    Parameters:
+        bars (list): (symbol, datetime, high, low, close) rows.
+        symbol_rows (dict): Symbol mapped to its row in the matrices, covering every symbol of the bars.
+
+    Returns:
+        tuple: Timestamps, and the high, low and close matrices.
+    """
+    timestamps = sorted({bar[1] for bar in bars})
+    timestamp_columns = {timestamp: column for column, timestamp in enumerate(timestamps)}
+
+    highs = np.full((len(symbol_rows), len(timestamps)), np.nan)
+    lows = np.full_like(highs, np.nan)
+    closes = np.full_like(highs, np.nan)
+    rows = np.fromiter((symbol_rows[bar[0]] for bar in bars), dtype=np.int64, count=len(bars))
+    columns = np.fromiter((timestamp_columns[bar[1]] for bar in bars), dtype=np.int64, count=len(bars))
+    values = np.array([bar[2:] for bar in bars], dtype=float).reshape(-1, 3)
+    highs[rows, columns] = values[:, 0]
+    lows[rows, columns] = values[:, 1]
+    closes[rows, columns] = values[:, 2]
+    return timestamps, highs, lows, closes
+
+
+def write_indicator_outputs(conn, symbols, timestamps, outputs):
+    """
+    Upsert the indicator values computed over a chunk of timestamps.
+    """
+    dates = [timestamp.date() for timestamp in timestamps]
+    for table_name, (table_schema, value_columns) in INDICATOR_TABLES.items():
+        values = np.stack([outputs[column] for column in value_columns], axis=-1)
+        rows, columns = np.nonzero(~np.isnan(values).any(axis=-1))
+        data_values = (
+            (symbols[row], dates[column], *values[row, column].tolist())
+            for row, column in zip(rows, columns)
+        )
+        updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in value_columns)
+        bulk_insert_data(
+            connection=conn,
+            db_schema=DB_RAW_DATA_SCHEMA,
+            db_table_name=table_name,
+            table_columns=list(table_schema.keys()),
+            table_data=data_values,
+            on_conflict_action=f'ON CONFLICT (symbol, datetime) DO UPDATE SET {updates}',
+            post_merge_statements=[change_notification_statement(f'{DB_RAW_DATA_SCHEMA}.{table_name}')]
+        )
+
+
+def compute_technical_indicators(full_refresh=False, chunk_rows=BAR_CHUNK_ROWS):
+    """
+    Compute technical indicators locally for every symbol with new daily bars and store them.
+
+    New bars are streamed in chunks of consecutive timestamps, so memory does not grow with the
+    history table. A symbol that got bars dated before its carried-over state, as recorded by the
+    low-water marks of the history table, is recomputed from its first bar.
+
+    Parameters:
+        full_refresh (bool): Ignore the carried-over state and recompute from the first bar.
+        chunk_rows (int): Bars read and processed per chunk.
+
+    Returns:
+        int: Number of new bars processed.
+    """
+    with db_session() as conn:
+        create_indicator_tables(conn)
+        create_ingestion_state_table(conn)
+        marks, late_symbols = load_late_symbols(conn)
+        if late_symbols and not full_refresh:
+            logger.info(f'Recomputing {len(late_symbols)} symbols with bars stored after their last run.')
+        states = {} if full_refresh else load_states(conn, late_symbols)
+        conn.commit()
+
+    engine = IndicatorEngine()
+    last_datetimes = {}
+    processed = 0
+    query, params = new_bars_query(full_refresh, late_symbols)
+
+    # The bars are read on a server-side cursor, so the results are written through another connection
+    with db_session() as read_conn, db_session() as write_conn:
+        for bars in chunk_by_timestamp(stream_select(read_conn, query, params, batch_size=chunk_rows)):
+            engine.add_symbols((bar[0] for bar in bars), states)
+            timestamps, highs, lows, closes = bars_to_matrices(bars, engine.symbol_rows)
+            outputs = engine.update(highs, lows, closes)
+            write_indicator_outputs(write_conn, engine.symbols, timestamps, outputs)
+            for symbol, timestamp, *_ in bars:
+                last_datetimes[symbol] = timestamp
+            processed += len(bars)
+            logger.info(f'Computed indicators over {processed} new bars so far.')
+
+        # Carry the state over to the next run once the results are stored, consuming the marks in the same transaction
+        consume_marks = consume_low_water_marks_statement(HISTORICAL_STOCK_DATA_TABLE_NAME, marks)
+        if not last_datetimes:
+            with write_conn.cursor() as cursor:
+                cursor.execute(*consume_marks)
+            write_conn.commit()
+            logger.info('No new daily bars to compute indicators for.')
+            return 0
+
+        exported_states = engine.export_states()
+        bulk_insert_data(
+            connection=write_conn,
+            db_schema=DB_RAW_DATA_SCHEMA,
+            db_table_name=INDICATOR_STATE_TABLE_NAME,
+            table_columns=list(INDICATOR_STATE_TABLE_SCHEMA.keys()),
+            table_data=[
+                (symbol, last_datetime, json.dumps(exported_states[symbol]))
+                for symbol, last_datetime in last_datetimes.items()
+            ],
+            on_conflict_action=(
+                'ON CONFLICT (symbol) DO UPDATE SET '
+                'last_datetime = EXCLUDED.last_datetime, state = EXCLUDED.state'
+            ),
+            # One transaction, so the marks are only consumed along with the states they were taken into
+            batch_size=len(last_datetimes),
+            post_merge_statements=[consume_marks]
+        )
+
+    logger.info(f'Finished computing technical indicators: {processed} new bars of {len(last_datetimes)} symbols.')
+    return processed
+
+
+if __name__ == "__main__":
+    compute_technical_indicators(full_refresh='--full-refresh' in sys.argv)
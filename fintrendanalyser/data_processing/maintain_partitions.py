@@ -0,0 +1,191 @@
+"""
+Partition maintenance of the time-partitioned raw tables: creates the upcoming partitions,
+drops the partitions past the retention period, and converts tables created before
+partitioning was introduced.
+
+Usage (from the fintrendanalyser directory):
+    python -m data_processing.maintain_partitions
+    python -m data_processing.maintain_partitions --intraday-retention-months 24
+    python -m data_processing.maintain_partitions --migrate
+"""
+from utils.constants import (
+    DB_RAW_DATA_SCHEMA,
+    HISTORICAL_STOCK_DATA_TABLE_NAME,
+    HISTORICAL_STOCK_DATA_TABLE_SCHEMA,
+    HISTORICAL_STOCK_DATA_TABLE_CONSTRAINTS,
+    HISTORICAL_STOCK_DATA_TABLE_INDEXES,
+    HISTORICAL_STOCK_DATA_TABLE_PARTITIONING,
+    INTRADAY_STOCK_DATA_TABLE_NAME,
+    INTRADAY_STOCK_DATA_TABLE_SCHEMA,
+    INTRADAY_STOCK_DATA_TABLE_CONSTRAINTS,
+    INTRADAY_STOCK_DATA_TABLE_INDEXES,
+    INTRADAY_STOCK_DATA_TABLE_PARTITIONING
+)
+from utils.database import (
+    db_session,
+    create_table_with_schema,
+    drop_partitions_before,
+    ensure_future_partitions,
+    ensure_partitions,
+    execute_select,
+    forget_created_tables,
+    shift_period
+)
+from utils.environment import load_environment
+from utils.logging import setup_logger
+import argparse
+import datetime
+import os
+
+
+logger = setup_logger(name='maintain_partitions')
+
+# Partitioned tables, with the environment variable holding their retention in partition intervals
+PARTITIONED_TABLES = {
+    INTRADAY_STOCK_DATA_TABLE_NAME: {
+        'schema': INTRADAY_STOCK_DATA_TABLE_SCHEMA,
+        'constraints': INTRADAY_STOCK_DATA_TABLE_CONSTRAINTS,
+        'partitioning': INTRADAY_STOCK_DATA_TABLE_PARTITIONING,
+        'indexes': INTRADAY_STOCK_DATA_TABLE_INDEXES,
+        'retention_variable': 'INTRADAY_RETENTION_MONTHS',
+    },
+    HISTORICAL_STOCK_DATA_TABLE_NAME: {
+        'schema': HISTORICAL_STOCK_DATA_TABLE_SCHEMA,
+        'constraints': HISTORICAL_STOCK_DATA_TABLE_CONSTRAINTS,
+        'partitioning': HISTORICAL_STOCK_DATA_TABLE_PARTITIONING,
+        'indexes': HISTORICAL_STOCK_DATA_TABLE_INDEXES,
+        'retention_variable': 'HISTORICAL_RETENTION_YEARS',
+    },
+}
+
+
+def create_partitioned_table(conn, table_name):
+    table = PARTITIONED_TABLES[table_name]
+    create_table_with_schema(
+        connection=conn,
+        db_schema=DB_RAW_DATA_SCHEMA,
+        db_table_name=table_name,
+        db_table_schema_definition=table['schema'],
+        constraints=table['constraints'],
+        partitioning=table['partitioning'],
+        indexes=table['indexes']
+    )
+
+
+def migrate_to_partitioned_table(conn, table_name):
+    """
+    Convert a table created before partitioning was introduced into a partitioned table.
+
+    The table is renamed to <table>_unpartitioned, recreated partitioned, and its rows are copied
+    over before the old table is dropped. An interrupted migration resumes from the renamed table.
+    Ingestion into the table must be stopped while it runs.
+
+    Parameters:
+        conn: The database connection object.
+        table_name (str): Name of a table of PARTITIONED_TABLES.
+
+    Returns:
+        int: Number of rows copied.
+    """
+    table = PARTITIONED_TABLES[table_name]
+    full_table_name = f'{DB_RAW_DATA_SCHEMA}.{table_name}'
+    legacy_table_name = f'{table_name}_unpartitioned'
+    legacy_full_table_name = f'{DB_RAW_DATA_SCHEMA}.{legacy_table_name}'
+
+    (exists, partitioned, legacy_exists), = execute_select(
+        conn,
+        'SELECT to_regclass(%s) IS NOT NULL, '
+        'EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)), '
+        'to_regclass(%s) IS NOT NULL',
+        (full_table_name, full_table_name, legacy_full_table_name)
+    )
+    if (partitioned or not exists) and not legacy_exists:
+        logger.info(f'Table "{full_table_name}" needs no migration.')
+        return 0
+
+    if not legacy_exists:
+        # Free the names of the table, its primary key and its indexes for the partitioned table
+        with conn.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {full_table_name} RENAME TO {legacy_table_name}')
+            cursor.execute(
+                f'ALTER TABLE {legacy_full_table_name} RENAME CONSTRAINT {table_name}_pkey TO {legacy_table_name}_pkey'
+            )
+            for suffix in table['indexes']:
+                cursor.execute(f'DROP INDEX IF EXISTS {DB_RAW_DATA_SCHEMA}.{table_name}_{suffix}')
+        conn.commit()
+        logger.info(f'Renamed "{full_table_name}" to "{legacy_full_table_name}".')
+
+    forget_created_tables()
+    create_partitioned_table(conn, table_name)
+
+    (first, last), = execute_select(
+        conn,
+        f"SELECT MIN({table['partitioning']['column']}), MAX({table['partitioning']['column']}) FROM {legacy_full_table_name}"
+    )
+    copied = 0
+    if first is not None:
+        ensure_partitions(conn, DB_RAW_DATA_SCHEMA, table_name, table['partitioning'], first, last)
+        columns = ', '.join(table['schema'])
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {full_table_name} ({columns}) SELECT {columns} FROM {legacy_full_table_name} '
+                f'ON CONFLICT DO NOTHING'
+            )
+            copied = cursor.rowcount
+            cursor.execute(f'DROP TABLE {legacy_full_table_name}')
+    else:
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {legacy_full_table_name}')
+    conn.commit()
+    logger.info(f'Migrated {copied} rows of "{full_table_name}" to a partitioned table.')
+    return copied
+
+
+def maintain_partitions(retention=None, migrate=False):
+    """
+    Create the upcoming partitions of every partitioned table and drop those past their retention.
+
+    Parameters:
+        retention (dict, optional): Table name mapped to the number of partition intervals to keep,
+            None to keep everything; tables left out use their retention environment variable.
+        migrate (bool): First convert tables created before partitioning was introduced.
+
+    Returns:
+        dict: Table name mapped to the names of the dropped partitions.
+    """
+    load_environment()
+    retention = retention or {}
+    dropped = {}
+
+    with db_session() as conn:
+        for table_name, table in PARTITIONED_TABLES.items():
+            if migrate:
+                migrate_to_partitioned_table(conn, table_name)
+            create_partitioned_table(conn, table_name)
+
+            # The tables may already be known to this process, so premake the partitions explicitly
+            partitioning = table['partitioning']
+            ensure_future_partitions(conn, DB_RAW_DATA_SCHEMA, table_name, partitioning)
+
+            periods = retention.get(table_name, os.getenv(table['retention_variable']))
+            if periods is None:
+                continue
+            # Keep the current partition plus the given number of past ones
+            cutoff = shift_period(datetime.date.today(), partitioning['interval'], -int(periods))
+            dropped[table_name] = drop_partitions_before(conn, DB_RAW_DATA_SCHEMA, table_name, partitioning, cutoff)
+
+    return dropped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create upcoming partitions and apply retention.')
+    parser.add_argument('--intraday-retention-months', type=int, help='Months of intraday bars to keep.')
+    parser.add_argument('--historical-retention-years', type=int, help='Years of daily bars to keep.')
+    parser.add_argument('--migrate', action='store_true', help='Convert unpartitioned tables first.')
+    args = parser.parse_args()
+    retention = {}
+    if args.intraday_retention_months is not None:
+        retention[INTRADAY_STOCK_DATA_TABLE_NAME] = args.intraday_retention_months
+    if args.historical_retention_years is not None:
+        retention[HISTORICAL_STOCK_DATA_TABLE_NAME] = args.historical_retention_years
+    maintain_partitions(retention=retention, migrate=args.migrate)
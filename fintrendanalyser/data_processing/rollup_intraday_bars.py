@@ -0,0 +1,206 @@
+from utils.constants import (
+    DB_PROCESSED_DATA_SCHEMA,
+    DB_RAW_DATA_SCHEMA,
+    INTRADAY_ROLLUP_INTERVALS,
+    INTRADAY_ROLLUP_TABLE_NAMES,
+    INTRADAY_ROLLUP_TABLE_SCHEMA,
+    INTRADAY_ROLLUP_TABLE_CONSTRAINTS,
+    INTRADAY_STOCK_DATA_TABLE_NAME
+)
+from utils.database import db_session, create_table_with_schema
+from utils.events import change_notification_statement
+from utils.ingestion_state import (
+    INGESTION_STATE_TABLE_FULLNAME,
+    create_ingestion_state_table,
+    load_watermarks,
+    low_water_source
+)
+from utils.logging import setup_logger
+import argparse
+
+
+logger = setup_logger(name='rollup_intraday_bars')
+
+# Checkpoints are kept per symbol and interval in the ingestion state table, under JOB_NAME:<interval>
+JOB_NAME = 'rollup_intraday_bars'
+
+RAW_TABLE_FULLNAME = f'{DB_RAW_DATA_SCHEMA}.{INTRADAY_STOCK_DATA_TABLE_NAME}'
+
+# Origin the buckets of every interval are aligned to (a midnight, so daily buckets are calendar days)
+BUCKET_ORIGIN = '2000-01-03 00:00:00'
+
+PENDING_TABLE_NAME = 'pending_intraday_rollups'
+
+def create_rollup_tables(conn):
+    for table_name in INTRADAY_ROLLUP_TABLE_NAMES.values():
+        create_table_with_schema(
+            connection=conn,
+            db_schema=DB_PROCESSED_DATA_SCHEMA,
+            db_table_name=table_name,
+            db_table_schema_definition=INTRADAY_ROLLUP_TABLE_SCHEMA,
+            constraints=INTRADAY_ROLLUP_TABLE_CONSTRAINTS
+        )
+    create_ingestion_state_table(conn)
+
+
+def checkpoint_source(interval):
+    return f'{JOB_NAME}:{interval}'
+
+
+def apply_low_water_marks(conn):
+    """
+    Lower the checkpoints of every interval to the low-water marks left by the intraday writers, and clear the marks.
+
+    A mark records the earliest minute written below a symbol's ingestion watermark, e.g. by a full
+    backfill or a gap filled late; those minutes are older than the checkpoints, so without this
+    they would never be rolled up. Taking the marks and lowering the checkpoints is one statement,
+    so a mark written concurrently is either applied or kept for the next run.
+
+    Returns:
+        int: Number of checkpoints lowered.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f'WITH marks AS ('
+            f'DELETE FROM {INGESTION_STATE_TABLE_FULLNAME} WHERE source = %(low_water_source)s '
+            f'RETURNING symbol, watermark) '
+            f'UPDATE {INGESTION_STATE_TABLE_FULLNAME} rollup_state '
+            f'SET watermark = LEAST(rollup_state.watermark, marks.watermark), updated_at = NOW() '
+            f'FROM marks WHERE rollup_state.symbol = marks.symbol '
+            f'AND rollup_state.source = ANY(%(checkpoint_sources)s)',
+            {
+                'low_water_source': low_water_source(INTRADAY_STOCK_DATA_TABLE_NAME),
+                'checkpoint_sources': [checkpoint_source(interval) for interval in INTRADAY_ROLLUP_INTERVALS]
+            }
+        )
+        lowered = cursor.rowcount
+    conn.commit()
+    if lowered:
+        logger.info(f'Lowered {lowered} rollup checkpoints to minutes written below the ingestion watermarks.')
+    return lowered
+
+
+def stage_pending_symbols(conn, interval, full_refresh):
+    """
+    Collect the symbols with minutes ingested since their last rollup to an interval into a temporary table.
+
+    Each row holds the rollup checkpoint of the symbol (NULL to start from its first minute) and the
+    ingestion watermark the run rolls up to.
+
+    Returns:
+        int: Number of symbols to roll up.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMP TABLE {PENDING_TABLE_NAME} ON COMMIT DROP AS '
+            f'SELECT source_state.symbol, '
+            f'CASE WHEN %(full_refresh)s THEN NULL ELSE rollup_state.watermark::timestamp END AS checkpoint, '
+            f'source_state.watermark::timestamp AS upper_bound, source_state.watermark '
+            f'FROM {INGESTION_STATE_TABLE_FULLNAME} source_state '
+            f'LEFT JOIN {INGESTION_STATE_TABLE_FULLNAME} rollup_state '
+            f'ON rollup_state.source = %(checkpoint_source)s AND rollup_state.symbol = source_state.symbol '
+            f'WHERE source_state.source = %(source)s AND source_state.watermark IS NOT NULL '
+            f'AND (%(full_refresh)s OR rollup_state.watermark IS NULL OR source_state.watermark > rollup_state.watermark)',
+            {
+                'full_refresh': full_refresh,
+                'checkpoint_source': checkpoint_source(interval),
+                'source': INTRADAY_STOCK_DATA_TABLE_NAME
+            }
+        )
+        return cursor.rowcount
+
+
+def rollup_interval(conn, interval):
+    """
+    Recompute the buckets of one interval touched by the pending minutes, in a single INSERT ... SELECT.
+
+    Only buckets from the one holding a symbol's checkpoint onwards are aggregated: earlier buckets
+    are closed and already stored, while the checkpoint's bucket may have been stored half-filled.
+
+    Parameters:
+        conn: The database connection object.
+        interval (str): Key of INTRADAY_ROLLUP_INTERVALS.
+
+    Returns:
+        int: Number of buckets written.
+    """
+    table_fullname = f'{DB_PROCESSED_DATA_SCHEMA}.{INTRADAY_ROLLUP_TABLE_NAMES[interval]}'
+    bucket = 'date_bin(%(interval)s::interval, {column}, %(origin)s::timestamp)'
+    value_columns = ['open', 'high', 'low', 'close', 'volume', 'bar_count']
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in value_columns)
+    sql = (
+        f"INSERT INTO {table_fullname} (symbol, datetime, {', '.join(value_columns)}) "
+        f"SELECT bars.symbol, {bucket.format(column='bars.datetime')} AS bucket, "
+        f"(array_agg(bars.open ORDER BY bars.datetime))[1], MAX(bars.high), MIN(bars.low), "
+        f"(array_agg(bars.close ORDER BY bars.datetime DESC))[1], SUM(bars.volume), COUNT(*) "
+        f"FROM {RAW_TABLE_FULLNAME} bars JOIN {PENDING_TABLE_NAME} pending ON pending.symbol = bars.symbol "
+        f"WHERE bars.datetime <= pending.upper_bound "
+        f"AND (pending.checkpoint IS NULL OR bars.datetime >= {bucket.format(column='pending.checkpoint')}) "
+        f"GROUP BY bars.symbol, bucket "
+        f"ON CONFLICT (symbol, datetime) DO UPDATE SET {updates}"
+    )
+    with conn.cursor() as cursor:
+        cursor.execute(sql, {'interval': INTRADAY_ROLLUP_INTERVALS[interval], 'origin': BUCKET_ORIGIN})
+        written = cursor.rowcount
+        cursor.execute(*change_notification_statement(table_fullname, source_table=PENDING_TABLE_NAME))
+        # Move the checkpoints in the same transaction as the buckets
+        cursor.execute(
+            f'INSERT INTO {INGESTION_STATE_TABLE_FULLNAME} (source, symbol, watermark, updated_at) '
+            f'SELECT %s, symbol, watermark, NOW() FROM {PENDING_TABLE_NAME} '
+            f'ON CONFLICT (source, symbol) DO UPDATE SET '
+            f'watermark = EXCLUDED.watermark, updated_at = EXCLUDED.updated_at',
+            (checkpoint_source(interval),)
+        )
+    return written
+
+
+def rollup_intraday_bars(intervals=None, full_refresh=False):
+    """
+    Incrementally maintain OHLCV rollups of the 1-minute intraday bars.
+
+    Each run only aggregates the minutes ingested since the per-symbol checkpoint of an interval,
+    recomputing the buckets that were still open at the previous run; checkpoints are first lowered
+    to the minutes written late below them, such as backfills. The aggregation runs
+    set-based inside PostgreSQL (date_bin, PostgreSQL 14+), and each interval commits its buckets
+    together with its new checkpoints.
+
+    Parameters:
+        intervals (list, optional): Keys of INTRADAY_ROLLUP_INTERVALS to maintain, defaults to all.
+        full_refresh (bool): Ignore the checkpoints and recompute every bucket.
+
+    Returns:
+        dict: Number of buckets written per interval.
+    """
+    intervals = intervals or list(INTRADAY_ROLLUP_INTERVALS)
+    written = {}
+
+    with db_session() as conn:
+        create_rollup_tables(conn)
+        # Seeds the ingestion watermarks of the raw table if the ingestion never recorded them
+        load_watermarks(conn, source=INTRADAY_STOCK_DATA_TABLE_NAME, data_table_fullname=RAW_TABLE_FULLNAME)
+        # Applied to every interval, also those outside this run, as the marks are cleared
+        apply_low_water_marks(conn)
+
+        for interval in intervals:
+            pending_symbols = stage_pending_symbols(conn, interval, full_refresh)
+            if not pending_symbols:
+                conn.rollback()
+                logger.info(f'No new intraday bars to roll up to {interval}.')
+                continue
+            written[interval] = rollup_interval(conn, interval)
+            conn.commit()
+            logger.info(f'Wrote {written[interval]} {interval} bars for {pending_symbols} symbols.')
+
+    logger.info('Finished rolling up intraday bars.')
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Roll 1-minute intraday bars up to coarser intervals.')
+    parser.add_argument(
+        '--interval', dest='intervals', action='append', choices=list(INTRADAY_ROLLUP_INTERVALS),
+        help='Interval to maintain, may be repeated; defaults to all.'
+    )
+    parser.add_argument('--full-refresh', action='store_true', help='Ignore the checkpoints and recompute everything.')
+    args = parser.parse_args()
+    rollup_intraday_bars(intervals=args.intervals, full_refresh=args.full_refresh)
@@ -0,0 +1,199 @@
+from concurrent.futures import ProcessPoolExecutor
+from utils.constants import (
+    DB_PROCESSED_DATA_SCHEMA,
+    FINANCIAL_NEWS_TABLE_NAME,
+    NEWS_CLUSTERS_TABLE_NAME,
+    NEWS_SENTIMENT_TABLE_NAME,
+    NEWS_SENTIMENT_TABLE_SCHEMA,
+    NEWS_SENTIMENT_TABLE_CONSTRAINTS,
+    SENTIMENT_CACHE_TABLE_NAME,
+    SENTIMENT_CACHE_TABLE_SCHEMA,
+    SENTIMENT_CACHE_TABLE_CONSTRAINTS
+)
+from utils.database import (
+    db_session,
+    create_table_with_schema,
+    bulk_insert_data,
+    stream_select
+)
+from utils.environment import get_setting
+from utils.logging import setup_logger
+import argparse
+import multiprocessing
+import os
+import time
+
+
+logger = setup_logger(name='score_news_sentiment')
+
+NEWS_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{FINANCIAL_NEWS_TABLE_NAME}'
+SENTIMENT_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{NEWS_SENTIMENT_TABLE_NAME}'
+CACHE_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{SENTIMENT_CACHE_TABLE_NAME}'
+CLUSTERS_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{NEWS_CLUSTERS_TABLE_NAME}'
+
+# Articles read from the database per chunk
+STREAM_CHUNK_SIZE = 5000
+
+# Texts sent to a worker process per task, large enough to amortise the inter-process overhead
+SCORING_BATCH_SIZE = 250
+
+def score_texts(texts):
+    """
+    Score the sentiment of a batch of texts with TextBlob. Runs in the worker processes.
+
+    Parameters:
+        texts (list): Texts to score.
+
+    Returns:
+        list: (polarity, subjectivity) of each text.
+    """
+    from textblob import TextBlob
+
+    scores = []
+    for text in texts:
+        sentiment = TextBlob(text).sentiment
+        scores.append((sentiment.polarity, sentiment.subjectivity))
+    return scores
+
+
+def create_sentiment_tables(conn):
+    create_table_with_schema(
+        connection=conn,
+        db_schema=DB_PROCESSED_DATA_SCHEMA,
+        db_table_name=NEWS_SENTIMENT_TABLE_NAME,
+        db_table_schema_definition=NEWS_SENTIMENT_TABLE_SCHEMA,
+        constraints=NEWS_SENTIMENT_TABLE_CONSTRAINTS
+    )
+    create_table_with_schema(
+        connection=conn,
+        db_schema=DB_PROCESSED_DATA_SCHEMA,
+        db_table_name=SENTIMENT_CACHE_TABLE_NAME,
+        db_table_schema_definition=SENTIMENT_CACHE_TABLE_SCHEMA,
+        constraints=SENTIMENT_CACHE_TABLE_CONSTRAINTS
+    )
+
+
+def unscored_articles_query():
+    """
+    Build the query returning every cluster representative without a score, with its content hash
+    and cached score.
+
+    Near-duplicates of a representative are not scored, and articles not clustered yet wait for the
+    next run. The text is only returned when the hash misses the cache, so cached articles cost no transfer.
+    """
+    content = "concat_ws(E'\\n', news.title, news.description)"
+    return (
+        f"SELECT article.url, article.content_hash, cache.polarity, cache.subjectivity, "
+        f"CASE WHEN cache.content_hash IS NULL THEN article.content END "
+        f"FROM ("
+        f"SELECT news.url, {content} AS content, md5({content}) AS content_hash FROM {NEWS_TABLE_FULLNAME} news "
+        f"JOIN {CLUSTERS_TABLE_FULLNAME} clusters ON clusters.url = news.url "
+        f"WHERE clusters.representative IS NOT FALSE "
+        f"AND NOT EXISTS (SELECT 1 FROM {SENTIMENT_TABLE_FULLNAME} scored WHERE scored.url = news.url)"
+        f") article "
+        f"LEFT JOIN {CACHE_TABLE_FULLNAME} cache ON cache.content_hash = article.content_hash"
+    )
+
+
+def score_chunk(executor, rows):
+    """
+    Score the articles of a chunk, sending each distinct uncached text to the worker processes once.
+
+    Returns:
+        tuple: Sentiment rows of every article, and the newly computed cache rows.
+    """
+    texts = {}
+    for _, content_hash, polarity, _, content in rows:
+        if polarity is None and content_hash not in texts:
+            texts[content_hash] = content
+
+    hashes = list(texts)
+    batches = [
+        [texts[content_hash] for content_hash in hashes[start:start + SCORING_BATCH_SIZE]]
+        for start in range(0, len(hashes), SCORING_BATCH_SIZE)
+    ]
+    new_scores = {}
+    for start, scores in zip(range(0, len(hashes), SCORING_BATCH_SIZE), executor.map(score_texts, batches)):
+        new_scores.update(zip(hashes[start:start + SCORING_BATCH_SIZE], scores))
+
+    sentiment_rows = [
+        (url, content_hash, *((polarity, subjectivity) if polarity is not None else new_scores[content_hash]))
+        for url, content_hash, polarity, subjectivity, _ in rows
+    ]
+    cache_rows = [(content_hash, *scores) for content_hash, scores in new_scores.items()]
+    return sentiment_rows, cache_rows
+
+
+def score_news_sentiment(max_workers=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Score the sentiment of the title and description of every cluster representative not scored yet,
+    as assigned by cluster_news_duplicates.
+
+    Articles are streamed in chunks; the texts of a chunk are batched across a pool of worker
+    processes. Scores are cached by content hash, so re-published or duplicate articles reuse the
+    score of the first copy instead of being scored again.
+
+    Parameters:
+        max_workers (int, optional): Number of worker processes, defaults to SENTIMENT_SCORING_WORKERS
+            or the number of CPUs.
+        chunk_size (int): Articles read and written per chunk.
+
+    Returns:
+        dict: Articles scored, of which cache hits, elapsed seconds and articles per second.
+    """
+    from data_processing.cluster_news_duplicates import create_cluster_tables
+
+    if max_workers is None:
+        max_workers = get_setting('SENTIMENT_SCORING_WORKERS', os.cpu_count() or 1, int)
+    start = time.perf_counter()
+    articles = cached = 0
+
+    with db_session() as conn:
+        create_sentiment_tables(conn)
+        # Run on its own, the job finds no representatives until the news are clustered
+        create_cluster_tables(conn)
+
+    # Workers are spawned rather than forked, so they inherit neither the pooled connections nor threads
+    with db_session() as read_conn, db_session() as write_conn, \
+            ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        for rows in stream_select(read_conn, unscored_articles_query(), batch_size=chunk_size):
+            sentiment_rows, cache_rows = score_chunk(executor, rows)
+            bulk_insert_data(
+                connection=write_conn,
+                db_schema=DB_PROCESSED_DATA_SCHEMA,
+                db_table_name=SENTIMENT_CACHE_TABLE_NAME,
+                table_columns=list(SENTIMENT_CACHE_TABLE_SCHEMA.keys()),
+                table_data=cache_rows,
+                on_conflict_action='ON CONFLICT (content_hash) DO NOTHING'
+            )
+            bulk_insert_data(
+                connection=write_conn,
+                db_schema=DB_PROCESSED_DATA_SCHEMA,
+                db_table_name=NEWS_SENTIMENT_TABLE_NAME,
+                table_columns=['url', 'content_hash', 'polarity', 'subjectivity'],
+                table_data=sentiment_rows,
+                on_conflict_action='ON CONFLICT (url) DO NOTHING'
+            )
+            articles += len(rows)
+            cached += len(rows) - len(cache_rows)
+            logger.info(f'Scored {articles} articles so far.')
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'articles': articles,
+        'cache_hits': cached,
+        'seconds': elapsed,
+        'articles_per_second': articles / elapsed if elapsed > 0 else 0.0,
+    }
+    logger.info(
+        f'Finished scoring news sentiment: {articles} articles ({cached} reused from the cache) '
+        f'in {elapsed:.1f}s, {stats["articles_per_second"]:.0f} articles/sec with {max_workers} workers.'
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Score the sentiment of processed financial news.')
+    parser.add_argument('--workers', type=int, help='Worker processes, defaults to SENTIMENT_SCORING_WORKERS.')
+    args = parser.parse_args()
+    score_news_sentiment(max_workers=args.workers)
@@ -2,52 +2,213 @@ from utils.constants import (
     DB_PROCESSED_DATA_SCHEMA,
     DB_RAW_DATA_SCHEMA,
     FINANCIAL_NEWS_TABLE_NAME,
-    FINANCIAL_NEWS_TABLE_SCHEMA
+    FINANCIAL_NEWS_TABLE_SCHEMA,
+    PROCESSED_FINANCIAL_NEWS_TABLE_CONSTRAINTS,
+    RAW_FINANCIAL_NEWS_TABLE_SCHEMA
 )
 from utils.database import (
-    get_db_connection,
+    db_session,
     create_table_with_schema,
     execute_select,
-    insert_data,
+    bulk_insert_data,
+    stream_select
 )
 from utils.logging import setup_logger
+from utils.watermarks import (
+    create_watermarks_table,
+    get_job_watermark,
+    set_job_watermark
+)
+import argparse
 
 
 logger = setup_logger(name='transform_financial_news')
 
-def transform_financial_news():
-    # Establish database connection
-    conn = get_db_connection()
+JOB_NAME = 'transform_financial_news'
+
+RAW_TABLE_FULLNAME = f"{DB_RAW_DATA_SCHEMA}.{FINANCIAL_NEWS_TABLE_NAME}"
+PROCESSED_TABLE_FULLNAME = f"{DB_PROCESSED_DATA_SCHEMA}.{FINANCIAL_NEWS_TABLE_NAME}"
+
+# Articles stored this long before the watermark are re-examined, to pick up the rows of ingestion
+# transactions that started before the last run but committed after it
+WATERMARK_LOOKBACK = '1 hour'
+
+# Rows per chunk when streaming raw articles through Python
+STREAM_CHUNK_SIZE = 5000
 
+REMOVED_MARKER = '[Removed]'
+
+def prepare_tables(conn):
+    """
+    Create the processed table and the raw-side column and index the incremental scan relies on.
+
+    Processed tables created before the URL key existed are deduplicated once and given the key.
+    Raw tables created before ingested_at existed get it, set to the current time for existing rows,
+    so those are scanned once more.
+    """
     create_table_with_schema(
         connection=conn,
         db_schema=DB_PROCESSED_DATA_SCHEMA,
         db_table_name=FINANCIAL_NEWS_TABLE_NAME,
-        db_table_schema_definition=FINANCIAL_NEWS_TABLE_SCHEMA
+        db_table_schema_definition=FINANCIAL_NEWS_TABLE_SCHEMA,
+        constraints=PROCESSED_FINANCIAL_NEWS_TABLE_CONSTRAINTS
+    )
+    create_watermarks_table(conn)
+
+    url_key_exists = execute_select(
+        conn, f"SELECT to_regclass('{DB_PROCESSED_DATA_SCHEMA}.{FINANCIAL_NEWS_TABLE_NAME}_url_key') IS NOT NULL"
+    )[0][0]
+    with conn.cursor() as cursor:
+        if not url_key_exists:
+            logger.info(f'Removing duplicate URLs from "{PROCESSED_TABLE_FULLNAME}" before adding its URL key.')
+            cursor.execute(
+                f"DELETE FROM {PROCESSED_TABLE_FULLNAME} a USING {PROCESSED_TABLE_FULLNAME} b "
+                "WHERE a.url = b.url AND a.ctid < b.ctid"
+            )
+            cursor.execute(
+                f"CREATE UNIQUE INDEX {FINANCIAL_NEWS_TABLE_NAME}_url_key ON {PROCESSED_TABLE_FULLNAME} (url)"
+            )
+        cursor.execute(
+            f"ALTER TABLE {RAW_TABLE_FULLNAME} ADD COLUMN IF NOT EXISTS "
+            f"ingested_at {RAW_FINANCIAL_NEWS_TABLE_SCHEMA['ingested_at']}"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {FINANCIAL_NEWS_TABLE_NAME}_ingested_at_idx "
+            f"ON {RAW_TABLE_FULLNAME} (ingested_at)"
+        )
+    conn.commit()
+
+
+def get_scan_bounds(conn, full_refresh):
+    """
+    Return the ingested_at range of raw articles to process in this run.
+
+    The scan follows the time articles were stored rather than published, so older articles
+    stored late, e.g. by a resumed backfill of a company, are still picked up.
+
+    Returns:
+        tuple: Lower bound (None to scan from the start) and upper bound (None if there is nothing to process).
+    """
+    watermark = None if full_refresh else get_job_watermark(conn, JOB_NAME)
+    if watermark is None:
+        lower_bound = None
+        upper_bound = execute_select(conn, f"SELECT MAX(ingested_at) FROM {RAW_TABLE_FULLNAME}")[0][0]
+    else:
+        lower_bound, upper_bound = execute_select(
+            conn,
+            f"SELECT %s::timestamptz - INTERVAL '{WATERMARK_LOOKBACK}', MAX(ingested_at) "
+            f"FROM {RAW_TABLE_FULLNAME} WHERE ingested_at >= %s::timestamptz - INTERVAL '{WATERMARK_LOOKBACK}'",
+            (watermark, watermark)
+        )[0]
+    return lower_bound, upper_bound
+
+
+def transform_in_database(conn, lower_bound, upper_bound):
+    """
+    Filter, deduplicate and insert new raw articles with a single INSERT ... SELECT ... ON CONFLICT.
+
+    Returns:
+        int: Number of articles inserted.
+    """
+    columns = ', '.join(FINANCIAL_NEWS_TABLE_SCHEMA.keys())
+    removed_checks = ', '.join(f"COALESCE({column}::text, '')" for column in FINANCIAL_NEWS_TABLE_SCHEMA)
+    sql = (
+        f"INSERT INTO {PROCESSED_TABLE_FULLNAME} ({columns}) "
+        f"SELECT DISTINCT ON (url) {columns} FROM {RAW_TABLE_FULLNAME} "
+        f"WHERE ingested_at <= %(upper_bound)s "
+        f"AND (%(lower_bound)s::timestamptz IS NULL OR ingested_at >= %(lower_bound)s) "
+        f"AND %(removed_marker)s NOT IN ({removed_checks}) "
+        f"ORDER BY url, published_at DESC "
+        f"ON CONFLICT (url) DO NOTHING"
     )
+    with conn.cursor() as cursor:
+        cursor.execute(sql, {
+            'lower_bound': lower_bound,
+            'upper_bound': upper_bound,
+            'removed_marker': REMOVED_MARKER
+        })
+        return cursor.rowcount
+
+
+def transform_in_python(lower_bound, upper_bound, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Stream new raw articles through Python in chunks and bulk insert the ones passing the filter.
 
-    # Retrieve raw data from the raw schema's table
-    raw_table_fullname = f"{DB_RAW_DATA_SCHEMA}.{FINANCIAL_NEWS_TABLE_NAME}"
-    raw_data = execute_select(conn, f"SELECT * FROM {raw_table_fullname}")
-
-    # Process the data: remove entries with "[Removed]"
-    processed_data = [
-        row for row in raw_data if "[Removed]" not in row
-    ]
-
-    # Insert processed data into the processed schema's table
-    for data_row in processed_data:
-        insert_data(
-            connection=conn,
-            db_schema=DB_PROCESSED_DATA_SCHEMA,
-            db_table_name=FINANCIAL_NEWS_TABLE_NAME,
-            table_columns=list(FINANCIAL_NEWS_TABLE_SCHEMA.keys()),
-            table_data=data_row
+    Returns:
+        int: Number of articles inserted.
+    """
+    columns = list(FINANCIAL_NEWS_TABLE_SCHEMA.keys())
+    inserted = 0
+
+    with db_session() as read_conn, db_session() as write_conn:
+        # The scan runs on a server-side cursor, so only one chunk is held in memory at a time
+        chunks = stream_select(
+            read_conn,
+            f"SELECT {', '.join(columns)} FROM {RAW_TABLE_FULLNAME} "
+            f"WHERE ingested_at <= %(upper_bound)s "
+            f"AND (%(lower_bound)s::timestamptz IS NULL OR ingested_at >= %(lower_bound)s)",
+            {'lower_bound': lower_bound, 'upper_bound': upper_bound},
+            batch_size=chunk_size,
+            cursor_name='transform_financial_news_scan'
         )
+        for rows in chunks:
+            # Process the data: remove entries with "[Removed]"
+            processed_data = [row for row in rows if REMOVED_MARKER not in row]
+            chunk_inserted, _ = bulk_insert_data(
+                connection=write_conn,
+                db_schema=DB_PROCESSED_DATA_SCHEMA,
+                db_table_name=FINANCIAL_NEWS_TABLE_NAME,
+                table_columns=columns,
+                table_data=processed_data,
+                on_conflict_action='ON CONFLICT (url) DO NOTHING'
+            )
+            inserted += chunk_inserted
+
+    return inserted
+
+
+def transform_financial_news(mode='sql', full_refresh=False):
+    """
+    Incrementally copy new raw financial news into the processed schema, dropping removed
+    articles and duplicate URLs.
+
+    Only raw articles stored since the stored watermark (minus a short lookback) are scanned,
+    so a run scales with new data rather than with the size of the raw table.
+
+    Parameters:
+        mode (str): "sql" to transform inside PostgreSQL, "python" to stream chunks through Python.
+        full_refresh (bool): Ignore the watermark and scan the whole raw table.
+
+    Returns:
+        int: Number of articles inserted.
+    """
+    # Check out a pooled database connection
+    with db_session() as conn:
+        prepare_tables(conn)
+
+        lower_bound, upper_bound = get_scan_bounds(conn, full_refresh)
+        if upper_bound is None:
+            logger.info('No new financial news to transform.')
+            return 0
+
+        logger.info(f'Transforming financial news stored between {lower_bound} and {upper_bound} ({mode} mode).')
+        if mode == 'sql':
+            inserted = transform_in_database(conn, lower_bound, upper_bound)
+        elif mode == 'python':
+            inserted = transform_in_python(lower_bound, upper_bound)
+        else:
+            raise ValueError(f'Unknown transform mode "{mode}".')
+
+        # Advance the watermark in the same transaction as the set-based insert
+        set_job_watermark(conn, JOB_NAME, upper_bound)
+
+    logger.info(f'Finished transforming and storing financial news data ({inserted} new articles).')
+    return inserted
 
-    # Close the database connection
-    conn.close()
-    logger.info('Finished transforming and storing financial news data.')
 
 if __name__ == "__main__":
-    transform_financial_news()
+    parser = argparse.ArgumentParser(description='Transform raw financial news into the processed schema.')
+    parser.add_argument('--mode', choices=['sql', 'python'], default='sql', help='Where the transform runs.')
+    parser.add_argument('--full-refresh', action='store_true', help='Ignore the watermark and rescan everything.')
+    args = parser.parse_args()
+    transform_financial_news(mode=args.mode, full_refresh=args.full_refresh)
@@ -0,0 +1,346 @@
+"""
+Single entry point running the ingestion and processing jobs as a dependency graph.
+
+Independent jobs run concurrently and share the process-wide connection pool, response cache
+and rate limiters. A failing job is retried; jobs depending on a job that still fails are skipped.
+An ingestion job fails when any of its symbols, companies or requests failed, so processing
+jobs never run on partial data.
+
+Usage (from the fintrendanalyser directory):
+    python -m orchestrator
+    python -m orchestrator --tasks financial_news --with-downstream
+    python -m orchestrator --rerun-failed run_summary.json
+    python -m orchestrator --profile --profile-cpu
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from utils.database import get_db_pool
+from utils.environment import load_environment
+from utils.logging import get_metrics, setup_logger
+from utils.profiling import get_telemetry, span
+import argparse
+import json
+import sys
+import time
+
+
+logger = setup_logger(name='orchestrator')
+
+# Maximum number of jobs running at the same time
+DEFAULT_MAX_PARALLEL_TASKS = 4
+
+# Retries of a failing job, and seconds before the first retry (doubled on each attempt)
+DEFAULT_TASK_RETRIES = 2
+DEFAULT_RETRY_DELAY = 30.0
+
+
+class TaskUnitsFailed(Exception):
+    """
+    Raised by a job wrapper when some units of work of its job failed, e.g. symbols of an ingestion.
+    """
+
+
+def check_statuses(statuses, unit):
+    """
+    Raise TaskUnitsFailed if any unit of a job failed.
+
+    Parameters:
+        statuses (dict): Unit mapped to its status, failures starting with "failed".
+        unit (str): Plural name of the units, used in the error.
+
+    Returns:
+        dict: The statuses, when no unit failed.
+    """
+    failed = sorted(name for name, status in statuses.items() if status.startswith('failed'))
+    if failed:
+        listed = ', '.join(failed[:10]) + (', ...' if len(failed) > 10 else '')
+        raise TaskUnitsFailed(f'{len(failed)} of {len(statuses)} {unit} failed: {listed}.')
+    return statuses
+
+
+class Task:
+    """
+    A job of the platform with the jobs it depends on.
+    """
+
+    def __init__(self, name, function, dependencies=(), retries=DEFAULT_TASK_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+        """
+        Parameters:
+            name (str): Unique task name.
+            function (callable): Runs the job, called without arguments.
+            dependencies (tuple): Names of the tasks that must succeed first.
+            retries (int): Retries after a failure.
+            retry_delay (float): Seconds before the first retry, doubled on each attempt.
+        """
+        self.name = name
+        self.function = function
+        self.dependencies = tuple(dependencies)
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+
+def build_tasks(args):
+    """
+    Declare the jobs of the platform and their dependencies.
+
+    Jobs import their module when they run, so a run only loads the clients it needs.
+
+    Returns:
+        dict: Task name mapped to its Task.
+    """
+
+    def historical_stock_data():
+        from data_ingestion.fetch_historical_stock_data import fetch_historical_stock_data
+        from utils.universe import load_symbol_universe
+        return check_statuses(
+            fetch_historical_stock_data(load_symbol_universe(path=args.symbols_file), full_backfill=args.full_backfill),
+            'symbols'
+        )
+
+    def intraday_stock_data():
+        from data_ingestion.fetch_intraday_stock_data import fetch_intraday_stock_data
+        from utils.universe import load_symbol_universe
+        return check_statuses(
+            fetch_intraday_stock_data(load_symbol_universe(path=args.symbols_file), full_backfill=args.full_backfill),
+            'symbols'
+        )
+
+    def financial_news():
+        from data_ingestion.fetch_financial_news import fetch_financial_news
+        return check_statuses(fetch_financial_news(), 'companies')
+
+    def economic_data():
+        from data_ingestion.fetch_economic_data import fetch_economic_data
+        return check_statuses(fetch_economic_data(full_backfill=args.full_backfill), 'requests')
+
+    def transform_financial_news():
+        from data_processing.transform_financial_news import transform_financial_news
+        return transform_financial_news(full_refresh=args.full_refresh)
+
+    def news_sentiment():
+        from data_processing.score_news_sentiment import score_news_sentiment
+        return score_news_sentiment()
+
+    def news_clusters():
+        from data_processing.cluster_news_duplicates import cluster_news_duplicates
+        return cluster_news_duplicates()
+
+    def partition_maintenance():
+        from data_processing.maintain_partitions import maintain_partitions
+        return maintain_partitions()
+
+    def technical_indicators():
+        from data_processing.compute_technical_indicators import compute_technical_indicators
+        return compute_technical_indicators(full_refresh=args.full_refresh)
+
+    def intraday_rollups():
+        from data_processing.rollup_intraday_bars import rollup_intraday_bars
+        return rollup_intraday_bars(full_refresh=args.full_refresh)
+
+    def risk_statistics():
+        from data_processing.compute_risk_statistics import compute_risk_statistics
+        return compute_risk_statistics(full_refresh=args.full_refresh)
+
+    tasks = [
+        Task('historical_stock_data', historical_stock_data),
+        Task('intraday_stock_data', intraday_stock_data),
+        Task('financial_news', financial_news),
+        Task('economic_data', economic_data),
+        Task('transform_financial_news', transform_financial_news, dependencies=['financial_news']),
+        Task('news_clusters', news_clusters, dependencies=['transform_financial_news']),
+        Task('news_sentiment', news_sentiment, dependencies=['news_clusters']),
+        Task('partition_maintenance', partition_maintenance),
+        Task('technical_indicators', technical_indicators, dependencies=['historical_stock_data']),
+        Task('intraday_rollups', intraday_rollups, dependencies=['intraday_stock_data']),
+        Task('risk_statistics', risk_statistics, dependencies=['historical_stock_data']),
+    ]
+    for task in tasks:
+        task.retries = args.retries
+        task.retry_delay = args.retry_delay
+    return {task.name: task for task in tasks}
+
+
+def select_tasks(tasks, names=None, with_upstream=False, with_downstream=False):
+    """
+    Pick the tasks of a partial run.
+
+    Parameters:
+        tasks (dict): All tasks by name.
+        names (list, optional): Tasks to run, defaults to all of them.
+        with_upstream (bool): Also run the tasks the selected ones depend on.
+        with_downstream (bool): Also run the tasks depending on the selected ones.
+
+    Returns:
+        set: Names of the tasks to run.
+    """
+    if not names:
+        return set(tasks)
+    unknown = set(names) - set(tasks)
+    if unknown:
+        raise ValueError(f'Unknown tasks: {", ".join(sorted(unknown))}.')
+
+    selected = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for task in tasks.values():
+            if with_upstream and task.name in selected:
+                missing = set(task.dependencies) - selected
+                if missing:
+                    selected |= missing
+                    changed = True
+            if with_downstream and task.name not in selected and selected & set(task.dependencies):
+                selected.add(task.name)
+                changed = True
+    return selected
+
+
+def run_task(task):
+    """
+    Run a task, retrying it with backoff.
+
+    Returns:
+        dict: Status, attempts, duration, and the result or error of the last attempt.
+    """
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            with span('orchestrator.task', task.name):
+                result = task.function()
+        except Exception as e:
+            if attempt > task.retries:
+                logger.error(f'Task "{task.name}" failed after {attempt} attempts: ', exc_info=e)
+                return {
+                    'status': 'failed',
+                    'attempts': attempt,
+                    'seconds': time.perf_counter() - start,
+                    'error': f'{type(e).__name__}: {e}'
+                }
+            delay = task.retry_delay * 2 ** (attempt - 1)
+            logger.warning(f'Task "{task.name}" failed ({e}), retrying in {delay:.0f}s.')
+            time.sleep(delay)
+            continue
+        return {
+            'status': 'succeeded',
+            'attempts': attempt,
+            'seconds': time.perf_counter() - start,
+            'result': result
+        }
+
+
+def run_tasks(tasks, selected, max_parallel=DEFAULT_MAX_PARALLEL_TASKS):
+    """
+    Run the selected tasks as soon as their dependencies have succeeded.
+
+    Dependencies outside the selection are assumed to be satisfied. Tasks whose dependencies
+    failed or were skipped are skipped.
+
+    Parameters:
+        tasks (dict): All tasks by name.
+        selected (set): Names of the tasks to run.
+        max_parallel (int): Maximum number of tasks running at the same time.
+
+    Returns:
+        dict: Summary of each selected task, as returned by run_task, plus "skipped" entries.
+    """
+    summary = {}
+    pending = {name: tasks[name] for name in selected}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='orchestrator') as executor:
+        while pending or running:
+            for name, task in list(pending.items()):
+                dependencies = [dependency for dependency in task.dependencies if dependency in selected]
+                if any(summary.get(dependency, {}).get('status') in ('failed', 'skipped') for dependency in dependencies):
+                    summary[name] = {'status': 'skipped', 'attempts': 0, 'seconds': 0.0}
+                    logger.warning(f'Skipping task "{name}": a dependency did not succeed.')
+                    del pending[name]
+                elif all(summary.get(dependency, {}).get('status') == 'succeeded' for dependency in dependencies):
+                    logger.info(f'Starting task "{name}".')
+                    running[executor.submit(run_task, task)] = name
+                    del pending[name]
+
+            if not running:
+                if pending:
+                    raise ValueError(f'Circular dependencies between tasks: {", ".join(sorted(pending))}.')
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                summary[name] = future.result()
+                logger.info(f'Task "{name}" {summary[name]["status"]} in {summary[name]["seconds"]:.1f}s.')
+
+    return summary
+
+
+def log_summary(summary):
+    logger.info('Run summary:')
+    for name, outcome in summary.items():
+        logger.info(
+            f'  {name:<28} {outcome["status"]:<10} {outcome["seconds"]:>8.1f}s  {outcome["attempts"]} attempt(s)'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the ingestion and processing jobs.')
+    parser.add_argument('--tasks', nargs='+', help='Run only these tasks.')
+    parser.add_argument('--with-upstream', action='store_true', help='Also run the dependencies of --tasks.')
+    parser.add_argument('--with-downstream', action='store_true', help='Also run the tasks depending on --tasks.')
+    parser.add_argument('--rerun-failed', metavar='SUMMARY', help='Rerun the failed and skipped tasks of a summary file.')
+    parser.add_argument('--list', action='store_true', help='List the tasks and their dependencies.')
+    parser.add_argument('--max-parallel', type=int, default=DEFAULT_MAX_PARALLEL_TASKS, help='Concurrent tasks.')
+    parser.add_argument('--retries', type=int, default=DEFAULT_TASK_RETRIES, help='Retries of a failing task.')
+    parser.add_argument('--retry-delay', type=float, default=DEFAULT_RETRY_DELAY, help='Seconds before the first retry.')
+    parser.add_argument('--summary-file', help='Write the run summary as JSON to this file.')
+    parser.add_argument('--symbols-file', help='File with one stock symbol per line.')
+    parser.add_argument('--full-backfill', action='store_true', help='Fetch full histories.')
+    parser.add_argument('--full-refresh', action='store_true', help='Recompute processed data from scratch.')
+    parser.add_argument('--profile', action='store_true', help='Time the job steps and export the run telemetry.')
+    parser.add_argument('--profile-cpu', action='store_true', help='Also capture a cProfile profile of the run.')
+    parser.add_argument('--profile-memory', action='store_true', help='Also trace allocations with tracemalloc.')
+    parser.add_argument('--telemetry-dir', help='Directory of the exported telemetry, defaults to FTA_TELEMETRY_DIR.')
+    args = parser.parse_args()
+
+    # Load .env before any job module is imported, so their settings see it
+    load_environment()
+    tasks = build_tasks(args)
+    if args.list:
+        for task in tasks.values():
+            print(f'{task.name}: {", ".join(task.dependencies) or "-"}')
+        return
+
+    names = args.tasks
+    if args.rerun_failed:
+        with open(args.rerun_failed) as summary_file:
+            previous = json.load(summary_file)
+        names = [name for name, outcome in previous.items() if outcome['status'] != 'succeeded']
+        if not names:
+            logger.info('Every task of the previous run succeeded, nothing to rerun.')
+            return
+
+    selected = select_tasks(tasks, names, with_upstream=args.with_upstream, with_downstream=args.with_downstream)
+    logger.info(f'Running {len(selected)} tasks: {", ".join(sorted(selected))}.')
+
+    telemetry = get_telemetry()
+    if args.profile or args.profile_cpu or args.profile_memory:
+        telemetry.enable()
+    if telemetry.enabled:
+        telemetry.start(cpu=args.profile_cpu, memory=args.profile_memory)
+
+    summary = run_tasks(tasks, selected, max_parallel=args.max_parallel)
+    log_summary(summary)
+    if telemetry.enabled:
+        telemetry.export('run', directory=args.telemetry_dir)
+    get_db_pool().log_stats()
+    get_metrics().log_summary(logger)
+    if args.summary_file:
+        with open(args.summary_file, 'w') as summary_file:
+            json.dump(summary, summary_file, indent=2, default=str)
+
+    if any(outcome['status'] != 'succeeded' for outcome in summary.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Checks of the COPY stream written by bulk_insert_data and of its handling of failed batches,
+against a fake connection recording what would be sent to PostgreSQL.
+
+Usage (from the fintrendanalyser directory):
+    python -m unittest discover -s tests -t .
+"""
+from utils.database import COPY_NULL_MARKER, _format_copy_value, bulk_insert_data
+import datetime
+import numpy as np
+import pandas as pd
+import unittest
+
+
+class FakeCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, params=None):
+        if sql.startswith('INSERT INTO') and 'staging_' in sql:
+            if len(self.connection.copied) in self.connection.failing_batches:
+                raise RuntimeError('merge failed')
+            self.rowcount = len(self.connection.copied[-1])
+        self.connection.statements.append((sql, params))
+
+    def copy_expert(self, sql, buffer):
+        self.connection.copied.append(buffer.read().splitlines())
+
+
+class FakeConnection:
+
+    def __init__(self, failing_batches=()):
+        self.failing_batches = set(failing_batches)
+        self.copied = []
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FormatCopyValueTest(unittest.TestCase):
+
+    def test_missing_values_are_null(self):
+        for value in (None, float('nan'), np.nan, np.float64('nan'), pd.NA, pd.NaT, np.datetime64('NaT', 'D')):
+            with self.subTest(value=value):
+                self.assertEqual(_format_copy_value(value), COPY_NULL_MARKER)
+
+    def test_strings_are_quoted(self):
+        self.assertEqual(_format_copy_value('\\N'), '"\\N"')
+        self.assertEqual(_format_copy_value(''), '""')
+        self.assertEqual(_format_copy_value('say "hi", then\nleave'), '"say ""hi"", then\nleave"')
+
+    def test_other_values(self):
+        self.assertEqual(_format_copy_value(3), '3')
+        self.assertEqual(_format_copy_value(np.int64(3)), '3')
+        self.assertEqual(_format_copy_value(2.5), '2.5')
+        self.assertEqual(_format_copy_value(datetime.date(2024, 1, 31)), '2024-01-31')
+
+
+class BulkInsertTest(unittest.TestCase):
+
+    def test_copy_stream_keeps_null_markers_and_strings_apart(self):
+        connection = FakeConnection()
+        bulk_insert_data(connection, 'raw', 'items', ['a', 'b'], [('\\N', None), ('', float('nan'))])
+
+        self.assertEqual(connection.copied, [['"\\N",\\N', '"",\\N']])
+
+    def test_dataframe_rows(self):
+        connection = FakeConnection()
+        frame = pd.DataFrame({'symbol': ['AAA', None], 'close': pd.array([1, None], dtype='Int64')})
+        inserted, skipped = bulk_insert_data(connection, 'raw', 'items', ['symbol', 'close'], frame)
+
+        self.assertEqual(connection.copied, [['"AAA",1', '\\N,\\N']])
+        self.assertEqual((inserted, skipped), (2, 0))
+
+    def test_failed_batch_is_rolled_back_and_raised(self):
+        connection = FakeConnection(failing_batches={2})
+        rows = [(index,) for index in range(5)]
+
+        with self.assertRaises(RuntimeError):
+            bulk_insert_data(
+                connection, 'raw', 'items', ['a'], rows, batch_size=2,
+                post_merge_statements=[('UPDATE state SET seen = TRUE FROM {staging_table}', ())]
+            )
+
+        # The first batch stays committed, the second is rolled back and the third never sent
+        self.assertEqual(connection.commits, 1)
+        self.assertEqual(connection.rollbacks, 1)
+        self.assertEqual(len(connection.copied), 2)
+        post_merges = [sql for sql, _ in connection.statements if sql.startswith('UPDATE state')]
+        self.assertEqual(post_merges, ['UPDATE state SET seen = TRUE FROM staging_items'])
+
+
+if __name__ == '__main__':
+    unittest.main()
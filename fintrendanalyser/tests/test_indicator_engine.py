@@ -0,0 +1,149 @@
+"""
+Checks of the incremental indicator engine against pandas reference implementations, and of
+its state carried between runs.
+
+Usage (from the fintrendanalyser directory):
+    python -m unittest discover -s tests -t .
+"""
+from data_processing.compute_technical_indicators import (
+    ATR_PERIOD,
+    BBANDS_STD_DEVS,
+    EMA_PERIOD,
+    MACD_FAST_PERIOD,
+    MACD_SIGNAL_PERIOD,
+    MACD_SLOW_PERIOD,
+    RSI_PERIOD,
+    SMA_PERIOD,
+    IndicatorEngine
+)
+import json
+import numpy as np
+import pandas as pd
+import unittest
+
+
+BARS = 120
+SYMBOLS = ['AAA', 'BBB', 'CCC']
+
+
+def make_bars(seed=7):
+    """
+    Build random walks of highs, lows and closes, with missing bars for the last symbol.
+    """
+    rng = np.random.default_rng(seed)
+    closes = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.02, (len(SYMBOLS), BARS)), axis=1))
+    highs = closes * (1.0 + rng.uniform(0.0, 0.02, closes.shape))
+    lows = closes * (1.0 - rng.uniform(0.0, 0.02, closes.shape))
+    missing = rng.random(BARS) < 0.2
+    for values in (closes, highs, lows):
+        values[-1, missing] = np.nan
+    return highs, lows, closes
+
+
+def wilder_average(values, period):
+    """
+    Wilder average of a series: the mean of its first period values, then smoothed with alpha 1/period.
+    """
+    seeded = values.iloc[period - 1:].copy()
+    seeded.iloc[0] = values.iloc[:period].mean()
+    return seeded.ewm(alpha=1.0 / period, adjust=False).mean().reindex(values.index)
+
+
+def reference_indicators(high, low, close):
+    """
+    Compute the indicators of one symbol with pandas, over its bars only.
+    """
+    sma = close.rolling(SMA_PERIOD).mean()
+    std = close.rolling(SMA_PERIOD).std(ddof=0)
+    ema = close.ewm(span=EMA_PERIOD, adjust=False).mean()
+    ema[:EMA_PERIOD - 1] = np.nan
+
+    macd = (
+        close.ewm(span=MACD_FAST_PERIOD, adjust=False).mean()
+        - close.ewm(span=MACD_SLOW_PERIOD, adjust=False).mean()
+    )
+    signal = macd.iloc[MACD_SLOW_PERIOD - 1:].ewm(span=MACD_SIGNAL_PERIOD, adjust=False).mean().reindex(macd.index)
+    signal[:MACD_SLOW_PERIOD + MACD_SIGNAL_PERIOD - 2] = np.nan
+    macd = macd.where(signal.notna())
+
+    change = close.diff().iloc[1:]
+    gain = wilder_average(change.clip(lower=0.0), RSI_PERIOD).reindex(close.index)
+    loss = wilder_average((-change).clip(lower=0.0), RSI_PERIOD).reindex(close.index)
+    rsi = 100.0 - 100.0 / (1.0 + gain / loss)
+
+    previous_close = close.shift()
+    true_range = pd.concat(
+        [high - low, (high - previous_close).abs(), (low - previous_close).abs()], axis=1
+    ).max(axis=1)
+    atr = wilder_average(true_range, ATR_PERIOD)
+
+    return {
+        'sma': sma,
+        'middle_band': sma,
+        'upper_band': sma + BBANDS_STD_DEVS * std,
+        'lower_band': sma - BBANDS_STD_DEVS * std,
+        'ema': ema,
+        'macd': macd,
+        'macd_signal': signal,
+        'macd_hist': macd - signal,
+        'rsi': rsi,
+        'atr': atr,
+    }
+
+
+class IndicatorEngineTest(unittest.TestCase):
+
+    def test_matches_pandas_reference(self):
+        highs, lows, closes = make_bars()
+        outputs = IndicatorEngine(SYMBOLS).update(highs, lows, closes)
+
+        for row, symbol in enumerate(SYMBOLS):
+            has_bar = ~np.isnan(closes[row])
+            expected = reference_indicators(
+                pd.Series(highs[row, has_bar]), pd.Series(lows[row, has_bar]), pd.Series(closes[row, has_bar])
+            )
+            for name, values in expected.items():
+                with self.subTest(symbol=symbol, indicator=name):
+                    np.testing.assert_allclose(outputs[name][row, has_bar], values.to_numpy(), rtol=1e-9)
+                    self.assertTrue(np.isnan(outputs[name][row, ~has_bar]).all())
+
+    def test_restored_state_matches_a_single_pass(self):
+        highs, lows, closes = make_bars()
+        single_pass = IndicatorEngine(SYMBOLS).update(highs, lows, closes)
+
+        split = BARS // 3
+        first_run = IndicatorEngine(SYMBOLS[:2])
+        first_run.update(highs[:2, :split], lows[:2, :split], closes[:2, :split])
+        # The state goes through the same JSON round-trip as between two runs
+        states = json.loads(json.dumps(first_run.export_states()))
+
+        # The last symbol only appears in the second run
+        second_run = IndicatorEngine(SYMBOLS, states)
+        outputs = second_run.update(highs[:, split:], lows[:, split:], closes[:, split:])
+        third_symbol_start = IndicatorEngine(SYMBOLS[2:]).update(
+            highs[2:, split:], lows[2:, split:], closes[2:, split:]
+        )
+
+        for name, values in outputs.items():
+            with self.subTest(indicator=name):
+                np.testing.assert_allclose(values[:2], single_pass[name][:2, split:], rtol=1e-9)
+                np.testing.assert_allclose(values[2:], third_symbol_start[name], rtol=1e-9)
+
+    def test_chunks_match_a_single_pass(self):
+        highs, lows, closes = make_bars()
+        single_pass = IndicatorEngine(SYMBOLS).update(highs, lows, closes)
+
+        engine = IndicatorEngine()
+        chunks = []
+        for start in range(0, BARS, 17):
+            engine.add_symbols(SYMBOLS)
+            chunk = slice(start, start + 17)
+            chunks.append(engine.update(highs[:, chunk], lows[:, chunk], closes[:, chunk]))
+
+        for name, values in single_pass.items():
+            with self.subTest(indicator=name):
+                np.testing.assert_allclose(np.hstack([chunk[name] for chunk in chunks]), values, rtol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
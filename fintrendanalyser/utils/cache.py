@@ -0,0 +1,290 @@
+from utils.constants import RESPONSE_CACHE_TTLS
+from utils.environment import get_flag, get_setting
+from utils.logging import get_metrics, setup_logger
+import collections
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+logger = setup_logger(name='response_cache')
+
+# Cache location and limits, overridable with the FTA_CACHE_DIR and FTA_CACHE_MAX_BYTES variables
+DEFAULT_RESPONSE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'fintrendanalyser')
+DEFAULT_RESPONSE_CACHE_MAX_BYTES = 1024 ** 3
+
+# Default time-to-live of namespaces missing from RESPONSE_CACHE_TTLS, in seconds
+DEFAULT_RESPONSE_CACHE_TTL = 60 * 60
+
+_USE_DEFAULT_TTL = object()
+
+
+class CacheMissError(Exception):
+    """
+    Raised in offline mode when a request has no cached response.
+    """
+
+
+class ResponseCache:
+    """
+    Provider-agnostic, persistent cache of API responses stored in a local SQLite file.
+
+    Entries are keyed by a hash of the provider namespace and the request, expire after a
+    per-namespace time-to-live, and are evicted least recently used first once the cache
+    grows beyond max_bytes. Values are stored pickled, so parsed JSON and DataFrames can be cached.
+    In offline mode, responses are only replayed from the cache and misses raise CacheMissError.
+
+    The file also counts the calls made to each rate-limited API per UTC day, so that every
+    process sharing it draws from the same daily request budget.
+    """
+
+    def __init__(
+            self,
+            path=None,
+            max_bytes=None,
+            offline=None,
+            ttls=None
+            ):
+        """
+        Parameters:
+            path (str, optional): SQLite file, defaults to responses.sqlite in FTA_CACHE_DIR.
+            max_bytes (int, optional): Size cap of the stored values in bytes, defaults to FTA_CACHE_MAX_BYTES.
+            offline (bool, optional): Replay cached responses only, never calling the providers;
+                defaults to FTA_CACHE_OFFLINE.
+            ttls (dict, optional): Time-to-live per namespace in seconds, defaults to RESPONSE_CACHE_TTLS.
+        """
+        if path is None:
+            cache_dir = get_setting('FTA_CACHE_DIR', DEFAULT_RESPONSE_CACHE_DIR)
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, 'responses.sqlite')
+
+        self.path = path
+        self.max_bytes = get_setting('FTA_CACHE_MAX_BYTES', DEFAULT_RESPONSE_CACHE_MAX_BYTES, int) \
+            if max_bytes is None else max_bytes
+        self.offline = get_flag('FTA_CACHE_OFFLINE') if offline is None else offline
+        self.ttls = RESPONSE_CACHE_TTLS if ttls is None else ttls
+        self._lock = threading.Lock()
+        self._hits = collections.Counter()
+        self._misses = collections.Counter()
+
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, namespace TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, '
+            'created_at REAL NOT NULL, expires_at REAL, last_accessed REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_last_accessed ON responses (last_accessed)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS daily_usage ('
+            'api TEXT NOT NULL, day TEXT NOT NULL, calls INTEGER NOT NULL, PRIMARY KEY (api, day))'
+        )
+
+    @staticmethod
+    def make_key(namespace, request):
+        """
+        Build the cache key of a request.
+
+        Parameters:
+            namespace (str): Provider or endpoint namespace, e.g. "newsapi".
+            request: JSON-serialisable description of the request, without credentials.
+
+        Returns:
+            str: Hex digest identifying the request.
+        """
+        payload = json.dumps([namespace, request], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, namespace, request):
+        """
+        Look up a cached response.
+
+        Returns:
+            tuple: (True, value) on a hit, (False, None) on a miss or an expired entry.
+        """
+        key = self.make_key(namespace, request)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT value, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] <= now:
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                row = None
+            if row is None:
+                self._misses[namespace] += 1
+                return False, None
+            self._db.execute('UPDATE responses SET last_accessed = ? WHERE key = ?', (now, key))
+            self._hits[namespace] += 1
+        return True, pickle.loads(row[0])
+
+    def set(self, namespace, request, value, ttl=_USE_DEFAULT_TTL):
+        """
+        Store a response, evicting least recently used entries if the cache grows beyond its size cap.
+
+        Parameters:
+            namespace (str): Provider or endpoint namespace.
+            request: JSON-serialisable description of the request.
+            value: Picklable response to store.
+            ttl (float, optional): Time-to-live in seconds, None to keep the entry until evicted.
+        """
+        if ttl is _USE_DEFAULT_TTL:
+            ttl = self.ttls.get(namespace, DEFAULT_RESPONSE_CACHE_TTL)
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, namespace, value, size, created_at, expires_at, last_accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.make_key(namespace, request), namespace, blob, len(blob), now, expires_at, now)
+            )
+            self._evict()
+
+    def _evict(self):
+        total_size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        self._db.execute('DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),))
+        evicted = 0
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY last_accessed').fetchall()
+        total_size = sum(size for _, size in rows)
+        for key, size in rows:
+            if total_size <= self.max_bytes:
+                break
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total_size -= size
+            evicted += 1
+        if evicted:
+            logger.info(f'Evicted {evicted} least recently used responses from the cache.')
+
+    def get_or_fetch(self, namespace, request, fetch, ttl=_USE_DEFAULT_TTL):
+        """
+        Return the cached response of a request, calling fetch and caching its result on a miss.
+
+        Parameters:
+            namespace (str): Provider or endpoint namespace, selects the default time-to-live.
+            request: JSON-serialisable description of the request, without credentials.
+            fetch (callable): Function performing the request; exceptions are propagated and not cached.
+            ttl (float, optional): Time-to-live overriding the namespace default, None for immutable data.
+
+        Returns:
+            The cached or freshly fetched response.
+        """
+        hit, value = self.get(namespace, request)
+        if hit:
+            return value
+        if self.offline:
+            raise CacheMissError(f'No cached {namespace} response for {request} in offline mode.')
+        # Only misses reach the provider, so this measures the API latency of each namespace
+        with get_metrics().timer(f'api.{namespace}.request_seconds'):
+            value = fetch()
+        self.set(namespace, request, value, ttl=ttl)
+        return value
+
+    def reserve_daily_call(self, api, day, limit):
+        """
+        Count a call against the budget of an API for a day, unless the budget is spent.
+
+        The check and the increment run in one write transaction, so concurrent processes never
+        overdraw the budget.
+
+        Parameters:
+            api (str): Name of the rate-limited API.
+            day (str): UTC date, in ISO format.
+            limit (int): Calls allowed that day.
+
+        Returns:
+            bool: Whether the call was counted; False when the budget is spent.
+        """
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT calls FROM daily_usage WHERE api = ? AND day = ?', (api, day)).fetchone()
+                if row is not None and row[0] >= limit:
+                    self._db.execute('COMMIT')
+                    return False
+                self._db.execute(
+                    'INSERT INTO daily_usage (api, day, calls) VALUES (?, ?, 1) '
+                    'ON CONFLICT (api, day) DO UPDATE SET calls = calls + 1',
+                    (api, day)
+                )
+                self._db.execute('DELETE FROM daily_usage WHERE day < ?', (day,))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return True
+
+    def release_daily_call(self, api, day):
+        """
+        Give back a call counted by reserve_daily_call that was not made after all.
+
+        Parameters:
+            api (str): Name of the rate-limited API.
+            day (str): UTC date the call was counted on, in ISO format.
+        """
+        with self._lock:
+            self._db.execute(
+                'UPDATE daily_usage SET calls = calls - 1 WHERE api = ? AND day = ? AND calls > 0',
+                (api, day)
+            )
+
+    def daily_usage(self, api, day):
+        """
+        Return the number of calls counted against the budget of an API for a day, by any process.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT calls FROM daily_usage WHERE api = ? AND day = ?', (api, day)).fetchone()
+        return row[0] if row else 0
+
+    def stats(self):
+        """
+        Return hit and miss counters per namespace.
+
+        Returns:
+            dict: Namespace mapped to a dict of hits and misses.
+        """
+        with self._lock:
+            namespaces = set(self._hits) | set(self._misses)
+            return {
+                namespace: {'hits': self._hits[namespace], 'misses': self._misses[namespace]}
+                for namespace in sorted(namespaces)
+            }
+
+    def log_stats(self, job_logger=None):
+        """
+        Log the hit and miss counters of every namespace used so far.
+
+        Parameters:
+            job_logger (logging.Logger, optional): Logger of the job, defaults to the cache logger.
+        """
+        for namespace, counters in self.stats().items():
+            (job_logger or logger).info(
+                f"Response cache {namespace}: {counters['hits']} hits, {counters['misses']} misses."
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """
+    Return the process-wide response cache, opening it on first use.
+
+    Returns:
+        ResponseCache: The shared cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+            if _cache.offline:
+                logger.info('Response cache is in offline replay mode.')
+        return _cache
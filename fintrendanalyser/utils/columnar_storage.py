@@ -0,0 +1,266 @@
+from utils.environment import get_flag, get_setting
+from utils.logging import setup_logger
+import datetime
+import os
+import time
+import uuid
+
+
+logger = setup_logger(name='columnar_storage')
+
+# Root directory of the Parquet datasets, overridable with the FTA_PARQUET_DIR variable
+DEFAULT_PARQUET_STORAGE_DIR = os.path.join(os.path.expanduser('~'), '.local', 'share', 'fintrendanalyser', 'parquet')
+
+# Partition granularity of each dataset: one directory per year for daily bars, per month for intraday bars
+HISTORICAL_BARS_DATASET = 'historical_stock_data'
+INTRADAY_BARS_DATASET = 'intraday_stock_data'
+DATASET_GRANULARITY = {
+    HISTORICAL_BARS_DATASET: 'year',
+    INTRADAY_BARS_DATASET: 'month',
+}
+
+BAR_COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'volume']
+BAR_DTYPES = {'open': 'float64', 'high': 'float64', 'low': 'float64', 'close': 'float64', 'volume': 'int64'}
+
+COMPACTED_FILE_NAME = 'data.parquet'
+
+
+def parquet_storage_dir():
+    """
+    Return the root directory of the Parquet datasets, FTA_PARQUET_DIR or the default one.
+    """
+    return get_setting('FTA_PARQUET_DIR', DEFAULT_PARQUET_STORAGE_DIR)
+
+
+def parquet_sink_enabled():
+    """
+    Return whether FTA_PARQUET_SINK enables the Parquet sink of the ingestion scripts without passing --parquet.
+    """
+    return get_flag('FTA_PARQUET_SINK')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            'The Parquet storage requires pyarrow, install the "parquet" extra with '
+            '"poetry install --extras parquet" or "pip install fintrendanalyser[parquet]".'
+        ) from e
+    return pyarrow, pyarrow.parquet
+
+
+def _partition_period(timestamp, granularity):
+    return f'{timestamp.year:04d}' if granularity == 'year' else f'{timestamp.year:04d}-{timestamp.month:02d}'
+
+
+def _period_bounds(period):
+    """
+    Return the first and last (year, month) covered by a partition period.
+    """
+    if len(period) == 4:
+        return (int(period), 1), (int(period), 12)
+    year, month = period.split('-')
+    return (int(year), int(month)), (int(year), int(month))
+
+
+def _partition_dir(root, dataset, symbol, period):
+    return os.path.join(root, dataset, f'symbol={symbol}', f'period={period}')
+
+
+class ParquetBarSink:
+    """
+    Append-and-compact Parquet sink for OHLCV bars, partitioned by symbol and period.
+
+    Each append writes a new part file into the partitions it touches; compact() later merges the
+    parts of every touched partition into a single sorted, deduplicated file.
+    """
+
+    def __init__(self, dataset, root=None):
+        """
+        Parameters:
+            dataset (str): Dataset name, e.g. HISTORICAL_BARS_DATASET.
+            root (str, optional): Root directory of the Parquet datasets, defaults to parquet_storage_dir().
+        """
+        self.dataset = dataset
+        self.root = root or parquet_storage_dir()
+        self.granularity = DATASET_GRANULARITY.get(dataset, 'year')
+        self._touched = set()
+
+    def append(self, symbol, bars):
+        """
+        Append bars of a symbol.
+
+        Parameters:
+            symbol (str): Stock symbol.
+            bars (DataFrame): Bars with the columns of BAR_COLUMNS.
+
+        Returns:
+            int: Number of bars written.
+        """
+        if bars.empty:
+            return 0
+        pa, pq = _import_pyarrow()
+
+        bars = bars[BAR_COLUMNS].astype(BAR_DTYPES)
+        periods = [_partition_period(timestamp, self.granularity) for timestamp in bars['datetime']]
+        for period, partition_bars in bars.groupby(periods, sort=False):
+            partition_dir = _partition_dir(self.root, self.dataset, symbol, period)
+            os.makedirs(partition_dir, exist_ok=True)
+            table = pa.Table.from_pandas(partition_bars, preserve_index=False)
+            # Part names sort by write time, so later appends win when duplicates are merged
+            part_name = f'part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet'
+            pq.write_table(table, os.path.join(partition_dir, part_name))
+            self._touched.add((symbol, period))
+        return len(bars)
+
+    def compact(self):
+        """
+        Compact every partition touched since the last compaction.
+
+        Returns:
+            int: Number of partitions compacted.
+        """
+        touched, self._touched = self._touched, set()
+        for symbol, period in sorted(touched):
+            compact_partition(self.dataset, symbol, period, root=self.root)
+        if touched:
+            logger.info(f'Compacted {len(touched)} partitions of the "{self.dataset}" Parquet dataset.')
+        return len(touched)
+
+
+def compact_partition(dataset, symbol, period, root=None):
+    """
+    Merge the files of a partition into one file sorted by datetime, keeping the latest copy of duplicate bars.
+
+    Parameters:
+        dataset (str): Dataset name.
+        symbol (str): Stock symbol.
+        period (str): Partition period, "YYYY" or "YYYY-MM".
+        root (str, optional): Root directory of the Parquet datasets, defaults to parquet_storage_dir().
+    """
+    pa, pq = _import_pyarrow()
+    partition_dir = _partition_dir(root or parquet_storage_dir(), dataset, symbol, period)
+    file_names = sorted(
+        name for name in os.listdir(partition_dir) if name.endswith('.parquet')
+    )
+    # The compacted file is read first, so bars from newer part files win on duplicates
+    file_names.sort(key=lambda name: name != COMPACTED_FILE_NAME)
+    if len(file_names) <= 1:
+        return
+
+    tables = [_read_parquet_file(os.path.join(partition_dir, name)) for name in file_names]
+    bars = pa.concat_tables(tables).to_pandas()
+    bars = bars.drop_duplicates(subset='datetime', keep='last').sort_values('datetime')
+
+    temporary_path = os.path.join(partition_dir, f'.{COMPACTED_FILE_NAME}.tmp')
+    pq.write_table(pa.Table.from_pandas(bars, preserve_index=False), temporary_path)
+    os.replace(temporary_path, os.path.join(partition_dir, COMPACTED_FILE_NAME))
+    for name in file_names:
+        if name != COMPACTED_FILE_NAME:
+            os.remove(os.path.join(partition_dir, name))
+
+
+def _read_parquet_file(path, columns=None):
+    _, pq = _import_pyarrow()
+    return pq.ParquetFile(path, memory_map=True).read(columns=columns)
+
+
+def _partition_files(dataset, symbol, start, end, root):
+    symbol_dir = os.path.join(root, dataset, f'symbol={symbol}')
+    if not os.path.isdir(symbol_dir):
+        return []
+
+    first = (start.year, start.month) if start is not None else None
+    last = (end.year, end.month) if end is not None else None
+    paths = []
+    for period_dir in sorted(os.listdir(symbol_dir)):
+        period = period_dir.split('=', 1)[1]
+        period_first, period_last = _period_bounds(period)
+        # Prune partitions entirely outside of the requested range
+        if (first is not None and period_last < first) or (last is not None and period_first > last):
+            continue
+        directory = os.path.join(symbol_dir, period_dir)
+        paths.extend(
+            os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.parquet')
+        )
+    return paths
+
+
+def read_bars(dataset, symbols, start=None, end=None, columns=None, root=None):
+    """
+    Load bars of several symbols from Parquet without touching the database.
+
+    Only the partitions overlapping the range are opened; files are memory-mapped and only the
+    requested columns are decoded.
+
+    Parameters:
+        dataset (str): Dataset name.
+        symbols (list): Stock symbols to load.
+        start (datetime, optional): Inclusive lower bound of the bars.
+        end (datetime, optional): Inclusive upper bound of the bars.
+        columns (list, optional): Bar columns to load besides datetime, defaults to all.
+        root (str, optional): Root directory of the Parquet datasets, defaults to parquet_storage_dir().
+
+    Returns:
+        DataFrame: Bars with a symbol column, sorted by symbol and datetime.
+    """
+    pa, _ = _import_pyarrow()
+    import pandas as pd
+
+    root = root or parquet_storage_dir()
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    read_columns = ['datetime'] + [column for column in (columns or BAR_COLUMNS) if column != 'datetime']
+
+    frames = []
+    for symbol in symbols:
+        tables = [
+            _read_parquet_file(path, columns=read_columns)
+            for path in _partition_files(dataset, symbol, start, end, root)
+        ]
+        if not tables:
+            continue
+        bars = pa.concat_tables(tables).to_pandas()
+        bars = bars.drop_duplicates(subset='datetime', keep='last')
+        if start is not None:
+            bars = bars[bars['datetime'] >= _align_timezone(start, bars['datetime'])]
+        if end is not None:
+            bars = bars[bars['datetime'] <= _align_timezone(end, bars['datetime'])]
+        bars.insert(0, 'symbol', symbol)
+        frames.append(bars.sort_values('datetime'))
+
+    if not frames:
+        return pd.DataFrame(columns=['symbol'] + read_columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _align_timezone(timestamp, series):
+    timezone = getattr(series.dt, 'tz', None)
+    if timezone is None:
+        return timestamp.tz_localize(None) if timestamp.tzinfo is not None else timestamp
+    return timestamp.tz_convert(timezone) if timestamp.tzinfo is not None else timestamp.tz_localize(timezone)
+
+
+def load_closes(symbols, years=None, start=None, end=None, dataset=HISTORICAL_BARS_DATASET, root=None):
+    """
+    Load closing prices of several symbols as a dates x symbols frame.
+
+    Parameters:
+        symbols (list): Stock symbols to load.
+        years (int, optional): Number of years back from end (or today) to load, ignored if start is given.
+        start (datetime, optional): Inclusive lower bound.
+        end (datetime, optional): Inclusive upper bound.
+        dataset (str): Dataset name.
+        root (str, optional): Root directory of the Parquet datasets, defaults to parquet_storage_dir().
+
+    Returns:
+        DataFrame: Closing prices indexed by datetime, one column per symbol; use .to_numpy() for an array.
+    """
+    import pandas as pd
+
+    if start is None and years is not None:
+        start = pd.Timestamp(end or datetime.datetime.now()) - pd.DateOffset(years=years)
+    bars = read_bars(dataset, symbols, start=start, end=end, columns=['close'], root=root)
+    return bars.pivot(index='datetime', columns='symbol', values='close').reindex(columns=symbols)
@@ -14,6 +14,9 @@ ECONOMIC_DATA_TABLE_SCHEMA = {
     'obs_status': 'VARCHAR(50)',
     'decimal': 'INT'
 }
+ECONOMIC_DATA_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (indicator_id, country_id, date)'
+]
 
 FINANCIAL_NEWS_TABLE_NAME = 'financial_news'
 FINANCIAL_NEWS_TABLE_SCHEMA = {
@@ -24,6 +27,17 @@ FINANCIAL_NEWS_TABLE_SCHEMA = {
     'published_at': 'TIMESTAMP WITH TIME ZONE',
     'source_name': 'VARCHAR(100)'
 }
+# The raw table also records when each article was stored, the incremental scan key of the news transform
+RAW_FINANCIAL_NEWS_TABLE_SCHEMA = {
+    **FINANCIAL_NEWS_TABLE_SCHEMA,
+    'ingested_at': 'TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()'
+}
+RAW_FINANCIAL_NEWS_TABLE_CONSTRAINTS = [
+    'UNIQUE (url)'
+]
+PROCESSED_FINANCIAL_NEWS_TABLE_CONSTRAINTS = [
+    'UNIQUE (url)'
+]
 
 HISTORICAL_STOCK_DATA_TABLE_NAME = 'historical_stock_data'
 HISTORICAL_STOCK_DATA_TABLE_SCHEMA = {
@@ -38,6 +52,15 @@ HISTORICAL_STOCK_DATA_TABLE_SCHEMA = {
 HISTORICAL_STOCK_DATA_TABLE_CONSTRAINTS = [
     'PRIMARY KEY (symbol, datetime)'
 ]
+# Range partitioning by time: partition length, and number of partitions created ahead of the current one
+HISTORICAL_STOCK_DATA_TABLE_PARTITIONING = {
+    'column': 'datetime',
+    'interval': 'year',
+    'premake': 2
+}
+HISTORICAL_STOCK_DATA_TABLE_INDEXES = {
+    'datetime_brin': 'USING BRIN (datetime)'
+}
 
 INTRADAY_STOCK_DATA_TABLE_NAME = 'intraday_stock_data'
 INTRADAY_STOCK_DATA_TABLE_SCHEMA = {
@@ -52,6 +75,14 @@ INTRADAY_STOCK_DATA_TABLE_SCHEMA = {
 INTRADAY_STOCK_DATA_TABLE_CONSTRAINTS = [
     'PRIMARY KEY (symbol, datetime)'
 ]
+INTRADAY_STOCK_DATA_TABLE_PARTITIONING = {
+    'column': 'datetime',
+    'interval': 'month',
+    'premake': 3
+}
+INTRADAY_STOCK_DATA_TABLE_INDEXES = {
+    'datetime_brin': 'USING BRIN (datetime)'
+}
 
 STOCK_SMA_DATA_TABLE_NAME = 'stock_sma_data'
 STOCK_SMA_DATA_TABLE_SCHEMA = {
@@ -62,3 +93,203 @@ STOCK_SMA_DATA_TABLE_SCHEMA = {
 STOCK_SMA_DATA_TABLE_CONSTRAINTS = [
     'PRIMARY KEY (symbol, datetime)'
 ]
+
+SYMBOL_UNIVERSE_TABLE_NAME = 'symbol_universe'
+SYMBOL_UNIVERSE_TABLE_SCHEMA = {
+    'symbol': 'VARCHAR(10)',
+    'active': 'BOOLEAN DEFAULT TRUE'
+}
+SYMBOL_UNIVERSE_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (symbol)'
+]
+
+# Fallback symbol universe when neither a symbols file nor the universe table is used
+DEFAULT_STOCK_SYMBOLS = ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'TSLA']
+
+# Response cache time-to-live per provider, in seconds (None keeps entries until evicted); yfinance
+# ranges ending before today are immutable and cached without expiry, so its entry covers open ranges
+RESPONSE_CACHE_TTLS = {
+    'worldbank': 7 * 24 * 60 * 60,
+    'newsapi': 60 * 60,
+    'yfinance': 15 * 60,
+    'alpha_vantage': 15 * 60,
+}
+
+JOB_WATERMARKS_TABLE_NAME = 'job_watermarks'
+JOB_WATERMARKS_TABLE_SCHEMA = {
+    'job_name': 'VARCHAR(100)',
+    'watermark': 'TIMESTAMP WITH TIME ZONE',
+    'updated_at': 'TIMESTAMP WITH TIME ZONE DEFAULT NOW()'
+}
+JOB_WATERMARKS_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (job_name)'
+]
+
+STOCK_EMA_DATA_TABLE_NAME = 'stock_ema_data'
+STOCK_EMA_DATA_TABLE_SCHEMA = {
+    'symbol': 'VARCHAR(10)',
+    'datetime': 'DATE',
+    'ema': 'FLOAT'
+}
+
+STOCK_RSI_DATA_TABLE_NAME = 'stock_rsi_data'
+STOCK_RSI_DATA_TABLE_SCHEMA = {
+    'symbol': 'VARCHAR(10)',
+    'datetime': 'DATE',
+    'rsi': 'FLOAT'
+}
+
+STOCK_MACD_DATA_TABLE_NAME = 'stock_macd_data'
+STOCK_MACD_DATA_TABLE_SCHEMA = {
+    'symbol': 'VARCHAR(10)',
+    'datetime': 'DATE',
+    'macd': 'FLOAT',
+    'macd_signal': 'FLOAT',
+    'macd_hist': 'FLOAT'
+}
+
+STOCK_BBANDS_DATA_TABLE_NAME = 'stock_bbands_data'
+STOCK_BBANDS_DATA_TABLE_SCHEMA = {
+    'symbol': 'VARCHAR(10)',
+    'datetime': 'DATE',
+    'middle_band': 'FLOAT',
+    'upper_band': 'FLOAT',
+    'lower_band': 'FLOAT'
+}
+
+STOCK_ATR_DATA_TABLE_NAME = 'stock_atr_data'
+STOCK_ATR_DATA_TABLE_SCHEMA = {
+    'symbol': 'VARCHAR(10)',
+    'datetime': 'DATE',
+    'atr': 'FLOAT'
+}
+
+# All indicator tables share the same key
+STOCK_INDICATOR_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (symbol, datetime)'
+]
+
+INDICATOR_STATE_TABLE_NAME = 'indicator_state'
+INDICATOR_STATE_TABLE_SCHEMA = {
+    'symbol': 'VARCHAR(10)',
+    'last_datetime': 'TIMESTAMP WITH TIME ZONE',
+    'state': 'JSONB'
+}
+INDICATOR_STATE_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (symbol)'
+]
+
+INGESTION_STATE_TABLE_NAME = 'ingestion_state'
+INGESTION_STATE_TABLE_SCHEMA = {
+    'source': 'VARCHAR(50)',
+    'symbol': 'VARCHAR(100)',
+    'watermark': 'TIMESTAMP WITH TIME ZONE',
+    'updated_at': 'TIMESTAMP WITH TIME ZONE DEFAULT NOW()'
+}
+INGESTION_STATE_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (source, symbol)'
+]
+
+# Intervals the 1-minute intraday bars are rolled up to, mapped to their PostgreSQL interval
+INTRADAY_ROLLUP_INTERVALS = {
+    '5m': '5 minutes',
+    '15m': '15 minutes',
+    '1h': '1 hour',
+    '1d': '1 day'
+}
+INTRADAY_ROLLUP_TABLE_NAMES = {
+    interval: f'{INTRADAY_STOCK_DATA_TABLE_NAME}_{interval}' for interval in INTRADAY_ROLLUP_INTERVALS
+}
+INTRADAY_ROLLUP_TABLE_SCHEMA = {
+    'symbol': 'VARCHAR(10)',
+    'datetime': 'TIMESTAMP WITHOUT TIME ZONE',
+    'open': 'FLOAT',
+    'high': 'FLOAT',
+    'low': 'FLOAT',
+    'close': 'FLOAT',
+    'volume': 'BIGINT',
+    'bar_count': 'INTEGER'
+}
+INTRADAY_ROLLUP_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (symbol, datetime)'
+]
+
+STOCK_RISK_STATISTICS_TABLE_NAME = 'stock_risk_statistics'
+STOCK_RISK_STATISTICS_TABLE_SCHEMA = {
+    'symbol': 'VARCHAR(10)',
+    'datetime': 'DATE',
+    'window_days': 'INTEGER',
+    'volatility': 'FLOAT',
+    'beta': 'FLOAT',
+    'benchmark_correlation': 'FLOAT'
+}
+STOCK_RISK_STATISTICS_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (symbol, datetime, window_days)'
+]
+
+STOCK_CORRELATIONS_TABLE_NAME = 'stock_correlations'
+STOCK_CORRELATIONS_TABLE_SCHEMA = {
+    'as_of': 'DATE',
+    'window_days': 'INTEGER',
+    'symbol_a': 'VARCHAR(10)',
+    'symbol_b': 'VARCHAR(10)',
+    'correlation': 'FLOAT',
+    'covariance': 'FLOAT'
+}
+STOCK_CORRELATIONS_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (as_of, window_days, symbol_a, symbol_b)'
+]
+
+NEWS_SENTIMENT_TABLE_NAME = 'financial_news_sentiment'
+NEWS_SENTIMENT_TABLE_SCHEMA = {
+    'url': 'TEXT',
+    'content_hash': 'CHAR(32)',
+    'polarity': 'FLOAT',
+    'subjectivity': 'FLOAT',
+    'scored_at': 'TIMESTAMP WITH TIME ZONE DEFAULT NOW()'
+}
+NEWS_SENTIMENT_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (url)'
+]
+
+SENTIMENT_CACHE_TABLE_NAME = 'sentiment_score_cache'
+SENTIMENT_CACHE_TABLE_SCHEMA = {
+    'content_hash': 'CHAR(32)',
+    'polarity': 'FLOAT',
+    'subjectivity': 'FLOAT'
+}
+SENTIMENT_CACHE_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (content_hash)'
+]
+
+# An article is the representative of the cluster it founded; representative is NULL for articles
+# clustered before the column existed
+NEWS_CLUSTERS_TABLE_NAME = 'financial_news_clusters'
+NEWS_CLUSTERS_TABLE_SCHEMA = {
+    'url': 'TEXT',
+    'cluster_id': 'BIGINT',
+    'assigned_at': 'TIMESTAMP WITH TIME ZONE DEFAULT NOW()',
+    'representative': 'BOOLEAN'
+}
+NEWS_CLUSTERS_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (url)'
+]
+
+NEWS_CLUSTER_SIGNATURES_TABLE_NAME = 'financial_news_cluster_signatures'
+NEWS_CLUSTER_SIGNATURES_TABLE_SCHEMA = {
+    'cluster_id': 'BIGINT',
+    'signature': 'BYTEA'
+}
+NEWS_CLUSTER_SIGNATURES_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (cluster_id)'
+]
+
+NEWS_LSH_BUCKETS_TABLE_NAME = 'financial_news_lsh_buckets'
+NEWS_LSH_BUCKETS_TABLE_SCHEMA = {
+    'band': 'SMALLINT',
+    'bucket': 'BIGINT',
+    'cluster_id': 'BIGINT'
+}
+NEWS_LSH_BUCKETS_TABLE_CONSTRAINTS = [
+    'PRIMARY KEY (band, bucket)'
+]
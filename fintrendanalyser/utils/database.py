@@ -1,31 +1,345 @@
-from dotenv import load_dotenv
-from utils.logging import setup_logger
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import PoolError
+from utils.environment import get_setting, load_environment
+from utils.logging import SampledLogger, get_metrics, setup_logger
+import atexit
+import collections
+import contextlib
+import datetime
+import io
+import itertools
 import os
 import psycopg2
+import psycopg2.errors
+import sys
+import threading
+import time
+import uuid
 
 
-# Load environment variables from .env file
-load_dotenv()
+logger = setup_logger(name='database_management')
+
+# Per-row and per-batch lines are sampled: a few per table every interval, the rest are only counted
+sampled_logger = SampledLogger(logger, interval=10.0, burst=5)
+
+metrics = get_metrics()
+
+# Number of rows sent through COPY and merged per transaction by bulk_insert_data
+DEFAULT_BULK_BATCH_SIZE = 10000
+
+# NULL marker used in the COPY stream, so that empty strings stay empty strings
+COPY_NULL_MARKER = '\\N'
+
+# Rows fetched per round-trip by the streaming readers, overridable with DB_STREAM_BATCH_SIZE
+DEFAULT_STREAM_BATCH_SIZE = 10000
 
-# PostgreSQL connection parameters
-db_params = {
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT'),
-    'database': os.getenv('DB_NAME'),
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
+# pandas dtype of each PostgreSQL type OID returned by the streaming readers; other types stay object columns
+STREAM_DTYPES = {
+    16: 'boolean',              # bool
+    20: 'Int64',                # int8
+    21: 'Int64',                # int2
+    23: 'Int64',                # int4
+    700: 'float64',             # float4
+    701: 'float64',             # float8
+    1700: 'float64',            # numeric
+    1082: 'datetime64[ns]',     # date
+    1114: 'datetime64[ns]',     # timestamp
+    1184: 'datetime64[ns, UTC]',  # timestamptz
 }
 
-logger = setup_logger(name='database_management')
+# Idle connections older than this many seconds are pinged before being handed out
+DB_POOL_HEALTH_CHECK_INTERVAL = 60.0
+
+# Tables created by create_table_with_schema in this process, per database
+_created_tables = set()
+_created_tables_lock = threading.Lock()
+
+# Partitions known to exist in this process, and partitioning configured on tables that predate it
+_created_partitions = set()
+_unpartitioned_tables = set()
+
+def get_db_params():
+    """
+    Return the PostgreSQL connection parameters, read from the environment (and .env) on first use.
+
+    Returns:
+        dict: psycopg2.connect keyword arguments.
+    """
+    load_environment()
+    return {
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT'),
+        'database': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+    }
+
 
 def get_db_connection():
     try:
-        conn = psycopg2.connect(**db_params)
+        conn = psycopg2.connect(**get_db_params())
         logger.info('Successfully connected to the database.')
         return conn
     except Exception as e:
         logger.error('Database connection failed: ', exc_info=e)
-        exit()
+        raise
+
+
+class ConnectionPool:
+    """
+    Thread-safe, bounded pool of PostgreSQL connections.
+
+    Connections are opened lazily up to max_size. When all of them are checked out,
+    callers wait up to timeout seconds for one to be returned before a PoolError is raised.
+    Idle connections are health-checked before reuse and replaced when broken.
+    """
+
+    def __init__(
+            self,
+            min_size=None,
+            max_size=None,
+            timeout=None,
+            connection_params=None
+            ):
+        """
+        Parameters:
+            min_size (int, optional): Number of connections opened up front, defaults to DB_POOL_MIN_SIZE or 1.
+            max_size (int, optional): Maximum number of open connections, defaults to DB_POOL_MAX_SIZE or 10.
+            timeout (float, optional): Seconds to wait for a free connection before giving up,
+                defaults to DB_POOL_TIMEOUT or 30.
+            connection_params (dict, optional): psycopg2.connect keyword arguments, defaults to get_db_params().
+        """
+        load_environment()
+        min_size = int(os.getenv('DB_POOL_MIN_SIZE', '1')) if min_size is None else min_size
+        max_size = int(os.getenv('DB_POOL_MAX_SIZE', '10')) if max_size is None else max_size
+        timeout = float(os.getenv('DB_POOL_TIMEOUT', '30')) if timeout is None else timeout
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(f'Invalid pool size: min_size={min_size}, max_size={max_size}.')
+
+        self.max_size = max_size
+        self.timeout = timeout
+        self._connection_params = connection_params or get_db_params()
+        self._condition = threading.Condition()
+        self._idle = collections.deque()
+        self._last_used = {}
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+
+        # Metrics
+        self._peak_in_use = 0
+        self._checkouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._health_check_failures = 0
+
+        for _ in range(min_size):
+            connection = self._connect()
+            with self._condition:
+                self._size += 1
+                self._idle.append(connection)
+                self._last_used[id(connection)] = time.monotonic()
+
+    def _connect(self):
+        return psycopg2.connect(**self._connection_params)
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        idle_for = time.monotonic() - self._last_used.get(id(connection), 0.0)
+        if idle_for < DB_POOL_HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, connection):
+        self._last_used.pop(id(connection), None)
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """
+        Check a connection out of the pool, opening a new one if the pool is not yet full.
+
+        Returns:
+            connection: A psycopg2 connection that must be returned with putconn().
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        connection = None
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolError('Connection pool is closed.')
+                if self._idle:
+                    connection = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolError(f'Timed out after {self.timeout}s waiting for a database connection.')
+                self._condition.wait(remaining)
+
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+
+        try:
+            if connection is not None and not self._is_healthy(connection):
+                with self._condition:
+                    self._health_check_failures += 1
+                logger.warning('Discarding unhealthy pooled database connection.')
+                self._discard(connection)
+                connection = None
+            if connection is None:
+                connection = self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+        return connection
+
+    def putconn(self, connection, discard=False):
+        """
+        Return a connection to the pool. Open transactions are rolled back and broken
+        connections are closed instead of being reused.
+
+        Parameters:
+            connection: A connection previously obtained with getconn().
+            discard (bool): Close the connection instead of returning it to the pool.
+        """
+        if not discard and not connection.closed:
+            status = connection.get_transaction_status()
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        with self._condition:
+            self._in_use -= 1
+            if discard or connection.closed or self._closed:
+                self._size -= 1
+                self._discard(connection)
+            else:
+                self._last_used[id(connection)] = time.monotonic()
+                self._idle.append(connection)
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Context manager checking out a connection, committing on success and rolling back on error.
+
+        Yields:
+            connection: A psycopg2 connection usable with the helpers of this module.
+        """
+        connection = self.getconn()
+        discard = False
+        try:
+            yield connection
+            connection.commit()
+        except Exception:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                discard = True
+            raise
+        finally:
+            self.putconn(connection, discard=discard)
+
+    def stats(self):
+        """
+        Return pool sizing and wait-time metrics.
+
+        Returns:
+            dict: Current size and utilisation, checkout counts and wait times in seconds.
+        """
+        with self._condition:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'max_size': self.max_size,
+                'utilisation': self._in_use / self.max_size,
+                'peak_in_use': self._peak_in_use,
+                'checkouts': self._checkouts,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_avg': self._wait_time_total / self._checkouts if self._checkouts else 0.0,
+                'wait_time_max': self._wait_time_max,
+                'timeouts': self._timeouts,
+                'health_check_failures': self._health_check_failures,
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"Connection pool: {stats['in_use']}/{stats['max_size']} in use (peak {stats['peak_in_use']}), "
+            f"{stats['checkouts']} checkouts, avg wait {stats['wait_time_avg'] * 1000:.1f} ms, "
+            f"max wait {stats['wait_time_max'] * 1000:.1f} ms, {stats['timeouts']} timeouts."
+        )
+
+    def close_all(self):
+        """
+        Close every idle connection and refuse further checkouts. Checked-out connections
+        are closed when they are returned.
+        """
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                self._size -= 1
+                self._discard(self._idle.pop())
+            self._condition.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """
+    Return the process-wide connection pool, creating it on first use.
+
+    Returns:
+        ConnectionPool: The shared pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._closed:
+            _pool = ConnectionPool()
+            atexit.register(_pool.close_all)
+            logger.info(f'Created database connection pool (max size {_pool.max_size}).')
+        return _pool
+
+
+def db_session():
+    """
+    Check out a connection from the shared pool as a committing/rolling-back context manager.
+
+    Example:
+        with db_session() as conn:
+            execute_select(conn, 'SELECT 1')
+    """
+    return get_db_pool().session()
 
 
 def create_table_with_schema(
@@ -33,32 +347,249 @@ def create_table_with_schema(
         db_schema,
         db_table_name,
         db_table_schema_definition,
-        constraints=None
+        constraints=None,
+        partitioning=None,
+        indexes=None
         ):
     """
     Create a table within a specific schema with the given schema definition
     and optional constraints, if it does not exist.
 
+    The DDL only runs the first time a table is seen by the process; later calls return at once.
+
     Parameters:
-        connection: Connection to the database.
+        connection: Connection to the database, e.g. a pooled session from db_session().
         db_schema (str): Name of the schema where the table will be created.
         db_table_name (str): Name of the table to create.
         schema_definition (dict): Dictionary where keys are column names and values are data types.
         constraints (list of str, optional): List of SQL constraint definitions.
+        partitioning (dict, optional): Range partitioning by time, with the partition "column", the
+            partition "interval" ("month" or "year") and the number of future partitions to "premake".
+            A default partition catches rows outside the created partitions.
+        indexes (dict, optional): Index name suffix mapped to its definition, e.g. 'USING BRIN (datetime)'.
     """
     column_defs = ', '.join([f'{col} {col_type}' for col, col_type in db_table_schema_definition.items()])
     constraint_defs = ', '.join(constraints) if constraints else ''
     table_definition = f"{column_defs}, {constraint_defs}" if constraints else column_defs
     full_table_name = f"{db_schema}.{db_table_name}"
-    sql = f'CREATE SCHEMA IF NOT EXISTS {db_schema}; CREATE TABLE IF NOT EXISTS {full_table_name} ({table_definition});'
+    table_key = (connection.dsn, full_table_name)
+    with _created_tables_lock:
+        if table_key in _created_tables:
+            return
+
+    partition_clause = f' PARTITION BY RANGE ({partitioning["column"]})' if partitioning else ''
+    sql = (
+        f'CREATE SCHEMA IF NOT EXISTS {db_schema}; '
+        f'CREATE TABLE IF NOT EXISTS {full_table_name} ({table_definition}){partition_clause};'
+    )
+    for suffix, definition in (indexes or {}).items():
+        sql += f' CREATE INDEX IF NOT EXISTS {db_table_name}_{suffix} ON {full_table_name} {definition};'
 
     try:
         with connection.cursor() as cursor:
             cursor.execute(sql)
+            if partitioning:
+                # A table created before partitioning was configured stays a plain table
+                cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', (full_table_name,))
+                partitioned = cursor.fetchone() is not None
+                if partitioned:
+                    cursor.execute(
+                        f'CREATE TABLE IF NOT EXISTS {full_table_name}_default PARTITION OF {full_table_name} DEFAULT'
+                    )
         connection.commit()
+        with _created_tables_lock:
+            _created_tables.add(table_key)
         logger.info(f'Table "{full_table_name}" created or already exists.')
     except Exception as e:
         logger.error(f'Failed to create table "{full_table_name}": ', exc_info=e)
+        return
+
+    if partitioning:
+        if not partitioned:
+            with _created_tables_lock:
+                _unpartitioned_tables.add(table_key)
+            logger.warning(
+                f'Table "{full_table_name}" already exists without partitioning; '
+                f'run data_processing.maintain_partitions --migrate to convert it.'
+            )
+            return
+        ensure_future_partitions(connection, db_schema, db_table_name, partitioning)
+
+
+def _as_date(moment):
+    if isinstance(moment, datetime.datetime):
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(datetime.timezone.utc)
+        return moment.date()
+    return moment
+
+
+def _period_start(day, interval):
+    if interval == 'year':
+        return datetime.date(day.year, 1, 1)
+    if interval == 'month':
+        return datetime.date(day.year, day.month, 1)
+    raise ValueError(f'Unsupported partition interval "{interval}".')
+
+
+def shift_period(day, interval, periods):
+    """
+    Return the first day of the partition interval a number of periods after (or before) the one of a day.
+    """
+    start = _period_start(day, interval)
+    if interval == 'year':
+        return start.replace(year=start.year + periods)
+    months = start.year * 12 + start.month - 1 + periods
+    return datetime.date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(db_table_name, interval, day):
+    """
+    Return the name of the partition of a table holding a day, e.g. intraday_stock_data_m2024_01.
+    """
+    start = _period_start(day, interval)
+    if interval == 'year':
+        return f'{db_table_name}_y{start.year}'
+    return f'{db_table_name}_m{start.year}_{start.month:02d}'
+
+
+def ensure_partitions(connection, db_schema, db_table_name, partitioning, start, end):
+    """
+    Create the missing partitions of a range-partitioned table between two days, both included.
+
+    Rows of a new partition's range already held by the default partition are moved into it before
+    it is attached. Partitions known to exist are remembered per process, so calling this before
+    every write costs no round-trip once the partitions exist. Tables created before partitioning
+    was configured are left alone.
+
+    Parameters:
+        connection: Connection to the database, e.g. a pooled session from db_session().
+        db_schema (str): Name of the schema of the table.
+        db_table_name (str): Name of the partitioned table.
+        partitioning (dict): Partitioning of the table, as given to create_table_with_schema.
+        start (date or datetime): First day to cover.
+        end (date or datetime): Last day to cover.
+
+    Returns:
+        int: Number of partitions created.
+    """
+    interval = partitioning['interval']
+    column = partitioning['column']
+    full_table_name = f'{db_schema}.{db_table_name}'
+    with _created_tables_lock:
+        if (connection.dsn, full_table_name) in _unpartitioned_tables:
+            return 0
+    period = _period_start(_as_date(start), interval)
+    last = _period_start(_as_date(end), interval)
+
+    created = 0
+    while period <= last:
+        next_period = shift_period(period, interval, 1)
+        name = partition_name(db_table_name, interval, period)
+        partition_key = (connection.dsn, f'{db_schema}.{name}')
+        with _created_tables_lock:
+            known = partition_key in _created_partitions
+        if not known:
+            # Bounds in UTC, which timestamp without time zone columns ignore
+            bounds = f"FROM ('{period} 00:00:00+00') TO ('{next_period} 00:00:00+00')"
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT to_regclass(%s)', (f'{db_schema}.{name}',))
+                    if cursor.fetchone()[0] is None:
+                        cursor.execute(
+                            f'CREATE TABLE {db_schema}.{name} (LIKE {full_table_name} INCLUDING DEFAULTS); '
+                            f'WITH moved AS ('
+                            f"DELETE FROM {full_table_name}_default WHERE {column} >= '{period} 00:00:00+00' "
+                            f"AND {column} < '{next_period} 00:00:00+00' RETURNING *"
+                            f') INSERT INTO {db_schema}.{name} SELECT * FROM moved; '
+                            f'ALTER TABLE {full_table_name} ATTACH PARTITION {db_schema}.{name} FOR VALUES {bounds};'
+                        )
+                        created += 1
+                connection.commit()
+            except psycopg2.errors.DuplicateTable:
+                # Created by a concurrent writer in the meantime
+                connection.rollback()
+            with _created_tables_lock:
+                _created_partitions.add(partition_key)
+        period = next_period
+
+    if created:
+        logger.info(f'Created {created} partitions of "{full_table_name}".')
+    return created
+
+
+def ensure_future_partitions(connection, db_schema, db_table_name, partitioning):
+    """
+    Create the partition of the current interval and the number of upcoming ones set by "premake".
+
+    Returns:
+        int: Number of partitions created.
+    """
+    today = datetime.date.today()
+    return ensure_partitions(
+        connection, db_schema, db_table_name, partitioning,
+        today, shift_period(today, partitioning['interval'], partitioning.get('premake', 0))
+    )
+
+
+def drop_partitions_before(connection, db_schema, db_table_name, partitioning, cutoff):
+    """
+    Drop the partitions of a range-partitioned table holding only rows older than a day.
+
+    Parameters:
+        connection: Connection to the database, e.g. a pooled session from db_session().
+        db_schema (str): Name of the schema of the table.
+        db_table_name (str): Name of the partitioned table.
+        partitioning (dict): Partitioning of the table, as given to create_table_with_schema.
+        cutoff (date): Partitions ending on or before this day are dropped.
+
+    Returns:
+        list: Names of the dropped partitions.
+    """
+    interval = partitioning['interval']
+    full_table_name = f'{db_schema}.{db_table_name}'
+    partitions = execute_select(
+        connection,
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = %s::regclass',
+        (full_table_name,)
+    )
+
+    dropped = []
+    for (name,) in partitions:
+        suffix = name[len(db_table_name) + 1:]
+        try:
+            if interval == 'year':
+                period = datetime.date(int(suffix[1:]), 1, 1)
+            else:
+                year, month = suffix[1:].split('_')
+                period = datetime.date(int(year), int(month), 1)
+        except ValueError:
+            # The default partition, or a partition not named by ensure_partitions
+            continue
+        if shift_period(period, interval, 1) <= cutoff:
+            dropped.append(name)
+
+    with connection.cursor() as cursor:
+        for name in dropped:
+            cursor.execute(f'DROP TABLE {db_schema}.{name}')
+    connection.commit()
+    with _created_tables_lock:
+        _created_partitions.difference_update((connection.dsn, f'{db_schema}.{name}') for name in dropped)
+    if dropped:
+        logger.info(f'Dropped {len(dropped)} partitions of "{full_table_name}" older than {cutoff}.')
+    return dropped
+
+
+def forget_created_tables():
+    """
+    Make create_table_with_schema run its DDL again, e.g. after tables were dropped.
+    """
+    with _created_tables_lock:
+        _created_tables.clear()
+        _created_partitions.clear()
+        _unpartitioned_tables.clear()
 
 
 def insert_data(
@@ -72,7 +603,7 @@ def insert_data(
     Insert data into a table within a specific schema, with an optional conflict handling.
 
     Parameters:
-        connection: The database connection object.
+        connection: The database connection object, e.g. a pooled session from db_session().
         db_schema (str): Name of the schema where the table resides.
         db_table_name (str): The name of the table where data will be inserted.
         table_columns (list): The list of column names for the insert.
@@ -91,30 +622,238 @@ def insert_data(
         with connection.cursor() as cursor:
             cursor.execute(sql, table_data)
             if cursor.rowcount > 0:
-                # Only log if the row was actually inserted
-                key_value_info = ", ".join([f"{col}={val}" for col, val in zip(table_columns, table_data)])
-                logger.info(f'Data inserted into "{full_table_name}": {key_value_info}.')
+                # Only log if the row was actually inserted, and only a sample of the rows
+                metrics.counter(f'db.rows_inserted.{db_table_name}').inc()
+                sampled_logger.info(
+                    full_table_name, 'Data inserted into "%s": %s.', full_table_name, dict(zip(table_columns, table_data))
+                )
             else:
-                # Optionally log when data was not inserted due to conflict, or omit this part to reduce log noise
-                # logger.info(f'No new data to insert for "{full_table_name}". Data might already exist or conflict.')
-                pass
+                metrics.counter(f'db.rows_skipped.{db_table_name}').inc()
         connection.commit()
     except Exception as e:
         logger.error(f'Failed to insert data into "{full_table_name}": ', exc_info=e)
 
 
+def _format_copy_value(value):
+    """
+    Convert a Python value into its COPY CSV field, mapping None, NaN, NaT and pd.NA to NULL.
+
+    Strings are always quoted, with their quotes doubled: a quoted field never matches the NULL
+    marker, so a literal "\\N" string is loaded as such.
+    """
+    if value is None:
+        return COPY_NULL_MARKER
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    # pd.NA cannot be compared, and rows only hold it once pandas is imported
+    pandas = sys.modules.get('pandas')
+    if pandas is not None:
+        if pandas.api.types.is_scalar(value) and pandas.isna(value):
+            return COPY_NULL_MARKER
+    elif value != value:
+        return COPY_NULL_MARKER
+    return str(value)
+
+
+def _iter_table_rows(table_data):
+    """
+    Yield plain tuples from either a pandas DataFrame or an iterable of tuples.
+    """
+    if hasattr(table_data, 'itertuples'):
+        return table_data.itertuples(index=False, name=None)
+    return iter(table_data)
+
+
+def bulk_insert_data(
+        connection,
+        db_schema,
+        db_table_name,
+        table_columns,
+        table_data,
+        on_conflict_action=None,
+        batch_size=DEFAULT_BULK_BATCH_SIZE,
+        post_merge_statements=None):
+    """
+    Bulk insert data into a table within a specific schema, with an optional conflict handling.
+
+    Rows are streamed with COPY into a temporary staging table and then merged into the target
+    table with a single INSERT ... SELECT, so each batch costs one transaction instead of one per row.
+    A failing batch is rolled back and its error raised; the batches merged before it stay committed.
+
+    Parameters:
+        connection: The database connection object, e.g. a pooled session from db_session().
+        db_schema (str): Name of the schema where the table resides.
+        db_table_name (str): The name of the table where data will be inserted.
+        table_columns (list): The list of column names for the insert.
+        table_data (DataFrame or iterable of tuples): The rows to insert, in the order of table_columns.
+        on_conflict_action (str, optional): SQL clause for conflict handling, e.g., 'ON CONFLICT (column) DO NOTHING'.
+        batch_size (int): Number of rows merged per transaction.
+        post_merge_statements (list of tuple, optional): (sql, params) pairs run after each merge in the
+            same transaction; "{staging_table}" in the SQL is replaced with the staging table name.
+
+    Returns:
+        tuple: Number of rows inserted and number of rows skipped by the conflict clause.
+    """
+    column_names = ', '.join(table_columns)
+    full_table_name = f'{db_schema}.{db_table_name}'
+    staging_table_name = f'staging_{db_table_name}'
+    create_staging_sql = (
+        f'CREATE TEMP TABLE {staging_table_name} (LIKE {full_table_name} INCLUDING DEFAULTS) ON COMMIT DROP'
+    )
+    copy_sql = f"COPY {staging_table_name} ({column_names}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL_MARKER}')"
+    merge_sql = f'INSERT INTO {full_table_name} ({column_names}) SELECT {column_names} FROM {staging_table_name}'
+
+    if on_conflict_action:
+        merge_sql += f' {on_conflict_action}'
+
+    total_inserted = 0
+    total_skipped = 0
+    rows = _iter_table_rows(table_data)
+
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+
+        buffer = io.StringIO()
+        for row in batch:
+            buffer.write(','.join(_format_copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        try:
+            with metrics.timer('db.bulk_insert_batch_seconds'), connection.cursor() as cursor:
+                cursor.execute(create_staging_sql)
+                cursor.copy_expert(copy_sql, buffer)
+                cursor.execute(merge_sql)
+                inserted = max(cursor.rowcount, 0)
+                for statement, params in post_merge_statements or []:
+                    cursor.execute(statement.format(staging_table=staging_table_name), params)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            logger.error(
+                f'Failed to bulk insert a batch of {len(batch)} rows into "{full_table_name}" '
+                f'after {total_inserted} inserted rows.'
+            )
+            raise
+
+        total_inserted += inserted
+        total_skipped += len(batch) - inserted
+        metrics.counter(f'db.rows_inserted.{db_table_name}').inc(inserted)
+        metrics.counter(f'db.rows_skipped.{db_table_name}').inc(len(batch) - inserted)
+        sampled_logger.debug(
+            full_table_name, 'Merged a batch of %d rows into "%s" (%d inserted).', len(batch), full_table_name, inserted
+        )
+
+    logger.info(f'Bulk inserted {total_inserted} rows into "{full_table_name}" ({total_skipped} skipped).')
+    return total_inserted, total_skipped
+
+
 def execute_select(connection, query, params=()):
     """
     Execute a SELECT statement and return the fetched results.
 
     Parameters:
-        connection: The database connection object.
+        connection: The database connection object, e.g. a pooled session from db_session().
         query (str): The SQL query to execute.
         params (tuple): Parameters for the SQL query.
 
     Returns:
         list: The fetched results.
     """
-    with connection.cursor() as cursor:
+    with metrics.timer('db.select_seconds'), connection.cursor() as cursor:
         cursor.execute(query, params)
         return cursor.fetchall()
+
+
+def stream_select(connection, query, params=(), batch_size=None, cursor_name=None):
+    """
+    Execute a SELECT statement on a server-side cursor and yield the results in batches.
+
+    Only one batch is held in memory at a time, so tables larger than RAM can be scanned. The
+    cursor lives in the current transaction: do not commit the connection before the iteration
+    ends, and write through another connection.
+
+    Parameters:
+        connection: The database connection object, e.g. a pooled session from db_session().
+        query (str): The SQL query to execute.
+        params (tuple or dict): Parameters for the SQL query.
+        batch_size (int, optional): Rows fetched per round-trip and yielded per batch, defaults to DB_STREAM_BATCH_SIZE.
+        cursor_name (str, optional): Name of the server-side cursor, generated when omitted.
+
+    Yields:
+        list: The next batch of rows.
+    """
+    for rows, _ in _stream_batches(connection, query, params, batch_size, cursor_name):
+        yield rows
+
+
+def _stream_batches(connection, query, params, batch_size, cursor_name=None):
+    if batch_size is None:
+        batch_size = get_setting('DB_STREAM_BATCH_SIZE', DEFAULT_STREAM_BATCH_SIZE, int)
+    with connection.cursor(name=cursor_name or f'stream_{uuid.uuid4().hex}') as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+        while True:
+            with metrics.timer('db.stream_fetch_seconds'):
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            metrics.counter('db.rows_streamed').inc(len(rows))
+            yield rows, cursor.description
+
+
+def _rows_to_frame(rows, description, dtypes):
+    import pandas as pd
+
+    columns = [column.name for column in description]
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    for column in description:
+        dtype = dtypes.get(column.name) or STREAM_DTYPES.get(column.type_code)
+        if dtype is None:
+            continue
+        if dtype.startswith('datetime64'):
+            frame[column.name] = pd.to_datetime(frame[column.name], utc=dtype.endswith('UTC]'))
+        elif dtype == 'float64':
+            frame[column.name] = pd.to_numeric(frame[column.name], errors='coerce').astype(dtype)
+        else:
+            frame[column.name] = frame[column.name].astype(dtype)
+            # Nullable integers without missing values are handed out as plain NumPy integers
+            if dtype == 'Int64' and not frame[column.name].hasnans:
+                frame[column.name] = frame[column.name].astype('int64')
+    return frame
+
+
+def stream_select_frames(
+        connection,
+        query,
+        params=(),
+        batch_size=None,
+        dtypes=None,
+        as_arrays=False
+        ):
+    """
+    Execute a SELECT statement on a server-side cursor and yield the results as typed chunks.
+
+    Column dtypes follow the PostgreSQL column types (see STREAM_DTYPES), so numeric and time
+    columns come out as NumPy-backed columns rather than object columns of Python values.
+
+    Parameters:
+        connection: The database connection object.
+        query (str): The SQL query to execute.
+        params (tuple or dict): Parameters for the SQL query.
+        batch_size (int, optional): Rows per chunk, defaults to DB_STREAM_BATCH_SIZE.
+        dtypes (dict, optional): Column name mapped to a pandas dtype, overriding the inferred one.
+        as_arrays (bool): Yield a dict of column name to NumPy array instead of a DataFrame.
+
+    Yields:
+        DataFrame or dict: The next chunk of rows.
+    """
+    dtypes = dtypes or {}
+    for rows, description in _stream_batches(connection, query, params, batch_size):
+        frame = _rows_to_frame(rows, description, dtypes)
+        if as_arrays:
+            yield {column: frame[column].to_numpy() for column in frame.columns}
+        else:
+            yield frame
@@ -0,0 +1,56 @@
+import os
+import threading
+
+
+_loaded = False
+_lock = threading.Lock()
+
+# Values of a boolean setting that turn it on
+TRUE_VALUES = ('1', 'true', 'yes')
+
+def load_environment():
+    """
+    Load the variables of the .env file into the process environment, once per process.
+
+    Modules call this when they first need a setting rather than at import time, so importing
+    them has no side effects. Variables already set in the environment take precedence.
+    """
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        from dotenv import load_dotenv
+        load_dotenv()
+        _loaded = True
+
+
+def get_setting(name, default=None, parse=str):
+    """
+    Read a setting from the environment, after loading the .env file.
+
+    Settings are read when they are needed rather than into module constants at import time,
+    so values from the .env file are not missed.
+
+    Parameters:
+        name (str): Name of the environment variable.
+        default: Value returned when the variable is unset or empty.
+        parse (callable): Conversion of the raw string, e.g. int.
+
+    Returns:
+        The parsed value, or default.
+    """
+    load_environment()
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    return parse(value)
+
+
+def get_flag(name, default=False):
+    """
+    Read a boolean setting from the environment, after loading the .env file.
+
+    Returns:
+        bool: Whether the variable is one of TRUE_VALUES, or default when it is unset or empty.
+    """
+    return get_setting(name, default, parse=lambda value: value.lower() in TRUE_VALUES)
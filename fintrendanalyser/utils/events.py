@@ -0,0 +1,158 @@
+"""
+In-process publish/subscribe of data events, such as new intraday bars written by the polling
+daemon, so that downstream stages react to new data instead of running on a fixed schedule.
+
+Handlers run on a single dispatcher thread in publish order, so a slow handler delays the
+following events but never the publisher.
+
+Changes to the stored data are also announced across processes with PostgreSQL NOTIFY, on
+DATA_CHANGED_CHANNEL: writers add change_notification_statement to their transaction, and
+readers caching query results LISTEN to the channel.
+"""
+from utils.environment import get_setting
+from utils.logging import get_metrics, setup_logger
+import queue
+import threading
+
+
+logger = setup_logger(name='events')
+
+# Events waiting for the dispatcher before new ones are dropped, overridable with EVENT_QUEUE_SIZE
+DEFAULT_EVENT_QUEUE_SIZE = 10000
+
+# Published when the intraday polling daemon stores new 1-minute bars of a symbol
+INTRADAY_BARS_TOPIC = 'intraday_bars'
+
+# PostgreSQL channel on which writers announce the series they changed, as "<schema>.<table>:<symbol>"
+DATA_CHANGED_CHANNEL = 'fta_data_changed'
+
+_STOP = object()
+
+
+def change_notification_statement(table_fullname, source_table='{staging_table}', key_column='symbol'):
+    """
+    Build the statement notifying DATA_CHANGED_CHANNEL of every symbol of a write.
+
+    Notifications are only delivered when the transaction commits, and identical ones are sent once,
+    so pass the result in the post_merge_statements of bulk_insert_data.
+
+    Parameters:
+        table_fullname (str): Schema-qualified name of the written table.
+        source_table (str): Table holding the written rows, by default the bulk_insert_data staging table.
+        key_column (str): Column identifying a series in the written rows.
+
+    Returns:
+        tuple: SQL statement and its parameters.
+    """
+    sql = (
+        f"SELECT pg_notify(%s, %s || ':' || {key_column}) "
+        f"FROM (SELECT DISTINCT {key_column} FROM {source_table}) changed"
+    )
+    return sql, (DATA_CHANGED_CHANNEL, table_fullname)
+
+
+class EventBus:
+    """
+    Topics mapped to their subscribed handlers, with a bounded queue of pending events.
+
+    An event is a dict; handlers take it as their only argument. Exceptions raised by a handler
+    are logged and do not reach the other handlers nor the publisher.
+    """
+
+    def __init__(self, queue_size=None):
+        """
+        Parameters:
+            queue_size (int, optional): Maximum number of events waiting for the dispatcher, defaults to EVENT_QUEUE_SIZE.
+        """
+        if queue_size is None:
+            queue_size = get_setting('EVENT_QUEUE_SIZE', DEFAULT_EVENT_QUEUE_SIZE, int)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._dispatcher = None
+
+    def subscribe(self, topic, handler):
+        """
+        Call handler with every event published to topic from now on.
+
+        Parameters:
+            topic (str): Topic name, e.g. INTRADAY_BARS_TOPIC.
+            handler (callable): Function taking the event dict.
+
+        Returns:
+            callable: Function removing the subscription.
+        """
+        with self._lock:
+            self._handlers[topic] = self._handlers.get(topic, ()) + (handler,)
+
+        def unsubscribe():
+            with self._lock:
+                self._handlers[topic] = tuple(h for h in self._handlers.get(topic, ()) if h is not handler)
+
+        return unsubscribe
+
+    def publish(self, topic, event):
+        """
+        Queue an event for the handlers of its topic, without waiting for them.
+
+        Returns:
+            bool: Whether the event was queued; it is dropped when nobody subscribed or the queue is full.
+        """
+        if not self._handlers.get(topic):
+            return False
+        self._start()
+        try:
+            self._queue.put_nowait((topic, event))
+        except queue.Full:
+            get_metrics().counter(f'events.{topic}.dropped').inc()
+            logger.warning(f'Dropped a "{topic}" event: {self._queue.maxsize} events are waiting for their handlers.')
+            return False
+        get_metrics().counter(f'events.{topic}.published').inc()
+        return True
+
+    def _start(self):
+        if self._dispatcher is not None:
+            return
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name='event-dispatcher', daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            topic, event = item
+            for handler in self._handlers.get(topic, ()):
+                try:
+                    handler(event)
+                except Exception as e:
+                    logger.error(f'Handler {getattr(handler, "__name__", handler)} of "{topic}" failed: {e}')
+
+    def close(self):
+        """
+        Deliver the queued events and stop the dispatcher.
+        """
+        with self._lock:
+            dispatcher, self._dispatcher = self._dispatcher, None
+        if dispatcher is not None:
+            self._queue.put(_STOP)
+            dispatcher.join()
+
+
+_event_bus = None
+_event_bus_lock = threading.Lock()
+
+def get_event_bus():
+    """
+    Return the process-wide event bus, creating it on first use.
+
+    Returns:
+        EventBus: The shared bus.
+    """
+    global _event_bus
+    with _event_bus_lock:
+        if _event_bus is None:
+            _event_bus = EventBus()
+        return _event_bus
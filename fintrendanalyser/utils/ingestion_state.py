@@ -0,0 +1,245 @@
+from utils.constants import (
+    DB_RAW_DATA_SCHEMA,
+    INGESTION_STATE_TABLE_NAME,
+    INGESTION_STATE_TABLE_SCHEMA,
+    INGESTION_STATE_TABLE_CONSTRAINTS
+)
+from utils.database import create_table_with_schema, execute_select
+from utils.logging import setup_logger
+
+
+logger = setup_logger(name='ingestion_state')
+
+INGESTION_STATE_TABLE_FULLNAME = f'{DB_RAW_DATA_SCHEMA}.{INGESTION_STATE_TABLE_NAME}'
+
+def create_ingestion_state_table(connection):
+    create_table_with_schema(
+        connection=connection,
+        db_schema=DB_RAW_DATA_SCHEMA,
+        db_table_name=INGESTION_STATE_TABLE_NAME,
+        db_table_schema_definition=INGESTION_STATE_TABLE_SCHEMA,
+        constraints=INGESTION_STATE_TABLE_CONSTRAINTS
+    )
+
+
+def load_watermarks(connection, source, data_table_fullname, key_column='symbol', time_column='datetime'):
+    """
+    Return the latest ingested timestamp of every key of a source in a single round-trip.
+
+    The first time a source is used, its state is seeded from the data table with one grouped
+    query, so existing deployments do not need a backfill of the state table.
+
+    Parameters:
+        connection: The database connection object.
+        source (str): Name of the ingestion source, e.g. the data table name.
+        data_table_fullname (str): Schema-qualified table the source writes to.
+        key_column (str): Column identifying a series in the data table.
+        time_column (str): Timestamp column of the data table.
+
+    Returns:
+        dict: Key mapped to its latest ingested timestamp; keys never ingested are absent.
+    """
+    rows = execute_select(
+        connection,
+        f'SELECT symbol, watermark FROM {INGESTION_STATE_TABLE_FULLNAME} WHERE source = %s',
+        (source,)
+    )
+    if not rows:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {INGESTION_STATE_TABLE_FULLNAME} (source, symbol, watermark, updated_at) '
+                f'SELECT %s, {key_column}, MAX({time_column}), NOW() FROM {data_table_fullname} '
+                f'GROUP BY {key_column} ON CONFLICT (source, symbol) DO NOTHING '
+                f'RETURNING symbol, watermark',
+                (source,)
+            )
+            rows = cursor.fetchall()
+        connection.commit()
+        if rows:
+            logger.info(f'Seeded ingestion state of "{source}" with {len(rows)} watermarks.')
+    return dict(rows)
+
+
+def watermark_update_statement(source, key_column='symbol', time_column='datetime', skip_backfills=False):
+    """
+    Build the statement advancing the watermarks of a source from a bulk_insert_data staging table.
+
+    Pass the result in post_merge_statements, so that the state moves in the same transaction as the data.
+
+    Parameters:
+        source (str): Name of the ingestion source.
+        key_column (str): Column identifying a series in the staged rows.
+        time_column (str): Timestamp column of the staged rows.
+        skip_backfills (bool): Leave the watermarks of keys with a backfill in progress unchanged.
+
+    Returns:
+        tuple: SQL statement and its parameters.
+    """
+    params = (source,)
+    where = ''
+    if skip_backfills:
+        where = (
+            f'WHERE {key_column} NOT IN '
+            f'(SELECT symbol FROM {INGESTION_STATE_TABLE_FULLNAME} WHERE source = %s) '
+        )
+        params += (backfill_source(source),)
+    sql = (
+        f'INSERT INTO {INGESTION_STATE_TABLE_FULLNAME} AS state (source, symbol, watermark, updated_at) '
+        f'SELECT %s, {key_column}, MAX({time_column}), NOW() FROM {{staging_table}} {where}GROUP BY {key_column} '
+        f'ON CONFLICT (source, symbol) DO UPDATE SET '
+        f'watermark = GREATEST(state.watermark, EXCLUDED.watermark), updated_at = EXCLUDED.updated_at'
+    )
+    return sql, params
+
+
+def backfill_source(source):
+    """
+    Return the name under which the progress of the backfills of a source is stored.
+    """
+    return f'{source}:backfill'
+
+
+def load_backfill_cursors(connection, source):
+    """
+    Return the keys of a source whose backfill is in progress, mapped to the oldest time reached so far.
+
+    A backfill walking back in time only moves the watermark of its key once it is complete, so an
+    interrupted one is resumed from its cursor instead of being taken for an up-to-date series.
+
+    Parameters:
+        connection: The database connection object.
+        source (str): Name of the ingestion source.
+
+    Returns:
+        dict: Key mapped to the start of the oldest range written so far.
+    """
+    rows = execute_select(
+        connection,
+        f'SELECT symbol, watermark FROM {INGESTION_STATE_TABLE_FULLNAME} WHERE source = %s',
+        (backfill_source(source),)
+    )
+    return dict(rows)
+
+
+def backfill_cursor_statement(source, key, cursor):
+    """
+    Build the statement recording the oldest time a backfill of a key has written so far.
+
+    Returns:
+        tuple: SQL statement and its parameters.
+    """
+    sql = (
+        f'INSERT INTO {INGESTION_STATE_TABLE_FULLNAME} (source, symbol, watermark, updated_at) '
+        f'VALUES (%s, %s, %s, NOW()) ON CONFLICT (source, symbol) DO UPDATE SET '
+        f'watermark = EXCLUDED.watermark, updated_at = EXCLUDED.updated_at'
+    )
+    return sql, (backfill_source(source), key, cursor)
+
+
+def backfill_completion_statements(source, keys, data_table_fullname, key_column='symbol', time_column='datetime'):
+    """
+    Build the statements closing the backfills of keys: their watermarks are set from the data
+    table and their cursors are dropped.
+
+    Parameters:
+        source (str): Name of the ingestion source.
+        keys (iterable): Keys whose backfill is complete.
+        data_table_fullname (str): Schema-qualified table the source writes to.
+        key_column (str): Column identifying a series in the data table.
+        time_column (str): Timestamp column of the data table.
+
+    Returns:
+        list: (sql, params) pairs.
+    """
+    keys = list(keys)
+    return [
+        (
+            f'INSERT INTO {INGESTION_STATE_TABLE_FULLNAME} AS state (source, symbol, watermark, updated_at) '
+            f'SELECT %s, {key_column}, MAX({time_column}), NOW() FROM {data_table_fullname} '
+            f'WHERE {key_column} = ANY(%s) GROUP BY {key_column} '
+            f'ON CONFLICT (source, symbol) DO UPDATE SET '
+            f'watermark = GREATEST(state.watermark, EXCLUDED.watermark), updated_at = EXCLUDED.updated_at',
+            (source, keys)
+        ),
+        (
+            f'DELETE FROM {INGESTION_STATE_TABLE_FULLNAME} WHERE source = %s AND symbol = ANY(%s)',
+            (backfill_source(source), keys)
+        ),
+    ]
+
+
+def low_water_source(source, consumer=None):
+    """
+    Return the name under which the low-water marks of a source are stored, for one of the jobs
+    consuming them when several do.
+    """
+    if consumer is None:
+        return f'{source}:low_water'
+    return f'{source}:low_water:{consumer}'
+
+
+def low_water_mark_statement(
+        source,
+        key_column='symbol',
+        time_column='datetime',
+        below_watermark=True,
+        consumer=None
+        ):
+    """
+    Build the statement lowering the low-water marks of a source to the staged rows that are not
+    past its watermarks, e.g. rows of a backfill or of a gap filled late, or to every staged row.
+
+    Jobs processing the source incrementally from per-key checkpoints never see such rows on their
+    own, since the watermarks do not move for them; they restart each key from its mark instead.
+    Pass the result in post_merge_statements, before watermark_update_statement.
+
+    Parameters:
+        source (str): Name of the ingestion source.
+        key_column (str): Column identifying a series in the staged rows.
+        time_column (str): Timestamp column of the staged rows.
+        below_watermark (bool): Only mark rows not past the watermarks; pass False for sources whose
+            watermarks lag behind their rows, e.g. during a backfill, and let the jobs compare the
+            marks with their own checkpoints.
+        consumer (str, optional): Job the marks are kept for, when several jobs consume them.
+
+    Returns:
+        tuple: SQL statement and its parameters.
+    """
+    params = (low_water_source(source, consumer),)
+    join = ''
+    if below_watermark:
+        join = (
+            f'JOIN {INGESTION_STATE_TABLE_FULLNAME} source_state '
+            f'ON source_state.source = %s AND source_state.symbol = staged.{key_column} '
+            f'WHERE staged.{time_column} <= source_state.watermark '
+        )
+        params += (source,)
+    sql = (
+        f'INSERT INTO {INGESTION_STATE_TABLE_FULLNAME} AS state (source, symbol, watermark, updated_at) '
+        f'SELECT %s, staged.{key_column}, MIN(staged.{time_column}), NOW() FROM {{staging_table}} staged '
+        f'{join}GROUP BY staged.{key_column} '
+        f'ON CONFLICT (source, symbol) DO UPDATE SET '
+        f'watermark = LEAST(state.watermark, EXCLUDED.watermark), updated_at = EXCLUDED.updated_at'
+    )
+    return sql, params
+
+
+def consume_low_water_marks_statement(source, marks, consumer=None):
+    """
+    Build the statement dropping the low-water marks a job read at the start of its run, unless new
+    rows lowered them in the meantime.
+
+    Parameters:
+        source (str): Name of the ingestion source.
+        marks (dict): Low-water mark per key, as read by the job.
+        consumer (str, optional): Job the marks are kept for, when several jobs consume them.
+
+    Returns:
+        tuple: SQL statement and its parameters.
+    """
+    sql = (
+        f'DELETE FROM {INGESTION_STATE_TABLE_FULLNAME} mark '
+        f'USING unnest(%s::varchar[], %s::timestamptz[]) AS taken(symbol, watermark) '
+        f'WHERE mark.source = %s AND mark.symbol = taken.symbol AND mark.watermark >= taken.watermark'
+    )
+    return sql, (list(marks), list(marks.values()), low_water_source(source, consumer))
@@ -1,4 +1,48 @@
+from logging.handlers import QueueHandler, QueueListener
+from utils.environment import get_setting
+import atexit
+import bisect
+import contextlib
 import logging
+import math
+import queue
+import threading
+import time
+
+
+# Upper bounds in seconds of the histogram buckets, from 1 ms to about 2 minutes
+DEFAULT_HISTOGRAM_BUCKETS = tuple(0.001 * 2 ** exponent for exponent in range(18))
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _get_log_queue():
+    """
+    Return the process-wide log queue, starting the listener writing its records to stderr.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            log_queue = queue.SimpleQueue()
+            stream_handler = logging.StreamHandler()
+            # Records are formatted by the queue handler of their logger
+            stream_handler.setFormatter(logging.Formatter('%(message)s'))
+            _listener = QueueListener(log_queue, stream_handler)
+            _listener.start()
+            atexit.register(stop_logging)
+        return _listener.queue
+
+
+def stop_logging():
+    """
+    Flush the queued log records and stop the background writer. Called at exit.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
 
 
 def setup_logger(
@@ -9,6 +53,9 @@ def setup_logger(
     """
     Sets up and returns a logger.
 
+    Records are formatted by the calling thread and written to stderr by a background thread,
+    unless LOG_ASYNC is set to 0.
+
     Args:
         name (str): Name of the logger.
         level (logging.LEVEL): Logging level.
@@ -22,8 +69,9 @@ def setup_logger(
 
     # Check if handlers are already added to avoid duplication
     if not logger.handlers:
-        # Create a console handler
-        ch = logging.StreamHandler()
+        # Create a queue handler, or a console handler when logging synchronously
+        log_async = get_setting('LOG_ASYNC', True, parse=lambda value: value != '0')
+        ch = QueueHandler(_get_log_queue()) if log_async else logging.StreamHandler()
         ch.setLevel(level)
 
         # Create formatter and add it to the handler
@@ -34,3 +82,248 @@ def setup_logger(
         logger.addHandler(ch)
 
     return logger
+
+
+class SampledLogger:
+    """
+    Rate-limited logging of high-volume messages, such as one line per inserted row.
+
+    At most burst messages per key are logged in each interval; the others are only counted, and
+    the count is reported with the next message logged for that key. Arguments are %-style, so a
+    dropped message is never formatted.
+    """
+
+    def __init__(self, logger, interval=10.0, burst=5):
+        """
+        Parameters:
+            logger (logging.Logger): Logger writing the sampled messages.
+            interval (float): Length of a sampling window in seconds.
+            burst (int): Messages logged per key and window.
+        """
+        self.logger = logger
+        self.interval = interval
+        self.burst = burst
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def log(self, level, key, message, *args):
+        """
+        Log a message unless its key already used its burst in the current window.
+
+        Parameters:
+            level (int): Logging level.
+            key (str): Sampling key, e.g. the table name.
+            message (str): %-style message.
+            *args: Message arguments.
+
+        Returns:
+            bool: Whether the message was logged.
+        """
+        if not self.logger.isEnabledFor(level):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            window_start, logged, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= self.interval:
+                window_start, logged = now, 0
+            if logged >= self.burst:
+                self._windows[key] = (window_start, logged, suppressed + 1)
+                return False
+            self._windows[key] = (window_start, logged + 1, 0)
+        if suppressed:
+            message += f' ({suppressed} similar messages suppressed)'
+        self.logger.log(level, message, *args)
+        return True
+
+    def info(self, key, message, *args):
+        return self.log(logging.INFO, key, message, *args)
+
+    def debug(self, key, message, *args):
+        return self.log(logging.DEBUG, key, message, *args)
+
+
+class Counter:
+    """
+    Monotonic count, e.g. rows inserted or requests sent.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def snapshot(self):
+        return {'type': 'counter', 'value': self._value}
+
+
+class Gauge:
+    """
+    Last value of a measurement, e.g. a queue depth or pool size.
+    """
+
+    def __init__(self):
+        self._value = None
+
+    def set(self, value):
+        self._value = value
+
+    def snapshot(self):
+        return {'type': 'gauge', 'value': self._value}
+
+
+class Histogram:
+    """
+    Distribution of observations, e.g. latencies in seconds, kept as counts per bucket.
+
+    Quantiles are estimated from the bucket bounds, so memory does not grow with the observations.
+    """
+
+    def __init__(self, buckets=DEFAULT_HISTOGRAM_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            self._min = min(self._min, value)
+            self._max = max(self._max, value)
+
+    @contextlib.contextmanager
+    def time(self):
+        """
+        Observe the seconds spent in the with block, including when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket holding it, capped by the maximum.
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            rank = q * self._count
+            seen = 0
+            for bound, count in zip(self.buckets, self._counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self._max)
+            return self._max
+
+    def snapshot(self):
+        with self._lock:
+            count, total = self._count, self._sum
+            minimum, maximum = self._min, self._max
+            counts = list(self._counts)
+        return {
+            'type': 'histogram',
+            'count': count,
+            'sum': total,
+            'min': minimum if count else None,
+            'max': maximum if count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([*self.buckets, math.inf], counts)),
+        }
+
+
+class MetricsRegistry:
+    """
+    Named counters, gauges and histograms shared by the database helpers and the jobs.
+
+    Metrics are created on first use, so recording into a metric is a dictionary lookup and an
+    addition under a lock.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, metric_class, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = metric_class(*args)
+        if not isinstance(metric, metric_class):
+            raise TypeError(f'Metric "{name}" is a {type(metric).__name__}, not a {metric_class.__name__}.')
+        return metric
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name):
+        return self._get(name, Gauge)
+
+    def histogram(self, name, buckets=DEFAULT_HISTOGRAM_BUCKETS):
+        """
+        Return the named histogram; buckets only apply when this call creates it.
+        """
+        return self._get(name, Histogram, buckets)
+
+    def timer(self, name):
+        """
+        Return a context manager recording the seconds spent in its block into the named histogram.
+        """
+        return self.histogram(name).time()
+
+    def snapshot(self):
+        """
+        Return the current value of every metric.
+
+        Returns:
+            dict: Metric name mapped to its snapshot.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def log_summary(self, job_logger):
+        """
+        Log one line per metric.
+
+        Parameters:
+            job_logger (logging.Logger): Logger of the job.
+        """
+        for name, snapshot in self.snapshot().items():
+            if snapshot['type'] != 'histogram':
+                job_logger.info(f'Metric {name}: {snapshot["value"]}.')
+            elif snapshot['count']:
+                job_logger.info(
+                    f'Metric {name}: {snapshot["count"]} observations, {snapshot["sum"]:.3f}s total, '
+                    f'p50 {snapshot["p50"] * 1000:.1f} ms, p95 {snapshot["p95"] * 1000:.1f} ms, '
+                    f'max {snapshot["max"] * 1000:.1f} ms.'
+                )
+
+
+_metrics = MetricsRegistry()
+
+def get_metrics():
+    """
+    Return the process-wide metrics registry.
+
+    Returns:
+        MetricsRegistry: The shared registry.
+    """
+    return _metrics
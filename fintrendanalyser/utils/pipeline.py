@@ -0,0 +1,218 @@
+from utils.logging import get_metrics, setup_logger
+import queue
+import threading
+import time
+
+
+logger = setup_logger(name='pipeline')
+
+# Maximum number of items waiting between two stages
+DEFAULT_QUEUE_SIZE = 8
+
+# Seconds between checks for an aborted pipeline while blocked on a queue
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class _Stage:
+
+    def __init__(self, name, function, workers, finish):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.finish = finish
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self.active_workers = self.workers
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues, each stage running on its own threads.
+
+    A stage function takes one item and returns an iterable (typically a generator) of items for
+    the next stage, so a stage can split an item into chunks or drop it. Since every queue is
+    bounded, a slow stage blocks the stages feeding it, and the number of items in flight, hence the
+    memory held by the pipeline, is set by the queue sizes rather than by the size of the input.
+
+    Items from a stage with several workers reach the next stage in completion order.
+    """
+
+    def __init__(self, name, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Parameters:
+            name (str): Name used in log messages.
+            queue_size (int): Maximum number of items waiting in front of each stage.
+        """
+        self.name = name
+        self.queue_size = queue_size
+        self._stages = []
+        self._stop = threading.Event()
+        self._errors = []
+
+    def stage(self, name, function, workers=1, finish=None):
+        """
+        Append a stage.
+
+        Parameters:
+            name (str): Stage name, used in statistics.
+            function (callable): Called with each input item, returns an iterable of output items or None.
+            workers (int): Number of threads running the function concurrently.
+            finish (callable, optional): Called once the stage has consumed all its input, returns an
+                iterable of final output items or None; use it to flush batches.
+
+        Returns:
+            Pipeline: The pipeline, so stages can be chained.
+        """
+        self._stages.append(_Stage(name, function, workers, finish))
+        return self
+
+    def _put(self, target_queue, item, stage=None):
+        while not self._stop.is_set():
+            try:
+                target_queue.put(item, timeout=POLL_INTERVAL)
+            except queue.Full:
+                continue
+            if stage is not None:
+                with stage.lock:
+                    stage.max_queue_depth = max(stage.max_queue_depth, target_queue.qsize())
+            return True
+        return False
+
+    def _get(self, source_queue):
+        while not self._stop.is_set():
+            try:
+                return source_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _abort(self, error):
+        self._errors.append(error)
+        self._stop.set()
+
+    def _forward(self, stage, outputs, output_queue, next_stage):
+        for output in outputs or ():
+            with stage.lock:
+                stage.items_out += 1
+            if output_queue is not None and not self._put(output_queue, output, next_stage):
+                return
+
+    def _feed(self, source, output_queue, next_stage):
+        try:
+            for item in source:
+                if not self._put(output_queue, item, next_stage):
+                    return
+            self._put(output_queue, _DONE)
+        except Exception as e:
+            logger.error(f'Source of pipeline "{self.name}" failed: ', exc_info=e)
+            self._abort(e)
+
+    def _work(self, stage, input_queue, output_queue, next_stage):
+        try:
+            while True:
+                item = self._get(input_queue)
+                if item is _DONE:
+                    # Hand the end marker over to the other workers of the stage
+                    self._put(input_queue, _DONE)
+                    break
+                start = time.perf_counter()
+                with stage.lock:
+                    stage.items_in += 1
+                self._forward(stage, stage.function(item), output_queue, next_stage)
+                with stage.lock:
+                    stage.busy_seconds += time.perf_counter() - start
+
+            with stage.lock:
+                stage.active_workers -= 1
+                last_worker = stage.active_workers == 0
+            if last_worker and not self._stop.is_set():
+                if stage.finish is not None:
+                    self._forward(stage, stage.finish(), output_queue, next_stage)
+                if output_queue is not None:
+                    self._put(output_queue, _DONE)
+        except Exception as e:
+            logger.error(f'Stage "{stage.name}" of pipeline "{self.name}" failed: ', exc_info=e)
+            self._abort(e)
+
+    def run(self, source):
+        """
+        Push every item of source through the stages and wait for the pipeline to drain.
+
+        The first exception raised by the source or a stage stops every stage and is re-raised.
+
+        Parameters:
+            source (iterable): Input items of the first stage.
+
+        Returns:
+            dict: Statistics per stage: items in and out, busy seconds and maximum input queue depth.
+        """
+        if not self._stages:
+            raise ValueError(f'Pipeline "{self.name}" has no stages.')
+        self._stop.clear()
+        self._errors = []
+        for stage in self._stages:
+            stage.reset()
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self._stages]
+        threads = [threading.Thread(
+            target=self._feed,
+            args=(source, queues[0], self._stages[0]),
+            name=f'{self.name}-source',
+            daemon=True
+        )]
+        for index, stage in enumerate(self._stages):
+            is_last = index == len(self._stages) - 1
+            output_queue = None if is_last else queues[index + 1]
+            next_stage = None if is_last else self._stages[index + 1]
+            threads.extend(
+                threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[index], output_queue, next_stage),
+                    name=f'{self.name}-{stage.name}-{worker}',
+                    daemon=True
+                )
+                for worker in range(stage.workers)
+            )
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if self._errors:
+            raise self._errors[0]
+
+        stats = {
+            stage.name: {
+                'items_in': stage.items_in,
+                'items_out': stage.items_out,
+                'busy_seconds': stage.busy_seconds,
+                'max_queue_depth': stage.max_queue_depth,
+            }
+            for stage in self._stages
+        }
+        metrics = get_metrics()
+        metrics.histogram(f'pipeline.{self.name}.run_seconds').observe(elapsed)
+        for stage in self._stages:
+            metrics.counter(f'pipeline.{self.name}.{stage.name}.items_out').inc(stage.items_out)
+            metrics.gauge(f'pipeline.{self.name}.{stage.name}.items_per_second').set(
+                stage.items_out / elapsed if elapsed > 0 else 0.0
+            )
+        logger.info(
+            f'Pipeline "{self.name}" finished in {elapsed:.2f}s: '
+            + ', '.join(
+                f'{name} {stage_stats["items_in"]} in / {stage_stats["busy_seconds"]:.2f}s busy'
+                for name, stage_stats in stats.items()
+            )
+        )
+        return stats
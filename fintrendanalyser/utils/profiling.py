@@ -0,0 +1,338 @@
+"""
+Opt-in run telemetry: timing spans around the fetch, transform and write steps of the jobs,
+optional cProfile and tracemalloc captures, and export as JSON and Prometheus text files.
+
+Spans cost a single attribute check while profiling is disabled. Enable them with
+FTA_PROFILE=1 or the orchestrator --profile flag.
+
+Usage (from the fintrendanalyser directory):
+    python -m orchestrator --profile --profile-cpu
+    python -m utils.profiling compare telemetry/run-20240101T020000.json telemetry/run-20240102T020000.json
+"""
+from utils.environment import get_flag, get_setting
+from utils.logging import get_metrics, setup_logger
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+
+
+logger = setup_logger(name='profiling')
+
+# Spans are recorded when FTA_PROFILE is set, and exported to FTA_TELEMETRY_DIR
+DEFAULT_TELEMETRY_DIR = 'telemetry'
+
+# Functions and allocation sites kept in the exported JSON
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+
+# A span regresses when it is this much slower than in the reference run, relatively and in seconds
+REGRESSION_TOLERANCE = 0.2
+REGRESSION_MIN_SECONDS = 1.0
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class RunTelemetry:
+    """
+    Timing spans of a run, and the optional CPU and memory captures around it.
+
+    On Python 3.12 and later the CPU profile covers every thread; on older versions only the
+    thread that started the capture is profiled, and the pipeline workers are covered by spans.
+    """
+
+    def __init__(self, enabled=None):
+        self.enabled = get_flag('FTA_PROFILE') if enabled is None else enabled
+        self._spans = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._memory = False
+        self._started_at = None
+        self._start = None
+
+    def enable(self):
+        self.enabled = True
+
+    def span(self, name, key=None):
+        """
+        Time a block into the named span, and into the entry of key (e.g. a symbol) within it.
+
+        Parameters:
+            name (str): Span name, "<job>.<step>", e.g. "historical_stock_data.fetch".
+            key (str, optional): Symbol, company or country the block works on.
+
+        Returns:
+            Context manager timing its block, a no-op while profiling is disabled.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._timed(name, key)
+
+    @contextlib.contextmanager
+    def _timed(self, name, key):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, key)
+
+    def record(self, name, seconds, key=None):
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                span = self._spans[name] = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'keys': {}}
+            span['count'] += 1
+            span['seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+            if key is not None:
+                span['keys'][key] = span['keys'].get(key, 0.0) + seconds
+
+    def start(self, cpu=False, memory=False):
+        """
+        Start the clock of the run and, optionally, the CPU profiler and allocation tracing.
+
+        Parameters:
+            cpu (bool): Capture a cProfile profile.
+            memory (bool): Trace allocations with tracemalloc.
+        """
+        self._started_at = datetime.datetime.now(datetime.timezone.utc)
+        self._start = time.perf_counter()
+        if cpu:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        if memory:
+            import tracemalloc
+            tracemalloc.start()
+            self._memory = True
+
+    def stop(self):
+        """
+        Stop the captures and return what they measured.
+
+        Returns:
+            dict: Telemetry of the run, as exported to JSON.
+        """
+        telemetry = {
+            'started_at': self._started_at.isoformat() if self._started_at else None,
+            'seconds': time.perf_counter() - self._start if self._start is not None else None,
+        }
+        if self._profiler is not None:
+            self._profiler.disable()
+            telemetry['top_functions'] = _top_functions(self._profiler)
+        if self._memory:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self._memory = False
+            telemetry['memory'] = {
+                'peak_bytes': peak,
+                'top_allocations': [
+                    {'location': str(stat.traceback), 'size_bytes': stat.size, 'count': stat.count}
+                    for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+                ],
+            }
+        with self._lock:
+            telemetry['spans'] = {name: dict(span, keys=dict(span['keys'])) for name, span in sorted(self._spans.items())}
+        telemetry['metrics'] = get_metrics().snapshot()
+        return telemetry
+
+    def export(self, run_name, directory=None):
+        """
+        Stop the captures and write the telemetry of the run as JSON, Prometheus text and, with
+        CPU profiling, a pstats file.
+
+        Parameters:
+            run_name (str): Prefix of the files, completed with the start time.
+            directory (str, optional): Directory of the files, defaults to FTA_TELEMETRY_DIR.
+
+        Returns:
+            dict: Format mapped to the path of the written file.
+        """
+        profiler = self._profiler
+        telemetry = self.stop()
+        telemetry['run'] = run_name
+        directory = directory or get_setting('FTA_TELEMETRY_DIR', DEFAULT_TELEMETRY_DIR)
+        os.makedirs(directory, exist_ok=True)
+        stamp = (self._started_at or datetime.datetime.now(datetime.timezone.utc)).strftime('%Y%m%dT%H%M%S')
+        prefix = os.path.join(directory, f'{run_name}-{stamp}')
+
+        paths = {'json': f'{prefix}.json', 'prometheus': f'{prefix}.prom'}
+        if profiler is not None:
+            paths['pstats'] = f'{prefix}.pstats'
+            profiler.dump_stats(paths['pstats'])
+            self._profiler = None
+        with open(paths['json'], 'w') as json_file:
+            json.dump(telemetry, json_file, indent=2, default=str)
+        with open(paths['prometheus'], 'w') as prometheus_file:
+            prometheus_file.write(to_prometheus(telemetry))
+        logger.info(f'Wrote run telemetry to {", ".join(paths.values())}.')
+        return paths
+
+
+def _top_functions(profiler):
+    import pstats
+
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = [
+        {
+            'function': f'{filename}:{line}({function})',
+            'calls': calls,
+            'own_seconds': own_seconds,
+            'cumulative_seconds': cumulative_seconds,
+        }
+        for (filename, line, function), (_, calls, own_seconds, cumulative_seconds, _) in stats.stats.items()
+    ]
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def to_prometheus(telemetry):
+    """
+    Render the spans and metrics of a run in the Prometheus text exposition format.
+
+    Parameters:
+        telemetry (dict): Telemetry of the run, as returned by RunTelemetry.stop.
+
+    Returns:
+        str: Exposition text.
+    """
+    lines = [
+        '# HELP fta_span_seconds_total Seconds spent in each span.',
+        '# TYPE fta_span_seconds_total counter',
+    ]
+    lines.extend(
+        f'fta_span_seconds_total{{span="{_label(name)}"}} {span["seconds"]}'
+        for name, span in telemetry['spans'].items()
+    )
+    lines += ['# HELP fta_span_count_total Executions of each span.', '# TYPE fta_span_count_total counter']
+    lines.extend(
+        f'fta_span_count_total{{span="{_label(name)}"}} {span["count"]}'
+        for name, span in telemetry['spans'].items()
+    )
+    if telemetry.get('seconds') is not None:
+        lines += ['# TYPE fta_run_seconds gauge', f'fta_run_seconds {telemetry["seconds"]}']
+    if 'memory' in telemetry:
+        lines += ['# TYPE fta_run_peak_traced_bytes gauge', f'fta_run_peak_traced_bytes {telemetry["memory"]["peak_bytes"]}']
+
+    for name, snapshot in telemetry['metrics'].items():
+        metric = f'fta_{_metric_name(name)}'
+        if snapshot['type'] == 'counter':
+            lines += [f'# TYPE {metric}_total counter', f'{metric}_total {snapshot["value"]}']
+        elif snapshot['type'] == 'gauge':
+            if snapshot['value'] is not None:
+                lines += [f'# TYPE {metric} gauge', f'{metric} {snapshot["value"]}']
+        else:
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, count in snapshot['buckets'].items():
+                cumulative += count
+                bound = '+Inf' if float(bound) == math.inf else bound
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f'{metric}_sum {snapshot["sum"]}', f'{metric}_count {snapshot["count"]}']
+    return '\n'.join(lines) + '\n'
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+def get_telemetry():
+    """
+    Return the process-wide run telemetry, creating it on first use.
+
+    Returns:
+        RunTelemetry: The shared telemetry.
+    """
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = RunTelemetry()
+    return _telemetry
+
+
+def span(name, key=None):
+    """
+    Time a block into a span of the process-wide telemetry; see RunTelemetry.span.
+    """
+    return get_telemetry().span(name, key)
+
+
+def compare_runs(reference, candidate, tolerance=REGRESSION_TOLERANCE, min_seconds=REGRESSION_MIN_SECONDS):
+    """
+    Compare the spans of two runs.
+
+    Parameters:
+        reference (dict): Telemetry of the reference run.
+        candidate (dict): Telemetry of the run to check.
+        tolerance (float): Relative slowdown tolerated.
+        min_seconds (float): Absolute slowdown tolerated, so that short spans do not flap.
+
+    Returns:
+        list: One dict per span with both durations, the change and whether it regressed, slowest change first.
+    """
+    rows = []
+    for name in sorted(set(reference['spans']) | set(candidate['spans'])):
+        before = reference['spans'].get(name, {}).get('seconds', 0.0)
+        after = candidate['spans'].get(name, {}).get('seconds', 0.0)
+        change = after - before
+        rows.append({
+            'span': name,
+            'reference_seconds': before,
+            'candidate_seconds': after,
+            'change_seconds': change,
+            'change_ratio': change / before if before else None,
+            'regressed': change > min_seconds and (not before or change > before * tolerance),
+        })
+    rows.sort(key=lambda row: row['change_seconds'], reverse=True)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the telemetry of two runs.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compare_parser = subparsers.add_parser('compare', help='Show which spans got slower between two runs.')
+    compare_parser.add_argument('reference', help='JSON telemetry of the reference run.')
+    compare_parser.add_argument('candidate', help='JSON telemetry of the run to check.')
+    compare_parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE, help='Relative slowdown tolerated.')
+    compare_parser.add_argument('--min-seconds', type=float, default=REGRESSION_MIN_SECONDS, help='Absolute slowdown tolerated.')
+    args = parser.parse_args()
+
+    with open(args.reference) as reference_file:
+        reference = json.load(reference_file)
+    with open(args.candidate) as candidate_file:
+        candidate = json.load(candidate_file)
+
+    rows = compare_runs(reference, candidate, tolerance=args.tolerance, min_seconds=args.min_seconds)
+    print(f'{"span":<44} {"reference":>10} {"candidate":>10} {"change":>10}')
+    for row in rows:
+        ratio = f'{row["change_ratio"]:+.0%}' if row['change_ratio'] is not None else 'new'
+        flag = '  REGRESSED' if row['regressed'] else ''
+        print(
+            f'{row["span"]:<44} {row["reference_seconds"]:>9.2f}s {row["candidate_seconds"]:>9.2f}s '
+            f'{ratio:>10}{flag}'
+        )
+    if reference.get('seconds') and candidate.get('seconds'):
+        print(f'{"whole run":<44} {reference["seconds"]:>9.2f}s {candidate["seconds"]:>9.2f}s')
+    if any(row['regressed'] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
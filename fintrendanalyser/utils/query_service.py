@@ -0,0 +1,407 @@
+"""
+Read-side query layer for charts and APIs: typed calls returning the bars and indicators of
+symbols over a date range, served from an in-memory cache.
+
+Results are cached per symbol, table and range in a least recently used cache bounded in bytes,
+with a time-to-live. Writers announce the symbols they change on the PostgreSQL channel of
+utils.events.DATA_CHANGED_CHANNEL, and the service drops the cached windows of those symbols as
+soon as the write commits. Concurrent requests missing the same window share a single query.
+
+Example:
+    service = get_query_service()
+    service.start_invalidation_listener()
+    frame = service.bars(['AAPL', 'MSFT'], start=datetime.date(2024, 1, 1), interval='1d')
+"""
+from utils.constants import (
+    DB_PROCESSED_DATA_SCHEMA,
+    DB_RAW_DATA_SCHEMA,
+    HISTORICAL_STOCK_DATA_TABLE_NAME,
+    INTRADAY_ROLLUP_TABLE_NAMES,
+    INTRADAY_STOCK_DATA_TABLE_NAME,
+    STOCK_ATR_DATA_TABLE_NAME,
+    STOCK_ATR_DATA_TABLE_SCHEMA,
+    STOCK_BBANDS_DATA_TABLE_NAME,
+    STOCK_BBANDS_DATA_TABLE_SCHEMA,
+    STOCK_EMA_DATA_TABLE_NAME,
+    STOCK_EMA_DATA_TABLE_SCHEMA,
+    STOCK_MACD_DATA_TABLE_NAME,
+    STOCK_MACD_DATA_TABLE_SCHEMA,
+    STOCK_RSI_DATA_TABLE_NAME,
+    STOCK_RSI_DATA_TABLE_SCHEMA,
+    STOCK_SMA_DATA_TABLE_NAME,
+    STOCK_SMA_DATA_TABLE_SCHEMA
+)
+from concurrent.futures import Future
+from utils.database import db_session, get_db_connection, stream_select_frames
+from utils.environment import get_setting
+from utils.events import DATA_CHANGED_CHANNEL
+from utils.logging import get_metrics, setup_logger
+import collections
+import select
+import threading
+import time
+
+
+logger = setup_logger(name='query_service')
+
+# Cache limits, overridable with the QUERY_CACHE_MAX_BYTES and QUERY_CACHE_TTL_SECONDS variables
+DEFAULT_QUERY_CACHE_MAX_BYTES = 256 * 1024 ** 2
+DEFAULT_QUERY_CACHE_TTL = 300
+
+# Table of each bar interval; the intraday rollups are in the processed schema
+BAR_TABLES = {
+    '1m': f'{DB_RAW_DATA_SCHEMA}.{INTRADAY_STOCK_DATA_TABLE_NAME}',
+    **{
+        interval: f'{DB_PROCESSED_DATA_SCHEMA}.{table_name}'
+        for interval, table_name in INTRADAY_ROLLUP_TABLE_NAMES.items() if interval != '1d'
+    },
+    '1d': f'{DB_RAW_DATA_SCHEMA}.{HISTORICAL_STOCK_DATA_TABLE_NAME}',
+}
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+# Table and value columns of each technical indicator
+INDICATOR_TABLES = {
+    name: (f'{DB_RAW_DATA_SCHEMA}.{table_name}', [column for column in table_schema if column not in ('symbol', 'datetime')])
+    for name, table_name, table_schema in [
+        ('sma', STOCK_SMA_DATA_TABLE_NAME, STOCK_SMA_DATA_TABLE_SCHEMA),
+        ('ema', STOCK_EMA_DATA_TABLE_NAME, STOCK_EMA_DATA_TABLE_SCHEMA),
+        ('rsi', STOCK_RSI_DATA_TABLE_NAME, STOCK_RSI_DATA_TABLE_SCHEMA),
+        ('macd', STOCK_MACD_DATA_TABLE_NAME, STOCK_MACD_DATA_TABLE_SCHEMA),
+        ('bbands', STOCK_BBANDS_DATA_TABLE_NAME, STOCK_BBANDS_DATA_TABLE_SCHEMA),
+        ('atr', STOCK_ATR_DATA_TABLE_NAME, STOCK_ATR_DATA_TABLE_SCHEMA),
+    ]
+}
+
+# Seconds between checks of the stop flag by the invalidation listener, and before it reconnects
+LISTEN_POLL_INTERVAL = 1.0
+LISTEN_RECONNECT_DELAY = 10.0
+
+
+class QueryService:
+    """
+    Typed read calls over the bar and indicator tables, cached in memory.
+
+    Each symbol's window is a cache entry of its own, so a request for many symbols reuses the
+    windows already cached, loads the others in one query, and a write to one symbol only
+    invalidates that symbol. Returned DataFrames are fresh copies the caller may modify.
+    """
+
+    def __init__(self, max_bytes=None, ttl=None):
+        """
+        Parameters:
+            max_bytes (int, optional): Size cap of the cached frames in bytes, defaults to QUERY_CACHE_MAX_BYTES.
+            ttl (float, optional): Seconds a cached window is served before being reloaded, defaults to QUERY_CACHE_TTL_SECONDS.
+        """
+        self.max_bytes = get_setting('QUERY_CACHE_MAX_BYTES', DEFAULT_QUERY_CACHE_MAX_BYTES, int) \
+            if max_bytes is None else max_bytes
+        self.ttl = get_setting('QUERY_CACHE_TTL_SECONDS', DEFAULT_QUERY_CACHE_TTL, float) if ttl is None else ttl
+        self._entries = collections.OrderedDict()
+        self._keys_by_series = {}
+        self._generations = {}
+        self._in_flight = {}
+        self._bytes = 0
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+        self._listener = None
+        self._stop_listening = threading.Event()
+
+    def bars(self, symbols, start=None, end=None, interval='1d'):
+        """
+        Return the OHLCV bars of symbols over a range.
+
+        Parameters:
+            symbols (str or list): Symbol or symbols.
+            start (date or datetime, optional): First bar time, inclusive.
+            end (date or datetime, optional): Last bar time, inclusive.
+            interval (str): Key of BAR_TABLES, e.g. "1m", "5m", "1h" or "1d".
+
+        Returns:
+            DataFrame: symbol, datetime and OHLCV columns, ordered by symbol (as requested) and time.
+        """
+        if interval not in BAR_TABLES:
+            raise ValueError(f'Unknown bar interval "{interval}", expected one of {", ".join(BAR_TABLES)}.')
+        return self._query('bars', BAR_TABLES[interval], BAR_COLUMNS, symbols, start, end)
+
+    def indicator(self, name, symbols, start=None, end=None):
+        """
+        Return the daily values of a technical indicator of symbols over a range.
+
+        Parameters:
+            name (str): Key of INDICATOR_TABLES, e.g. "sma" or "macd".
+            symbols (str or list): Symbol or symbols.
+            start (date, optional): First date, inclusive.
+            end (date, optional): Last date, inclusive.
+
+        Returns:
+            DataFrame: symbol, datetime and the value columns of the indicator.
+        """
+        if name not in INDICATOR_TABLES:
+            raise ValueError(f'Unknown indicator "{name}", expected one of {", ".join(INDICATOR_TABLES)}.')
+        table_fullname, columns = INDICATOR_TABLES[name]
+        return self._query(name, table_fullname, columns, symbols, start, end)
+
+    def sma(self, symbols, start=None, end=None):
+        return self.indicator('sma', symbols, start=start, end=end)
+
+    def _query(self, kind, table_fullname, columns, symbols, start, end):
+        import pandas as pd
+
+        symbols = [symbols] if isinstance(symbols, str) else list(dict.fromkeys(symbols))
+        metrics = get_metrics()
+        frames = {}
+        waiting = {}
+        owned = {}
+
+        with metrics.timer(f'query.{kind}_seconds'):
+            now = time.monotonic()
+            with self._lock:
+                for symbol in symbols:
+                    key = (table_fullname, symbol, start, end)
+                    frame = self._lookup(key, now)
+                    if frame is not None:
+                        self._counters['hits'] += 1
+                        frames[symbol] = frame
+                    elif key in self._in_flight:
+                        self._counters['coalesced'] += 1
+                        waiting[symbol] = self._in_flight[key]
+                    else:
+                        self._counters['misses'] += 1
+                        self._in_flight[key] = Future()
+                        owned[symbol] = self._generations.get((table_fullname, symbol), 0)
+
+            if owned:
+                frames.update(self._load_owned(table_fullname, columns, owned, start, end))
+            for symbol, future in waiting.items():
+                frames[symbol] = future.result()
+
+            metrics.counter('query.cache_hits').inc(len(symbols) - len(owned) - len(waiting))
+            metrics.counter('query.cache_misses').inc(len(owned))
+            metrics.counter('query.coalesced').inc(len(waiting))
+            # Concatenating copies the cached frames, so callers never modify a cache entry
+            parts = [frames[symbol] for symbol in symbols if len(frames[symbol])] or [frames[symbols[0]]]
+            return pd.concat(parts, ignore_index=True)
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        frame, _, expires_at = entry
+        if expires_at <= now:
+            self._counters['expirations'] += 1
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return frame
+
+    def _load_owned(self, table_fullname, columns, owned, start, end):
+        """
+        Load the windows this request is the first to miss, then cache them and hand them to the waiting requests.
+        """
+        keys = {symbol: (table_fullname, symbol, start, end) for symbol in owned}
+        try:
+            loaded = self._load(table_fullname, columns, list(owned), start, end)
+        except Exception as e:
+            with self._lock:
+                futures = [self._in_flight.pop(key) for key in keys.values()]
+            for future in futures:
+                future.set_exception(e)
+            raise
+
+        with self._lock:
+            futures = []
+            for symbol, generation in owned.items():
+                futures.append((self._in_flight.pop(keys[symbol]), loaded[symbol]))
+                # A window invalidated while it was loading may miss the write, so it is served once but not cached
+                if self._generations.get((table_fullname, symbol), 0) == generation:
+                    self._store(keys[symbol], loaded[symbol])
+        for future, frame in futures:
+            future.set_result(frame)
+        return loaded
+
+    def _load(self, table_fullname, columns, symbols, start, end):
+        import pandas as pd
+
+        query = f"SELECT symbol, datetime, {', '.join(columns)} FROM {table_fullname} WHERE symbol = ANY(%s)"
+        params = [symbols]
+        if start is not None:
+            query += ' AND datetime >= %s'
+            params.append(start)
+        if end is not None:
+            query += ' AND datetime <= %s'
+            params.append(end)
+        query += ' ORDER BY symbol, datetime'
+
+        with get_metrics().timer('query.load_seconds'), db_session() as conn:
+            chunks = list(stream_select_frames(conn, query, tuple(params)))
+        frame = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=['symbol', 'datetime', *columns])
+
+        empty = frame.iloc[0:0]
+        loaded = {symbol: empty for symbol in symbols}
+        for symbol, group in frame.groupby('symbol', sort=False):
+            # One shared string for the symbol column, so the shallow memory usage is the real size
+            loaded[symbol] = group.assign(symbol=symbol).reset_index(drop=True)
+        return loaded
+
+    def _store(self, key, frame):
+        size = int(frame.memory_usage(index=True, deep=False).sum())
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (frame, size, time.monotonic() + self.ttl)
+        self._keys_by_series.setdefault(key[:2], set()).add(key)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._counters['evictions'] += 1
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        series_keys = self._keys_by_series.get(key[:2])
+        if series_keys is not None:
+            series_keys.discard(key)
+            if not series_keys:
+                del self._keys_by_series[key[:2]]
+
+    def invalidate(self, table_fullname, symbols):
+        """
+        Drop the cached windows of symbols of a table, including the windows being loaded.
+
+        Parameters:
+            table_fullname (str): Schema-qualified table name, as in BAR_TABLES and INDICATOR_TABLES.
+            symbols (list): Symbols whose data changed.
+
+        Returns:
+            int: Number of cached windows dropped.
+        """
+        dropped = 0
+        with self._lock:
+            for symbol in symbols:
+                series = (table_fullname, symbol)
+                self._generations[series] = self._generations.get(series, 0) + 1
+                for key in list(self._keys_by_series.get(series, ())):
+                    self._remove(key)
+                    dropped += 1
+            self._counters['invalidations'] += dropped
+        return dropped
+
+    def clear(self):
+        """
+        Drop every cached window, e.g. after notifications may have been missed.
+        """
+        with self._lock:
+            for series in self._keys_by_series:
+                self._generations[series] = self._generations.get(series, 0) + 1
+            for key in self._in_flight:
+                self._generations[key[:2]] = self._generations.get(key[:2], 0) + 1
+            self._entries.clear()
+            self._keys_by_series.clear()
+            self._bytes = 0
+
+    def start_invalidation_listener(self):
+        """
+        Start a background thread listening to the data change notifications of the writers, on a
+        dedicated connection. Until it runs, changes are only picked up when windows expire.
+        """
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._stop_listening.clear()
+            self._listener = threading.Thread(target=self._listen, name='query-invalidation', daemon=True)
+            self._listener.start()
+
+    def stop_invalidation_listener(self):
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            self._stop_listening.set()
+            listener.join()
+
+    def _listen(self):
+        while not self._stop_listening.is_set():
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {DATA_CHANGED_CHANNEL}')
+                # Changes committed while not listening were missed
+                self.clear()
+                logger.info(f'Listening to data changes on "{DATA_CHANGED_CHANNEL}".')
+
+                while not self._stop_listening.is_set():
+                    if select.select([conn], [], [], LISTEN_POLL_INTERVAL) == ([], [], []):
+                        continue
+                    conn.poll()
+                    changed = {}
+                    while conn.notifies:
+                        table_fullname, _, symbol = conn.notifies.pop(0).payload.rpartition(':')
+                        changed.setdefault(table_fullname, set()).add(symbol)
+                    for table_fullname, symbols in changed.items():
+                        self.invalidate(table_fullname, symbols)
+            except Exception as e:
+                logger.error(f'Data change listener failed: {e}. Reconnecting in {LISTEN_RECONNECT_DELAY:.0f}s.')
+                self._stop_listening.wait(LISTEN_RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self):
+        """
+        Return the cache counters, hit rate and request latency percentiles.
+
+        Returns:
+            dict: Counters, "hit_rate" over all symbol windows requested, cache size, and the
+                p50/p95/p99 latency in seconds of each kind of request.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            entries, size = len(self._entries), self._bytes
+        requested = counters.get('hits', 0) + counters.get('misses', 0) + counters.get('coalesced', 0)
+        latency = {}
+        for name, snapshot in get_metrics().snapshot().items():
+            if name.startswith('query.') and name.endswith('_seconds') and snapshot['type'] == 'histogram':
+                latency[name[len('query.'):-len('_seconds')]] = {
+                    quantile: snapshot[quantile] for quantile in ('p50', 'p95', 'p99')
+                }
+        return {
+            **{name: counters.get(name, 0) for name in ('hits', 'misses', 'coalesced', 'expirations', 'evictions', 'invalidations')},
+            'hit_rate': counters.get('hits', 0) / requested if requested else None,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'latency': latency,
+        }
+
+    def log_stats(self, job_logger=None):
+        stats = self.stats()
+        hit_rate = f"{stats['hit_rate']:.1%}" if stats['hit_rate'] is not None else 'n/a'
+        (job_logger or logger).info(
+            f"Query cache: {stats['entries']} windows, {stats['bytes'] / 1024 ** 2:.1f}/{self.max_bytes / 1024 ** 2:.0f} MiB, "
+            f"hit rate {hit_rate} ({stats['hits']} hits, {stats['misses']} misses, {stats['coalesced']} coalesced), "
+            f"{stats['evictions']} evictions, {stats['invalidations']} invalidations."
+        )
+        for kind, quantiles in stats['latency'].items():
+            if quantiles['p50'] is not None:
+                (job_logger or logger).info(
+                    f"Query {kind}: p50 {quantiles['p50'] * 1000:.1f} ms, p95 {quantiles['p95'] * 1000:.1f} ms, "
+                    f"p99 {quantiles['p99'] * 1000:.1f} ms."
+                )
+
+
+_query_service = None
+_query_service_lock = threading.Lock()
+
+def get_query_service():
+    """
+    Return the process-wide query service, creating it on first use.
+
+    Returns:
+        QueryService: The shared service.
+    """
+    global _query_service
+    with _query_service_lock:
+        if _query_service is None:
+            _query_service = QueryService()
+        return _query_service
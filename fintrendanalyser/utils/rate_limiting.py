@@ -0,0 +1,320 @@
+from concurrent.futures import ThreadPoolExecutor
+from pyrate_limiter import Duration, Limiter, Rate
+from utils.cache import get_response_cache
+from utils.environment import load_environment
+from utils.logging import get_metrics, setup_logger
+import collections
+import datetime
+import os
+import random
+import threading
+import time
+
+
+logger = setup_logger(name='rate_limiting')
+
+# Alpha Vantage request budget (free tier), overridable with the ALPHA_VANTAGE_REQUESTS_PER_* variables
+DEFAULT_ALPHA_VANTAGE_REQUESTS_PER_MINUTE = 5
+DEFAULT_ALPHA_VANTAGE_REQUESTS_PER_DAY = 25
+
+# NewsAPI request budget (developer plan), overridable with the NEWS_API_REQUESTS_PER_* variables
+DEFAULT_NEWS_API_REQUESTS_PER_MINUTE = 30
+DEFAULT_NEWS_API_REQUESTS_PER_DAY = 100
+DEFAULT_NEWS_API_MAX_CONCURRENCY = 4
+
+# Alpha Vantage answers throttled requests with an informational note, which the client raises as a ValueError
+ALPHA_VANTAGE_THROTTLE_MARKERS = (
+    'call frequency',
+    'rate limit',
+    'thank you for using alpha vantage',
+)
+
+SECONDS_PER_MINUTE = 60
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class RateLimitBudgetExhausted(Exception):
+    """
+    Raised when a call cannot be scheduled without exceeding the daily request budget.
+    """
+
+
+def is_alpha_vantage_throttled(error):
+    """
+    Tell whether an exception raised by the alpha_vantage client is a throttling response.
+
+    Parameters:
+        error (Exception): Exception raised by a TimeSeries or TechIndicators call.
+
+    Returns:
+        bool: True if the call should be retried later.
+    """
+    message = str(error).lower()
+    return isinstance(error, ValueError) and any(marker in message for marker in ALPHA_VANTAGE_THROTTLE_MARKERS)
+
+
+def is_news_api_throttled(error):
+    """
+    Tell whether an exception raised by a NewsAPI request is a throttling response (HTTP 429).
+    """
+    return getattr(getattr(error, 'response', None), 'status_code', None) == 429
+
+
+class RequestScheduler:
+    """
+    Paces calls to a rate-limited API within a per-minute and per-day request budget.
+
+    Calls are queued on a thread pool, so as many run concurrently as the budget allows.
+    Calls rejected by the provider as throttled are retried with exponential backoff.
+
+    With a usage store, the daily budget is counted per UTC day in the store and shared by every
+    process using it, e.g. one-shot runs, the orchestrator and the polling daemon; without one,
+    it is a rolling day of this process only.
+    """
+
+    def __init__(
+            self,
+            name,
+            requests_per_minute,
+            requests_per_day=None,
+            max_workers=None,
+            max_retries=5,
+            backoff_base=15.0,
+            backoff_max=120.0,
+            is_throttled=is_alpha_vantage_throttled,
+            usage_store=None
+            ):
+        """
+        Parameters:
+            name (str): Name of the API, used in logs.
+            requests_per_minute (int): Maximum number of calls per rolling minute.
+            requests_per_day (int, optional): Maximum number of calls per rolling day.
+            max_workers (int, optional): Maximum concurrent calls, defaults to requests_per_minute.
+            max_retries (int): Retries of a throttled call before its error is raised.
+            backoff_base (float): Seconds to wait before the first retry, doubled on each attempt.
+            backoff_max (float): Upper bound of the wait between retries, in seconds.
+            is_throttled (callable): Predicate telling whether an exception is a throttling response.
+            usage_store (ResponseCache, optional): Store counting the calls of each UTC day across processes.
+        """
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.requests_per_day = requests_per_day
+        self.max_workers = max_workers or requests_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.is_throttled = is_throttled
+        self.usage_store = usage_store
+
+        rates = [Rate(requests_per_minute, Duration.MINUTE)]
+        if requests_per_day and usage_store is None:
+            rates.append(Rate(requests_per_day, Duration.DAY))
+        # Wait up to a minute for the per-minute window to free up; longer waits mean the daily budget is spent
+        self._limiter = Limiter(rates, raise_when_fail=False, max_delay=Duration.SECOND * 65)
+
+        self._lock = threading.Lock()
+        self._call_times = collections.deque()
+        self._retries = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix=f'{name}-scheduler'
+        )
+
+    def _acquire(self):
+        reserved = self.requests_per_day and self.usage_store is not None
+        day = utc_today()
+        if reserved and not self.usage_store.reserve_daily_call(self.name, day, self.requests_per_day):
+            raise RateLimitBudgetExhausted(f'{self.name} daily request budget of {self.requests_per_day} is exhausted.')
+        if not self._limiter.try_acquire(self.name):
+            if reserved:
+                # The call is not made, so it must not count against the shared daily budget
+                self.usage_store.release_daily_call(self.name, day)
+                raise RateLimitBudgetExhausted(
+                    f'{self.name} per-minute request budget of {self.requests_per_minute} '
+                    f'had no free slot within the wait limit.'
+                )
+            raise RateLimitBudgetExhausted(
+                f'{self.name} per-minute or daily request budget ({self.requests_per_minute}/minute, '
+                f'{self.requests_per_day}/day) had no free slot within the wait limit.'
+            )
+        now = time.monotonic()
+        with self._lock:
+            self._call_times.append(now)
+            while self._call_times and now - self._call_times[0] >= SECONDS_PER_DAY:
+                self._call_times.popleft()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run a call within the budget, retrying it with backoff while the provider reports throttling.
+
+        Parameters:
+            func (callable): API call to run.
+            *args, **kwargs: Arguments of the call.
+
+        Returns:
+            The result of the call.
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not self.is_throttled(e) or attempt >= self.max_retries:
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+                attempt += 1
+                with self._lock:
+                    self._retries += 1
+                get_metrics().counter(f'api.{self.name}.throttled_retries').inc()
+                logger.warning(
+                    f'{self.name} throttled {getattr(func, "__name__", "call")}, '
+                    f'retry {attempt}/{self.max_retries} in {delay:.1f}s.'
+                )
+                time.sleep(delay)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue a call to run concurrently within the budget.
+
+        Returns:
+            Future: Future resolving to the result of the call.
+        """
+        return self._executor.submit(self.call, func, *args, **kwargs)
+
+    def remaining_budget(self):
+        """
+        Return how many calls are left in the current rolling windows.
+
+        Returns:
+            dict: Calls left this minute and today (None without a daily budget), and retries so far;
+            with a usage store, today's calls include those of the other processes.
+        """
+        now = time.monotonic()
+        with self._lock:
+            used_today = sum(1 for called_at in self._call_times if now - called_at < SECONDS_PER_DAY)
+            used_this_minute = sum(1 for called_at in self._call_times if now - called_at < SECONDS_PER_MINUTE)
+            retries = self._retries
+        if self.usage_store is not None:
+            used_today = self.usage_store.daily_usage(self.name, utc_today())
+        return {
+            'minute': max(self.requests_per_minute - used_this_minute, 0),
+            'day': max(self.requests_per_day - used_today, 0) if self.requests_per_day else None,
+            'retries': retries,
+        }
+
+    def log_budget(self):
+        budget = self.remaining_budget()
+        logger.info(
+            f"{self.name} budget left: {budget['minute']}/{self.requests_per_minute} this minute, "
+            f"{budget['day']}/{self.requests_per_day} today ({budget['retries']} throttled retries)."
+        )
+
+    def wrap(self, client, cache=None, namespace=None):
+        """
+        Wrap an API client so that every method call goes through the scheduler.
+
+        Parameters:
+            client: API client object, e.g. an alpha_vantage TimeSeries.
+            cache (ResponseCache, optional): Response cache consulted before spending any budget.
+            namespace (str, optional): Cache namespace of the client responses.
+
+        Returns:
+            ScheduledClient: Proxy exposing the client methods as scheduled calls.
+        """
+        return ScheduledClient(client, self, cache=cache, namespace=namespace)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class ScheduledClient:
+    """
+    Proxy running the methods of an API client through a RequestScheduler.
+
+    Methods are called synchronously; use submit() to queue a call and get a Future.
+    With a response cache, cached responses are returned without spending any request budget.
+    """
+
+    def __init__(self, client, scheduler, cache=None, namespace=None):
+        self._client = client
+        self._scheduler = scheduler
+        self._cache = cache
+        self._namespace = namespace or scheduler.name
+
+    def _call(self, name, *args, **kwargs):
+        method = getattr(self._client, name)
+        if self._cache is None:
+            return self._scheduler.call(method, *args, **kwargs)
+        request = {'method': name, 'args': args, 'kwargs': kwargs}
+        return self._cache.get_or_fetch(
+            self._namespace,
+            request,
+            lambda: self._scheduler.call(method, *args, **kwargs)
+        )
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        def scheduled(*args, **kwargs):
+            return self._call(name, *args, **kwargs)
+
+        scheduled.__name__ = name
+        return scheduled
+
+    def submit(self, method_name, *args, **kwargs):
+        return self._scheduler._executor.submit(self._call, method_name, *args, **kwargs)
+
+
+def utc_today():
+    """
+    Return the current UTC date in ISO format, the key of the daily request budgets.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_alpha_vantage_scheduler():
+    """
+    Return the process-wide Alpha Vantage scheduler, shared by all TimeSeries and TechIndicators clients.
+
+    Returns:
+        RequestScheduler: The shared scheduler.
+    """
+    with _schedulers_lock:
+        if 'alpha_vantage' not in _schedulers:
+            load_environment()
+            _schedulers['alpha_vantage'] = RequestScheduler(
+                name='Alpha Vantage',
+                requests_per_minute=int(
+                    os.getenv('ALPHA_VANTAGE_REQUESTS_PER_MINUTE', DEFAULT_ALPHA_VANTAGE_REQUESTS_PER_MINUTE)
+                ),
+                requests_per_day=int(os.getenv('ALPHA_VANTAGE_REQUESTS_PER_DAY', DEFAULT_ALPHA_VANTAGE_REQUESTS_PER_DAY)),
+                usage_store=get_response_cache()
+            )
+        return _schedulers['alpha_vantage']
+
+
+def get_news_api_scheduler():
+    """
+    Return the process-wide NewsAPI scheduler.
+
+    Returns:
+        RequestScheduler: The shared scheduler.
+    """
+    with _schedulers_lock:
+        if 'news_api' not in _schedulers:
+            load_environment()
+            _schedulers['news_api'] = RequestScheduler(
+                name='NewsAPI',
+                requests_per_minute=int(os.getenv('NEWS_API_REQUESTS_PER_MINUTE', DEFAULT_NEWS_API_REQUESTS_PER_MINUTE)),
+                requests_per_day=int(os.getenv('NEWS_API_REQUESTS_PER_DAY', DEFAULT_NEWS_API_REQUESTS_PER_DAY)),
+                max_workers=DEFAULT_NEWS_API_MAX_CONCURRENCY,
+                is_throttled=is_news_api_throttled,
+                usage_store=get_response_cache()
+            )
+        return _schedulers['news_api']
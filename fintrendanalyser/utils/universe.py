@@ -0,0 +1,60 @@
+from utils.constants import (
+    DB_RAW_DATA_SCHEMA,
+    DEFAULT_STOCK_SYMBOLS,
+    SYMBOL_UNIVERSE_TABLE_NAME
+)
+from utils.database import execute_select
+from utils.logging import setup_logger
+
+
+logger = setup_logger(name='symbol_universe')
+
+def read_symbols_file(path):
+    """
+    Read a symbol universe from a text or CSV file.
+
+    The file holds one symbol per line; for CSV files only the first column is used
+    and a header row named "symbol" is skipped. Blank lines and lines starting with "#" are ignored.
+
+    Parameters:
+        path (str): Path to the symbols file.
+
+    Returns:
+        list: Unique upper-cased symbols, in file order.
+    """
+    symbols = []
+    seen = set()
+    with open(path) as symbols_file:
+        for line in symbols_file:
+            symbol = line.split(',')[0].strip().upper()
+            if not symbol or symbol.startswith('#') or symbol == 'SYMBOL' or symbol in seen:
+                continue
+            seen.add(symbol)
+            symbols.append(symbol)
+    return symbols
+
+
+def load_symbol_universe(path=None, connection=None):
+    """
+    Load the list of symbols to ingest, from a file, the universe table, or the built-in default.
+
+    Parameters:
+        path (str, optional): Path to a symbols file, takes precedence over the database.
+        connection (optional): Database connection used to read the active symbols of the universe table.
+
+    Returns:
+        list: Symbols to ingest.
+    """
+    if path:
+        symbols = read_symbols_file(path)
+        logger.info(f'Loaded {len(symbols)} symbols from "{path}".')
+    elif connection is not None:
+        rows = execute_select(
+            connection,
+            f"SELECT symbol FROM {DB_RAW_DATA_SCHEMA}.{SYMBOL_UNIVERSE_TABLE_NAME} WHERE active ORDER BY symbol"
+        )
+        symbols = [row[0] for row in rows]
+        logger.info(f'Loaded {len(symbols)} symbols from the symbol universe table.')
+    else:
+        symbols = list(DEFAULT_STOCK_SYMBOLS)
+    return symbols
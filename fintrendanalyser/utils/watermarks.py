@@ -0,0 +1,57 @@
+from utils.constants import (
+    DB_PROCESSED_DATA_SCHEMA,
+    JOB_WATERMARKS_TABLE_NAME,
+    JOB_WATERMARKS_TABLE_SCHEMA,
+    JOB_WATERMARKS_TABLE_CONSTRAINTS
+)
+from utils.database import create_table_with_schema, execute_select
+
+
+WATERMARKS_TABLE_FULLNAME = f'{DB_PROCESSED_DATA_SCHEMA}.{JOB_WATERMARKS_TABLE_NAME}'
+
+def create_watermarks_table(connection):
+    create_table_with_schema(
+        connection=connection,
+        db_schema=DB_PROCESSED_DATA_SCHEMA,
+        db_table_name=JOB_WATERMARKS_TABLE_NAME,
+        db_table_schema_definition=JOB_WATERMARKS_TABLE_SCHEMA,
+        constraints=JOB_WATERMARKS_TABLE_CONSTRAINTS
+    )
+
+
+def get_job_watermark(connection, job_name):
+    """
+    Return the watermark up to which a processing job has already run.
+
+    Parameters:
+        connection: The database connection object.
+        job_name (str): Name of the processing job.
+
+    Returns:
+        datetime or None: The stored watermark, or None if the job never ran.
+    """
+    rows = execute_select(
+        connection,
+        f'SELECT watermark FROM {WATERMARKS_TABLE_FULLNAME} WHERE job_name = %s',
+        (job_name,)
+    )
+    return rows[0][0] if rows else None
+
+
+def set_job_watermark(connection, job_name, watermark):
+    """
+    Store the watermark of a processing job.
+
+    The change is not committed, so that it lands in the same transaction as the job's writes.
+
+    Parameters:
+        connection: The database connection object.
+        job_name (str): Name of the processing job.
+        watermark (datetime): New watermark.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {WATERMARKS_TABLE_FULLNAME} (job_name, watermark, updated_at) VALUES (%s, %s, NOW()) '
+            'ON CONFLICT (job_name) DO UPDATE SET watermark = EXCLUDED.watermark, updated_at = EXCLUDED.updated_at',
+            (job_name, watermark)
+        )